@@ -0,0 +1,268 @@
+import asyncio
+import functools
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+import aiohttp
+from database_init import *
+from database_init import app as flask_app
+from api_keys import *
+from geocoding import geocoding_base_url, geocoding_client, normalize_address, get_cached_address, \
+    handle_geocoding_response
+from holiday_cache import holiday_api_url
+from upstream_client import UpstreamUnavailableError
+from delivery_api import Timeslots, holiday_cache, holiday_calendar_job, holidays_cache_path, search_available_timeslots
+from holiday_calendar import get_calendar_holidays
+from metrics import metrics, span
+
+# ASGI entry point for timeslot search. Geocoding and Holiday API are accessed with an async HTTP client, so one worker
+# serves many users waiting on upstream APIs. Database access runs in a thread pool, as Flask-SQLAlchemy is sync.
+# Rate limits and circuit breakers of the sync upstream clients are shared, so both versions back off together.
+# Run with any ASGI server, e.g.: uvicorn async_timeslots:app
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message     = message
+
+
+def get_user_info(user_email):
+    # returns address string, country code and city (None if address is not resolved yet), None if user does not exist
+    user = db.session.query(UsersModel.address, UsersModel.country_code, UsersModel.address_country_code,
+                            UsersModel.address_city).filter_by(user_email=user_email).first()
+    if user is None:
+        return None
+
+    if user.address_city is None:
+        return user.address, user.country_code, None
+
+    return user.address, user.address_country_code, user.address_city
+
+
+def save_address_object(user_email, address_fields):
+    user = UsersModel.query.filter_by(user_email=user_email).first()
+    user.address_object = Address(**address_fields)
+    db.session.commit()
+
+
+def run_in_app_context(func, *args):
+    # app context removes thread's db session when func returns
+    with flask_app.app_context():
+        return func(*args)
+
+
+class AsyncTimeslotsApp:
+    path_regex = re.compile(r'^/timeslots/([^/]+)$')
+
+    def __init__(self, geocoding_timeout=5, holidays_timeout=5, db_workers=8):
+        self.geocoding_timeout = geocoding_timeout
+        self.holidays_timeout  = holidays_timeout
+        self.geocoding_url     = geocoding_base_url
+        self.holiday_api_url   = holiday_api_url
+        self.db_executor       = ThreadPoolExecutor(max_workers=db_workers)
+        self.http_session      = None
+        self.holiday_fetches   = {}    # (country_code, year) -> task, concurrent misses share one Holiday API call
+
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            return
+
+        if scope['path'] == '/metrics' and scope['method'] == 'GET':
+            await self.send_body(send, 200, metrics.render().encode(), b'text/plain; version=0.0.4')
+            return
+
+        match = self.path_regex.match(scope['path'])
+        if not match:
+            await self.send_json(send, 404, {'message': 'Not found'})
+            return
+
+        if scope['method'] != 'POST':
+            await self.send_json(send, 405, {'message': 'Method not allowed'})
+            return
+
+        # search is cancelled if client disconnects before it completes
+        search_task     = asyncio.ensure_future(self.search(unquote(match.group(1))))
+        disconnect_task = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        done, _ = await asyncio.wait({search_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        disconnect_task.cancel()
+        if search_task not in done:
+            search_task.cancel()
+            return
+
+        status_code, body = search_task.result()
+        await self.send_json(send, status_code, body)
+
+
+    async def search(self, user_email):
+        # returns http status code and response body, same responses as Timeslots.post. Upstream errors are returned
+        # with 502/503/504 status code
+        user_info = await self.run_db(get_user_info, user_email)
+        if user_info is None:
+            return 200, {'message': 'User does not exist. Please create user to see available timeslots'}
+
+        address_str, country_code, user_city = user_info
+        # accessing geocoding and holidays API is done concurrently
+        holidays_task = asyncio.ensure_future(self.get_holidays(country_code))
+        try:
+            if user_city is None:
+                status, address_fields = await self.resolve_address(address_str)
+                if status == 'OK':
+                    await self.run_db(save_address_object, user_email, address_fields)
+                    user_city = address_fields['city']
+
+                elif status == 'ZERO_RESULTS':
+                    return 200, {'message': 'Address does not exist. Please provide a valid address'}
+
+                else:
+                    return 502, {'message': 'Something went wrong'}
+
+            holidays = await holidays_task
+
+        except UpstreamError as e:
+            return e.status_code, {'message': e.message}
+
+        finally:
+            holidays_task.cancel()  # no-op if holidays were fetched
+
+        available_timeslots_list = await self.run_db(search_available_timeslots, user_city, holidays)
+        return 200, available_timeslots_list
+
+
+    async def resolve_address(self, address_str):
+        normalized_address = normalize_address(address_str)
+        cached_result = await self.run_db(get_cached_address, normalized_address)
+        if cached_result:
+            return cached_result
+
+        params = { 'key': geocoding_api_key, 'address': address_str }
+        try:
+            response = await self.get_json(self.geocoding_url, params, self.geocoding_timeout, 'Geocoding API',
+                                           geocoding_client)
+        except UpstreamError:
+            # expired cache entry is served while Geocoding API is not available, same as in sync version
+            stale_result = await self.run_db(get_cached_address, normalized_address, True)
+            if stale_result:
+                return stale_result
+            raise
+
+        return await self.run_db(handle_geocoding_response, normalized_address, response)
+
+
+    async def get_holidays(self, country_code):
+        # on Holiday API error timeslots are returned without holiday exclusion, same as in sync version
+        year = Timeslots.year_for_holiday_API
+        holidays = await self.run_db(get_calendar_holidays, country_code, year)
+        if holidays is not None:
+            return holidays
+
+        holiday_calendar_job.request_refresh(country_code)
+        holidays = await self.run_db(holiday_cache.get_cached_holidays, country_code, year)
+        if holidays is not None:
+            return holidays
+
+        key = (country_code, year)
+        fetch_task = self.holiday_fetches.get(key)
+        if fetch_task is None:
+            fetch_task = asyncio.ensure_future(self.fetch_holidays(country_code, year))
+            self.holiday_fetches[key] = fetch_task
+            fetch_task.add_done_callback(lambda _: self.holiday_fetches.pop(key, None))
+
+        try:
+            # shield - cancelling one waiting search does not cancel the fetch shared with other searches
+            return await asyncio.shield(fetch_task)
+        except UpstreamError as e:
+            logger.exception('Holiday API error, stale holidays of %s are used: %s', country_code, e.message)
+            holidays = await self.run_db(holiday_cache.get_stale_holidays, country_code, year)
+            return holidays if holidays is not None else frozenset()
+
+
+    async def fetch_holidays(self, country_code, year):
+        params = { 'key': holiday_api_key, 'country': country_code, 'year': year }
+        holidays_dict = await self.get_json(self.holiday_api_url, params, self.holidays_timeout, 'Holiday API',
+                                            holiday_cache.upstream_client)
+        try:
+            return await self.run_db(holiday_cache.add_holidays, country_code, year, holidays_dict)
+        except (KeyError, ValueError):
+            raise UpstreamError(502, 'Holiday API returned an invalid response')
+
+
+    async def get_json(self, url, params, timeout, api_name, upstream_client):
+        # single attempt, rate limit and circuit breaker of upstream_client are checked without waiting
+        if self.http_session is None:
+            self.http_session = aiohttp.ClientSession()
+
+        try:
+            upstream_client.acquire()
+        except UpstreamUnavailableError:
+            raise UpstreamError(503, '{} is not available'.format(api_name))
+
+        try:
+            with span(upstream_client.api):
+                async with self.http_session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    response.raise_for_status()
+                    response_json = await response.json(content_type=None)
+
+        except asyncio.TimeoutError:
+            upstream_client.record_failure()
+            raise UpstreamError(504, '{} timed out'.format(api_name))
+
+        except (aiohttp.ClientError, ValueError):
+            upstream_client.record_failure()
+            raise UpstreamError(502, '{} is not available'.format(api_name))
+
+        upstream_client.circuit_breaker.record_success()
+        return response_json
+
+
+    async def run_db(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.db_executor, functools.partial(run_in_app_context, func, *args))
+
+
+    async def wait_for_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                holiday_cache.open_persistence(os.path.abspath(holidays_cache_path))
+                holiday_calendar_job.start()
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                if self.http_session is not None:
+                    await self.http_session.close()
+                self.db_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+    async def send_json(self, send, status_code, body):
+        with span('serialization'):
+            body_bytes = json.dumps(body).encode()
+        await self.send_body(send, status_code, body_bytes, b'application/json')
+
+
+    async def send_body(self, send, status_code, body_bytes, content_type):
+        await send({'type': 'http.response.start', 'status': status_code,
+                    'headers': [(b'content-type', content_type),
+                                (b'content-length', str(len(body_bytes)).encode())]})
+        await send({'type': 'http.response.body', 'body': body_bytes})
+
+
+app = AsyncTimeslotsApp()
@@ -0,0 +1,270 @@
+import logging
+import threading
+import time
+from heapq import merge
+from database_init import *
+from interval_tree import IntervalTree
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CourierDateRecord:
+    # remaining capacity of a courier's day, shared by all timeslots of that day. version is the index sequence number
+    # of the last booking or cancellation applied to the record
+    __slots__ = ('courier_id', 'date', 'num_of_remaining_deliveries', 'version')
+
+    def __init__(self, courier_id, date, num_of_remaining_deliveries):
+        self.courier_id                  = courier_id
+        self.date                        = date
+        self.num_of_remaining_deliveries = num_of_remaining_deliveries
+        self.version                     = 0
+
+
+class TimeslotRecord:
+    __slots__ = ('timeslot_id', 'courier_date', 'num_of_scheduled_deliveries', 'status', 'timeslot_entry', 'version')
+
+    def __init__(self, timeslot_id, courier_date, num_of_scheduled_deliveries, status, timeslot_entry):
+        self.timeslot_id                 = timeslot_id
+        self.courier_date                = courier_date
+        self.num_of_scheduled_deliveries = num_of_scheduled_deliveries
+        self.status                      = status
+        self.timeslot_entry              = timeslot_entry  # response entry is formatted once, when index is built
+        self.version                     = 0               # same as CourierDateRecord.version
+
+    def is_available(self):
+        return self.status == TimeslotsModel.available and self.courier_date.num_of_remaining_deliveries > 0
+
+
+class AvailabilityIndex:
+    # in-process availability index - timeslot records bucketed by city and date, built once from the database and
+    # updated incrementally by bookings and cancellations of this process. Timeslot search is answered from memory.
+    # Changes made by other processes are not seen until refresh reloads the records that differ from the database
+    # (AvailabilityIndexRefreshJob), bookings are checked against the database whatever the index says.
+    # Build and refresh read the database without holding the lock. Every applied booking and cancellation increases
+    # sequence and stamps its records with it, records stamped after the read started are not overwritten by the read
+    # (it may or may not include the change). A change committed before the read and applied after the records were
+    # replaced is counted twice until the next refresh, the window is the time between commit and apply
+    def __init__(self):
+        self.is_built       = False
+        self.timeslots      = {}    # timeslot_id -> TimeslotRecord
+        self.city_buckets   = {}    # city -> date -> list of TimeslotRecord sorted by timeslot_id
+        self.courier_dates  = {}    # (courier_id, date) -> CourierDateRecord
+        # city -> IntervalTree of the city's TimeslotRecords by start and end time, None -> tree of all timeslots.
+        # Timeslot times never change, trees are rebuilt with the index (after courier files are loaded)
+        self.interval_trees = {}
+        self.sequence       = 0
+        self._lock          = threading.Lock()
+
+
+    def build(self):
+        # loads all timeslots, cities and courier dates with three queries, the new index replaces the old one at once.
+        # Changes applied while building went to the old records, counters of the new records are reloaded then
+        with self._lock:
+            start_sequence = self.sequence
+        couriers_table        = CouriersModel.__table__
+        timeslots_table       = TimeslotsModel.__table__
+        timeslot_cities_table = TimeslotCitiesModel.__table__
+        courier_dates = {}
+        for courier_id, date, num_of_remaining_deliveries in db.session.execute(
+                db.select([couriers_table.c.courier_id, couriers_table.c.date,
+                           couriers_table.c.num_of_remaining_deliveries])):
+            courier_dates[(courier_id, date)] = CourierDateRecord(courier_id, date, num_of_remaining_deliveries)
+
+        timeslots, intervals = {}, {}
+        for timeslot_id, courier_id, date, start_time, end_time, num_of_scheduled_deliveries, status in db.session.execute(
+                db.select([timeslots_table.c.timeslot_id, timeslots_table.c.courier_id, timeslots_table.c.date,
+                           timeslots_table.c.start_time, timeslots_table.c.end_time,
+                           timeslots_table.c.num_of_scheduled_deliveries, timeslots_table.c.status])):
+            courier_date = courier_dates.get((courier_id, date))
+            if courier_date is None:    # timeslot without courier date is never available
+                courier_date = CourierDateRecord(courier_id, date, 0)
+            timeslot_entry = format_timeslot_entry(timeslot_id, start_time, end_time)
+            timeslots[timeslot_id] = TimeslotRecord(timeslot_id, courier_date, num_of_scheduled_deliveries, status,
+                                                    timeslot_entry)
+            intervals[timeslot_id] = (start_time, end_time, timeslots[timeslot_id])
+
+        city_buckets, timeslot_cities = {}, {}
+        for city, timeslot_id in db.session.execute(
+                db.select([timeslot_cities_table.c.city, timeslot_cities_table.c.timeslot_id])):
+            timeslot = timeslots.get(timeslot_id)
+            if timeslot is not None:
+                city_buckets.setdefault(city, {}).setdefault(timeslot.courier_date.date, []).append(timeslot)
+                timeslot_cities.setdefault(timeslot_id, []).append(city)
+        for date_buckets in city_buckets.values():
+            for bucket in date_buckets.values():
+                bucket.sort(key=lambda timeslot: timeslot.timeslot_id)
+
+        # intervals are sorted once (timeslots with the same times by timeslot_id), trees of cities get them in order
+        sorted_intervals = sorted(intervals.values(), key=lambda interval: (interval[0], interval[1],
+                                                                            interval[2].timeslot_id))
+        city_intervals = {}
+        for interval in sorted_intervals:
+            for city in timeslot_cities.get(interval[2].timeslot_id, ()):
+                city_intervals.setdefault(city, []).append(interval)
+        interval_trees = {city: IntervalTree(city_intervals_list) for city, city_intervals_list in city_intervals.items()}
+        interval_trees[None] = IntervalTree(sorted_intervals)
+
+        with self._lock:
+            self.timeslots, self.city_buckets, self.courier_dates = timeslots, city_buckets, courier_dates
+            self.interval_trees = interval_trees
+            self.is_built = True
+            is_changed_while_building = self.sequence != start_sequence
+        if is_changed_while_building:
+            self.refresh()
+
+
+    def search(self, city, holidays):
+        # returns available timeslot entries for city ordered by timeslot_id, timeslots on holidays are skipped
+        date_buckets = self.city_buckets.get(city, {})
+        available_buckets = [[timeslot for timeslot in bucket if timeslot.is_available()]
+                             for date, bucket in date_buckets.items() if date.date() not in holidays]
+        timeslots = merge(*available_buckets, key=lambda timeslot: timeslot.timeslot_id)
+        return [timeslot.timeslot_entry for timeslot in timeslots]
+
+
+    def search_overlapping(self, range_start, range_end, min_overlap, city=None):
+        # returns available timeslot entries that overlap [range_start, range_end) by at least min_overlap (timedelta),
+        # ordered by start time. Timeslots of all cities are searched if city is None
+        interval_tree = self.interval_trees.get(city)
+        if interval_tree is None:
+            return []
+
+        return [timeslot.timeslot_entry
+                for start_time, end_time, timeslot in interval_tree.overlapping(range_start, range_end)
+                if timeslot.is_available() and min(end_time, range_end) - max(start_time, range_start) >= min_overlap]
+
+
+    def apply_booking(self, timeslot_id):
+        # mirrors book_timeslot after it was committed
+        with self._lock:
+            timeslot = self.timeslots.get(timeslot_id)
+            if timeslot is None:
+                return
+
+            self._stamp(timeslot)
+            timeslot.num_of_scheduled_deliveries += 1
+            if timeslot.num_of_scheduled_deliveries >= TimeslotsModel.max_num_of_deliveries:
+                timeslot.status = TimeslotsModel.not_available
+            timeslot.courier_date.num_of_remaining_deliveries -= 1
+
+
+    def apply_cancellation(self, timeslot_id):
+        # mirrors cancel_delivery after it was committed
+        with self._lock:
+            timeslot = self.timeslots.get(timeslot_id)
+            if timeslot is None:
+                return
+
+            self._stamp(timeslot)
+            if timeslot.num_of_scheduled_deliveries > 0:
+                timeslot.num_of_scheduled_deliveries -= 1
+                timeslot.status = TimeslotsModel.available
+            if timeslot.courier_date.num_of_remaining_deliveries < CouriersModel.max_num_of_remaining_deliveries_var:
+                timeslot.courier_date.num_of_remaining_deliveries += 1
+
+
+    def refresh(self):
+        # reloads counters and status of records that differ from the database (changed by other processes), the index
+        # is rebuilt if timeslots were added or removed. Records changed by this process while the database was read
+        # are skipped. Returns num of reloaded timeslot and courier date records
+        with self._lock:
+            start_sequence = self.sequence
+        db_timeslots, db_courier_dates = self._load_counters()
+        if db_timeslots.keys() != self.timeslots.keys() or db_courier_dates.keys() - self.courier_dates.keys():
+            self.build()
+            return len(db_timeslots)
+
+        num_of_reloaded_records = 0
+        with self._lock:
+            for timeslot_id, (num_of_scheduled_deliveries, status) in db_timeslots.items():
+                timeslot = self.timeslots[timeslot_id]
+                if timeslot.version > start_sequence:
+                    continue
+
+                if (timeslot.num_of_scheduled_deliveries, timeslot.status) != (num_of_scheduled_deliveries, status):
+                    timeslot.num_of_scheduled_deliveries, timeslot.status = num_of_scheduled_deliveries, status
+                    num_of_reloaded_records += 1
+            for key, courier_date in self.courier_dates.items():
+                num_of_remaining_deliveries = db_courier_dates.get(key, 0)
+                if courier_date.version > start_sequence:
+                    continue
+
+                if courier_date.num_of_remaining_deliveries != num_of_remaining_deliveries:
+                    courier_date.num_of_remaining_deliveries = num_of_remaining_deliveries
+                    num_of_reloaded_records += 1
+
+        return num_of_reloaded_records
+
+
+    def _stamp(self, timeslot):
+        # called with the lock held
+        self.sequence += 1
+        timeslot.version = timeslot.courier_date.version = self.sequence
+
+
+    def check_consistency(self):
+        # returns list of timeslot ids whose counters or status differ from the database
+        db_timeslots, db_courier_dates = self._load_counters()
+        inconsistent_timeslot_ids = [timeslot_id for timeslot_id, counters in db_timeslots.items()
+                                     if timeslot_id not in self.timeslots or counters != (
+                                         self.timeslots[timeslot_id].num_of_scheduled_deliveries,
+                                         self.timeslots[timeslot_id].status)]
+        inconsistent_timeslot_ids += [timeslot_id for timeslot_id in self.timeslots if timeslot_id not in db_timeslots]
+        for timeslot in self.timeslots.values():
+            courier_date = timeslot.courier_date
+            if db_courier_dates.get((courier_date.courier_id, courier_date.date), 0) \
+                    != courier_date.num_of_remaining_deliveries:
+                inconsistent_timeslot_ids.append(timeslot.timeslot_id)
+
+        return sorted(set(inconsistent_timeslot_ids))
+
+
+    def _load_counters(self):
+        # returns timeslot_id -> (num_of_scheduled_deliveries, status) and (courier_id, date) -> remaining deliveries
+        timeslots_table = TimeslotsModel.__table__
+        couriers_table  = CouriersModel.__table__
+        db_timeslots = {timeslot_id: (num_of_scheduled_deliveries, status)
+                        for timeslot_id, num_of_scheduled_deliveries, status in db.session.execute(
+                            db.select([timeslots_table.c.timeslot_id, timeslots_table.c.num_of_scheduled_deliveries,
+                                       timeslots_table.c.status]))}
+        db_courier_dates = {(courier_id, date): num_of_remaining_deliveries
+                            for courier_id, date, num_of_remaining_deliveries in db.session.execute(
+                                db.select([couriers_table.c.courier_id, couriers_table.c.date,
+                                           couriers_table.c.num_of_remaining_deliveries]))}
+        return db_timeslots, db_courier_dates
+
+
+class AvailabilityIndexRefreshJob:
+    # background job that refreshes the availability index every refresh_interval_seconds, so timeslot search of a
+    # process sees bookings and cancellations of other processes (and courier files they loaded) within that time
+    def __init__(self, availability_index, refresh_interval_seconds):
+        self.availability_index       = availability_index
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._lock                    = threading.Lock()
+        self._thread                  = None
+
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval_seconds)
+            try:
+                with app.app_context():
+                    metrics.increment('availability_index_reloaded_records_total',
+                                      self.availability_index.refresh())
+            except Exception:
+                logger.exception('Availability index refresh failed')
+
+
+def format_timeslot_entry(timeslot_id, start_time, end_time):
+    start_time_str  = start_time.strftime('%d/%m/%Y, %H:%M')
+    end_time_str    = end_time.strftime('%d/%m/%Y, %H:%M')
+    timeslot_string = '{}-{}'.format(start_time_str, end_time_str)
+    return (str(timeslot_id), timeslot_string)
@@ -0,0 +1,461 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs, urlencode
+from werkzeug.serving import make_server, WSGIRequestHandler
+from create_courier_json_file import create_synthetic_couriers_file, get_city_weights
+
+# benchmark harness - generates synthetic couriers and users, then drives every resource of delivery_api through the
+# Flask test client and through a real WSGI server (werkzeug, threaded). Geocoding and Holiday API are replaced by a
+# local HTTP stub, which can inject upstream failures (503 responses, hanging calls). Results (throughput, p50/p95/p99
+# latency, SQL queries per request, upstream calls) are printed as JSON. With --search-load, sync (WSGI) and async
+# (async_timeslots, served by uvicorn) timeslot search are compared under concurrent searches and bookings.
+# Usage: python benchmark.py --couriers 200 --days 30 --cities 50 --users 500 --requests 300 --output results.json
+#        python benchmark.py --upstream-error-rate 0.2 --upstream-hang-rate 0.1 --transport wsgi
+#        python benchmark.py --search-load --search-clients 64 --upstream-latency-ms 200
+start_date    = datetime(2021, 7, 17)
+stub_holidays = ['2021-07-18', '2021-08-15']
+batch_size    = 20
+percentiles   = (50, 95, 99)
+# a hanging upstream call is answered after upstream_hang_seconds, longer than any upstream client timeout
+upstream_hang_seconds = 10
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UpstreamStubHandler(BaseHTTPRequestHandler):
+    # answers like Geocoding API (/geocode/json, address is "<street> <home_num>, <city>") and Holiday API
+    # (/v1/holidays). A call fails with 503 with probability error_rate and hangs with probability hang_rate, every
+    # call is answered after latency_seconds
+    error_rate      = 0
+    hang_rate       = 0
+    latency_seconds = 0
+    rnd             = random.Random(0)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        time.sleep(self.latency_seconds)
+        fault = self.rnd.random()
+        if fault < self.hang_rate:
+            time.sleep(upstream_hang_seconds)
+        elif fault < self.hang_rate + self.error_rate:
+            self.send_json(503, {'status': 'UNKNOWN_ERROR'})
+            return
+
+        if url.path == '/v1/holidays':
+            self.send_json(200, {'holidays': [{'date': date_str} for date_str in stub_holidays]})
+            return
+
+        address_str = parse_qs(url.query)['address'][0]
+        street_and_num, city = address_str.rsplit(', ', 1)
+        street, home_num = street_and_num.rsplit(' ', 1)
+        address_components = [{'types': ['street_number'], 'long_name': home_num, 'short_name': home_num},
+                              {'types': ['route'], 'long_name': street, 'short_name': street},
+                              {'types': ['locality'], 'long_name': city, 'short_name': city},
+                              {'types': ['country'], 'long_name': 'Israel', 'short_name': 'IL'}]
+        self.send_json(200, {'status': 'OK', 'results': [{'address_components': address_components}]})
+
+    def send_json(self, status_code, body_dict):
+        body = json.dumps(body_dict).encode()
+        try:
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:     # client timed out and closed the connection
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def start_in_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestClientTransport:
+    # requests through Flask test client, in the calling thread
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json_body=None, headers=None):
+        response = self.client.open(path, method=method, json=json_body, headers=headers)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+
+class HttpTransport:
+    # requests to a real WSGI server, a requests session per client thread
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.local    = threading.local()
+        self.requests = requests
+
+    def request(self, method, path, json_body=None, headers=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.request(method, self.base_url + path, json=json_body, headers=headers)
+        return response.status_code, response.content
+
+
+class AsgiServerThread:
+    # serves an ASGI app with uvicorn, in a thread with its own event loop. Lifespan events are not sent - the harness
+    # opens holidays cache persistence itself and does not start background jobs. HTTP session of the app is closed
+    # on shutdown, as the event loop it was created in is closed
+    def __init__(self, asgi_app):
+        import uvicorn
+        self.asgi_app = asgi_app
+        self.socket   = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.server_port = self.socket.getsockname()[1]
+        self.server   = uvicorn.Server(uvicorn.Config(asgi_app, lifespan='off', log_level='warning', access_log=False))
+        self.thread   = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError('ASGI server did not start')
+            time.sleep(0.01)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.server.serve(sockets=[self.socket]))
+            if self.asgi_app.http_session is not None:
+                loop.run_until_complete(self.asgi_app.http_session.close())
+                self.asgi_app.http_session = None
+        finally:
+            loop.close()
+
+    def shutdown(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def get_query_count(metrics_registry, endpoint):
+    # (sum, count) of db_queries_per_request histogram of endpoint
+    histogram = metrics_registry.histograms.get(('db_queries_per_request', (('endpoint', endpoint),)))
+    return (histogram.sum, histogram.count) if histogram else (0, 0)
+
+
+def get_upstream_counts(metrics_registry):
+    # upstream_* counters by name and labels, e.g. 'upstream_rejected_total{api=geocode,reason=circuit_open}'
+    return {'{}{{{}}}'.format(name, ','.join('{}={}'.format(*label) for label in labels)): value
+            for (name, labels), value in sorted(metrics_registry.counters.items()) if name.startswith('upstream_')}
+
+
+def run_scenario(transport, requests_list, num_of_threads, metrics_registry, endpoint):
+    # runs list of (method, path, json_body) or (method, path, json_body, headers), returns stats and list of
+    # (request, status_code, body)
+    queries_before = get_query_count(metrics_registry, endpoint)
+
+    def timed_request(request):
+        request_start_time = time.perf_counter()
+        status_code, body = transport.request(*request)
+        return time.perf_counter() - request_start_time, request, status_code, body
+
+    scenario_start_time = time.perf_counter()
+    if num_of_threads == 1:
+        results = [timed_request(request) for request in requests_list]
+    else:
+        with ThreadPoolExecutor(max_workers=num_of_threads) as executor:
+            results = list(executor.map(timed_request, requests_list))
+    duration = time.perf_counter() - scenario_start_time
+
+    queries_after = get_query_count(metrics_registry, endpoint)
+    num_of_queries, num_of_counted_requests = (queries_after[0] - queries_before[0], queries_after[1] - queries_before[1])
+    latencies = sorted(latency for latency, _, _, _ in results)
+    stats = {'requests': len(results), 'seconds': round(duration, 3),
+             'throughput_rps': round(len(results) / duration, 1) if duration else None,
+             'errors': sum(1 for _, _, status_code, _ in results if status_code >= 400),
+             'queries_per_request': round(num_of_queries / num_of_counted_requests, 2) if num_of_counted_requests else None}
+    for percentile in percentiles:
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        stats['p{}_ms'.format(percentile)] = round(latencies[index] * 1000, 2) if latencies else None
+    return stats, [(request, status_code, body) for _, request, status_code, body in results]
+
+
+def create_range_search_path(range_start, range_length, city):
+    params = {'start': range_start.strftime('%d/%m/%Y, %H:%M'),
+              'end': (range_start + range_length).strftime('%d/%m/%Y, %H:%M')}
+    if city is not None:
+        params['city'] = city
+    return '/timeslots/search?' + urlencode(params)
+
+
+def run_benchmark(delivery_api, transport, args, city_names, rnd):
+    # runs all scenarios in order, later scenarios use users, timeslots and deliveries created by earlier ones
+    metrics_registry = delivery_api.metrics
+    results = {}
+
+    def scenario(name, endpoint, requests_list, num_of_threads=args.threads):
+        stats, responses = run_scenario(transport, requests_list, num_of_threads, metrics_registry, endpoint)
+        results[name] = stats
+        return responses
+
+    city_weights = get_city_weights(len(city_names), args.skew)
+    users = ['user{}@example.com'.format(user_num) for user_num in range(args.users)]
+    scenario('create_user', 'user', [
+        ('POST', '/create-user/Herzl {}, {}/IL/user{}/{}'.format(user_num + 1, rnd.choices(city_names, city_weights)[0],
+                                                                  user_num, user_email), None)
+        for user_num, user_email in enumerate(users)])
+    delivery_api.holiday_calendar_job.refresh()     # background job is not started by the harness
+
+    resolved_users = users[:len(users) // 2]    # other half is resolved by the first timeslot search
+    scenario('resolve_address', 'resolveaddress', [('POST', '/resolve-address/' + user_email, None)
+                                                   for user_email in resolved_users])
+
+    responses = scenario('search_timeslots', 'timeslots', [('POST', '/timeslots/' + rnd.choice(users), None)
+                                                           for _ in range(args.requests)])
+    available_timeslots = [(request[1].rsplit('/', 1)[1], timeslot_entry[0]) for request, status_code, body in responses
+                           if status_code == 200 for timeslot_entry in json.loads(body) if isinstance(timeslot_entry, list)]
+    rnd.shuffle(available_timeslots)
+    bookings = available_timeslots[:args.requests]
+
+    # timeslots overlapping 13:00-15:00 of a day, half of the searches are limited to a city
+    scenario('search_overlapping_timeslots', 'timeslotssearch', [
+        ('GET', create_range_search_path(start_date + timedelta(days=rnd.randrange(args.days), hours=13),
+                                         timedelta(hours=2), rnd.choice(city_names) if rnd.random() < 0.5 else None),
+         None) for _ in range(args.requests)])
+
+    scenario('book_delivery', 'deliverybooking', [('POST', '/deliveries/{}/{}'.format(user_email, timeslot_id), None)
+                                                  for user_email, timeslot_id in bookings])
+    batch_bookings = available_timeslots[args.requests:args.requests * 2]
+    scenario('book_deliveries_batch', 'deliveriesbatch', [
+        ('POST', '/deliveries/batch', [{'user_email': user_email, 'timeslot_id': int(timeslot_id)}
+                                       for user_email, timeslot_id in batch_bookings[i:i + batch_size]])
+        for i in range(0, len(batch_bookings), batch_size)])
+
+    # delivery requests of users with resolved addresses, each with a morning window and a window on the next day
+    def create_preferred_windows(day_start):
+        return [[(day_start + timedelta(hours=8)).strftime('%d/%m/%Y, %H:%M'),
+                 (day_start + timedelta(hours=12)).strftime('%d/%m/%Y, %H:%M')],
+                [(day_start + timedelta(days=1, hours=12)).strftime('%d/%m/%Y, %H:%M'),
+                 (day_start + timedelta(days=1, hours=18)).strftime('%d/%m/%Y, %H:%M')]]
+    delivery_requests = [{'user_email': rnd.choice(resolved_users), 'preferred_windows': create_preferred_windows(
+                              start_date + timedelta(days=rnd.randrange(args.days)))} for _ in range(args.requests)]
+    scenario('assign_deliveries_batch', 'deliveriesassignment', [
+        ('POST', '/deliveries/batch/assign', delivery_requests[i:i + batch_size])
+        for i in range(0, len(delivery_requests), batch_size)])
+
+    # manifests of booked courier days, then the same manifests requested with their ETag (304 Not Modified)
+    with delivery_api.app.app_context():
+        manifests = delivery_api.db.session.query(delivery_api.CourierManifestsModel.courier_id,
+                                                  delivery_api.CourierManifestsModel.date,
+                                                  delivery_api.CourierManifestsModel.version).all()
+    manifest_requests = [rnd.choice(manifests) for _ in range(args.requests)] if manifests else []
+    scenario('courier_manifest', 'couriermanifest', [
+        ('GET', '/couriers/{}/manifest/{}'.format(courier_id, date.strftime('%d-%m-%Y')), None)
+        for courier_id, date, _ in manifest_requests])
+    scenario('courier_manifest_not_modified', 'couriermanifest', [
+        ('GET', '/couriers/{}/manifest/{}'.format(courier_id, date.strftime('%d-%m-%Y')), None,
+         {'If-None-Match': '"{}"'.format(delivery_api.get_manifest_etag(courier_id, date, version))})
+        for courier_id, date, version in manifest_requests])
+
+    window_dates = [(start_date + timedelta(days=day_num)).strftime('%d/%m/%Y') for day_num in range(args.days)]
+    scenario('daily_deliveries', 'deliveries', [('GET', '/deliveries/daily?date=' + rnd.choice(window_dates), None)
+                                                for _ in range(args.requests)])
+    scenario('weekly_deliveries', 'weeklydeliveries', [('GET', '/deliveries/weekly?date=' + rnd.choice(window_dates), None)
+                                                       for _ in range(args.requests)])
+    scenario('weekly_deliveries_page', 'weeklydeliveries', [
+        ('GET', '/deliveries/weekly?limit=100&num_of_days={}&date={}'.format(args.days, window_dates[0]), None)
+        for _ in range(args.requests)])
+
+    with delivery_api.app.app_context():
+        deliveries = delivery_api.db.session.query(delivery_api.DeliveriesModel.delivery_id,
+                                                   delivery_api.DeliveriesModel.user_email).all()
+    rnd.shuffle(deliveries)
+    num_of_deliveries = len(deliveries)
+    completed, cancelled, batch_cancelled = (deliveries[:num_of_deliveries // 3],
+                                             deliveries[num_of_deliveries // 3:2 * num_of_deliveries // 3],
+                                             deliveries[2 * num_of_deliveries // 3:])
+    scenario('complete_delivery', 'deliveries', [('POST', '/deliveries/{}/{}/completed'.format(user_email, delivery_id),
+                                                  None) for delivery_id, user_email in completed])
+    scenario('cancel_delivery', 'deliveries', [('DELETE', '/deliveries/{}/{}'.format(user_email, delivery_id), None)
+                                               for delivery_id, user_email in cancelled])
+    scenario('cancel_deliveries_batch', 'deliveriesbatch', [
+        ('DELETE', '/deliveries/batch', [delivery_id for delivery_id, _ in batch_cancelled[i:i + batch_size]])
+        for i in range(0, len(batch_cancelled), batch_size)])
+    scenario('metrics', 'metrics', [('GET', '/metrics', None) for _ in range(min(args.requests, 50))])
+    return results
+
+
+def run_search_load(delivery_api, search_transport, booking_transport, args, city_names, rnd):
+    # searches run concurrently with bookings - half of the users have unresolved addresses, so their first search
+    # waits on Geocoding API, the other half books available timeslots. Users are created and resolved before the
+    # measured scenarios, holiday calendar is refreshed so both search paths read holidays from the database
+    metrics_registry = delivery_api.metrics
+    city_weights = get_city_weights(len(city_names), args.skew)
+    users = ['user{}@example.com'.format(user_num) for user_num in range(args.users)]
+    run_scenario(booking_transport, [
+        ('POST', '/create-user/Herzl {}, {}/IL/user{}/{}'.format(user_num + 1, rnd.choices(city_names, city_weights)[0],
+                                                                  user_num, user_email), None)
+        for user_num, user_email in enumerate(users)], args.threads, metrics_registry, 'user')
+    delivery_api.holiday_calendar_job.refresh()
+    booking_users, searching_users = users[:len(users) // 2], users[len(users) // 2:]
+    run_scenario(booking_transport, [('POST', '/resolve-address/' + user_email, None) for user_email in booking_users],
+                 args.threads, metrics_registry, 'resolveaddress')
+
+    with delivery_api.app.app_context():
+        timeslot_ids = [timeslot_id for timeslot_id, in delivery_api.db.session.query(
+            delivery_api.TimeslotsModel.timeslot_id).filter_by(status=delivery_api.TimeslotsModel.available)]
+    booking_requests = [('POST', '/deliveries/{}/{}'.format(rnd.choice(booking_users), timeslot_id), None)
+                        for timeslot_id in rnd.sample(timeslot_ids, min(args.requests, len(timeslot_ids)))]
+    search_requests  = [('POST', '/timeslots/' + searching_users[request_num % len(searching_users)], None)
+                        for request_num in range(args.requests)]
+
+    booking_results = {}
+    def book():
+        booking_results['book_delivery'] = run_scenario(booking_transport, booking_requests, args.threads,
+                                                        metrics_registry, 'deliverybooking')[0]
+    booking_thread = threading.Thread(target=book)
+    booking_thread.start()
+    search_stats = run_scenario(search_transport, search_requests, args.search_clients, metrics_registry, 'timeslots')[0]
+    booking_thread.join()
+    return dict(search_timeslots=search_stats, **booking_results)
+
+
+def prepare_database(delivery_api, database_path, couriers_file, use_availability_index):
+    delivery_api.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database_path
+    with delivery_api.app.app_context():
+        delivery_api.db.create_all()
+        load_start_time = time.perf_counter()
+        delivery_api.load_courier_timeslots(couriers_file)
+        load_seconds = time.perf_counter() - load_start_time
+        delivery_api.availability_index.__init__()
+        if use_availability_index:
+            delivery_api.availability_index.build()
+        num_of_timeslots = delivery_api.TimeslotsModel.query.count()
+    return {'load_seconds': round(load_seconds, 3), 'num_of_timeslots': num_of_timeslots}
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark delivery API with synthetic data')
+    parser.add_argument('--couriers', type=int, default=200)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--skew', type=float, default=1.0)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=300, help='requests per scenario')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent clients of WSGI server')
+    parser.add_argument('--transport', choices=['test_client', 'wsgi', 'both'], default='both')
+    parser.add_argument('--no-availability-index', action='store_true', help='search timeslots in the database')
+    parser.add_argument('--upstream-error-rate', type=float, default=0, help='fraction of upstream calls failing with 503')
+    parser.add_argument('--upstream-hang-rate', type=float, default=0, help='fraction of upstream calls that hang')
+    parser.add_argument('--upstream-latency-ms', type=float, default=0, help='response time of every upstream call')
+    parser.add_argument('--search-load', action='store_true',
+                        help='compare sync and async timeslot search under concurrent searches and bookings')
+    parser.add_argument('--search-clients', type=int, default=32, help='concurrent search clients of search load')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON results file, printed to stdout if not set')
+    args = parser.parse_args()
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    # database, holidays cache and generated data are kept in a temporary directory
+    work_dir = tempfile.mkdtemp(prefix='delivery_api_benchmark_')
+    os.chdir(work_dir)
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(work_dir, 'database.db')
+    couriers_file = os.path.join(work_dir, 'couriers.jsonl')
+    city_names = create_synthetic_couriers_file(couriers_file, args.couriers, args.days, args.cities, args.skew,
+                                                start_date, args.seed)
+
+    UpstreamStubHandler.error_rate, UpstreamStubHandler.hang_rate = args.upstream_error_rate, args.upstream_hang_rate
+    UpstreamStubHandler.latency_seconds = args.upstream_latency_ms / 1000
+    upstream_stub = start_in_thread(ThreadingHTTPServer(('127.0.0.1', 0), UpstreamStubHandler))
+    import delivery_api
+    import geocoding
+    from holiday_cache import HolidayApiClient
+    stub_url = 'http://127.0.0.1:{}'.format(upstream_stub.server_port)
+    geocoding.geocoding_base_url = stub_url + '/geocode/json?'
+    delivery_api.holiday_cache.client_factory = lambda: HolidayApiClient(base_url=stub_url + '/v1/holidays?')
+    delivery_api.holiday_cache.open_persistence(os.path.join(work_dir, 'holidays_cache.db'))
+
+    report = {'commit': get_git_commit(), 'python': sys.version.split()[0],
+              'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'results': {}}
+    transports = ['test_client', 'wsgi'] if args.transport == 'both' else [args.transport]
+    for transport_name in transports:
+        database_path = os.path.join(work_dir, '{}.db'.format(transport_name))
+        data_info = prepare_database(delivery_api, database_path, couriers_file, not args.no_availability_index)
+        delivery_api.holiday_cache.clear()
+        if transport_name == 'test_client':
+            transport, num_of_threads = TestClientTransport(delivery_api.app), 1
+        else:
+            wsgi_server = start_in_thread(make_server('127.0.0.1', 0, delivery_api.app, threaded=True,
+                                                      request_handler=QuietWSGIRequestHandler))
+            transport, num_of_threads = HttpTransport('http://127.0.0.1:{}'.format(wsgi_server.server_port)), args.threads
+
+        run_args = argparse.Namespace(**dict(vars(args), threads=num_of_threads))
+        results = run_benchmark(delivery_api, transport, run_args, city_names, random.Random(args.seed))
+        report['results'][transport_name] = dict(data_info, threads=num_of_threads, scenarios=results,
+                                                 upstream=get_upstream_counts(delivery_api.metrics))
+        if transport_name == 'wsgi':
+            wsgi_server.shutdown()
+
+    if args.search_load:
+        import async_timeslots
+        async_timeslots.app.geocoding_url   = stub_url + '/geocode/json?'
+        async_timeslots.app.holiday_api_url = stub_url + '/v1/holidays?'
+        report['search_load'] = {}
+        for search_path in ['sync', 'async']:
+            database_path = os.path.join(work_dir, 'search_load_{}.db'.format(search_path))
+            data_info = prepare_database(delivery_api, database_path, couriers_file, not args.no_availability_index)
+            delivery_api.holiday_cache.clear()
+            wsgi_server = start_in_thread(make_server('127.0.0.1', 0, delivery_api.app, threaded=True,
+                                                      request_handler=QuietWSGIRequestHandler))
+            wsgi_url = 'http://127.0.0.1:{}'.format(wsgi_server.server_port)
+            if search_path == 'sync':
+                asgi_server, search_url = None, wsgi_url
+            else:
+                asgi_server = AsgiServerThread(async_timeslots.app)
+                search_url  = 'http://127.0.0.1:{}'.format(asgi_server.server_port)
+
+            results = run_search_load(delivery_api, HttpTransport(search_url), HttpTransport(wsgi_url), args,
+                                      city_names, random.Random(args.seed))
+            report['search_load'][search_path] = dict(data_info, search_clients=args.search_clients,
+                                                      booking_threads=args.threads, scenarios=results)
+            if asgi_server is not None:
+                asgi_server.shutdown()
+            wsgi_server.shutdown()
+
+    report_json = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w') as f:
+            f.write(report_json)
+    print(report_json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+from itertools import chain
+from database_init import *
+
+
+def update_courier_manifests(booked_deliveries=(), completed_deliveries=(), cancelled_deliveries=()):
+    # incremental update of courier manifests, runs in the transaction that changed the deliveries. Manifest rows are
+    # read FOR UPDATE, a new manifest is only created by a booking, which already holds the courier day row lock.
+    # booked_deliveries - list of (courier_id, date, start_time, delivery_id),
+    # completed_deliveries - list of (courier_id, date, delivery_id) that changed from scheduled to completed,
+    # cancelled_deliveries - list of (courier_id, date, delivery_id, status). Caller commits
+    manifest_keys = {(courier_id, date) for courier_id, date, *_ in
+                     chain(booked_deliveries, completed_deliveries, cancelled_deliveries)}
+    manifests, entries = get_courier_manifests(manifest_keys), {}
+    for courier_id, date in manifest_keys:
+        manifest = manifests.get((courier_id, date))
+        if manifest is None:
+            manifest = manifests[(courier_id, date)] = CourierManifestsModel(
+                courier_id=courier_id, date=date, num_of_scheduled_deliveries=0, num_of_completed_deliveries=0,
+                deliveries='[]', version=0)
+            db.session.add(manifest)
+        manifest.version += 1
+        entries[(courier_id, date)] = json.loads(manifest.deliveries)
+
+    for courier_id, date, start_time, delivery_id in booked_deliveries:
+        manifests[(courier_id, date)].num_of_scheduled_deliveries += 1
+        entries[(courier_id, date)].append(create_manifest_entry(start_time, delivery_id))
+
+    for courier_id, date, delivery_id in completed_deliveries:
+        manifests[(courier_id, date)].num_of_scheduled_deliveries -= 1
+        manifests[(courier_id, date)].num_of_completed_deliveries += 1
+
+    cancelled_delivery_ids = set()
+    for courier_id, date, delivery_id, status in cancelled_deliveries:
+        cancelled_delivery_ids.add(delivery_id)
+        if status == DeliveriesModel.completed:
+            manifests[(courier_id, date)].num_of_completed_deliveries -= 1
+        else:
+            manifests[(courier_id, date)].num_of_scheduled_deliveries -= 1
+
+    for key, manifest_entries in entries.items():
+        manifests[key].deliveries = json.dumps(sorted(entry for entry in manifest_entries
+                                                      if entry[1] not in cancelled_delivery_ids))
+
+
+def get_courier_manifests(manifest_keys):
+    # returns dict of (courier_id, date) -> CourierManifestsModel of existing manifests, a single courier day is a
+    # primary key lookup, batches are read by courier ids and date range. Rows are locked (no-op on SQLite, where
+    # writers are serialized anyway)
+    if len(manifest_keys) == 1:
+        courier_id, date = next(iter(manifest_keys))
+        manifest = CourierManifestsModel.query.filter_by(courier_id=courier_id, date=date).with_for_update().first()
+        return {(manifest.courier_id, manifest.date): manifest} if manifest else {}
+
+    manifests = {}
+    courier_ids = list({courier_id for courier_id, _ in manifest_keys})
+    dates       = [date for _, date in manifest_keys]
+    for courier_ids_chunk in chunks(courier_ids):
+        for manifest in CourierManifestsModel.query.filter(CourierManifestsModel.courier_id.in_(courier_ids_chunk),
+                                                           CourierManifestsModel.date >= min(dates),
+                                                           CourierManifestsModel.date <= max(dates))\
+                .with_for_update():
+            if (manifest.courier_id, manifest.date) in manifest_keys:
+                manifests[(manifest.courier_id, manifest.date)] = manifest
+    return manifests
+
+
+def get_manifest_etag(courier_id, date, version):
+    return '{}-{}-{}'.format(courier_id, date.strftime('%Y%m%d'), version)
+
+
+def create_manifest_body(courier_id, date, manifest):
+    # manifest of a courier day without deliveries is returned with zero counts
+    if manifest is None:
+        return {'courier_id': courier_id, 'date': date.strftime('%d/%m/%Y'), 'num_of_scheduled_deliveries': 0,
+                'num_of_completed_deliveries': 0, 'delivery_ids': []}
+
+    return {'courier_id': courier_id, 'date': date.strftime('%d/%m/%Y'),
+            'num_of_scheduled_deliveries': manifest.num_of_scheduled_deliveries,
+            'num_of_completed_deliveries': manifest.num_of_completed_deliveries,
+            'delivery_ids': [delivery_id for _, delivery_id in json.loads(manifest.deliveries)]}
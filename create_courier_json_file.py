@@ -1,32 +1,109 @@
+import argparse
 import json
 import random
+from datetime import datetime, timedelta
 
 # courier id is random (each courier should have unique ID. in real life couriers should enter their ID)
 courier_id_max_val = (2 ** 32) - 1
-courier_id = random.randint(0, courier_id_max_val)
-
-# value for each day of the week is a list of timeslot lists, each timeslot list contains starting time, end time and list of supported addresses
-available_timeslots_dict = \
-    {"courier_id": courier_id, "timeslots":
-        {"17/07/2021": [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan", "Bnei Brak"]],
-                        ["12:00", "14:00", ["Ramat Gan", "Bnei Brak", "Petah Tikva"]], ["14:00", "16:00", ["Bnei Brak", "Petah Tikva", "Rosh Haayin"]],
-                        ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
-        "18/07/2021":  [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan", "Bnei Brak"]],
-                        ["12:00", "14:00", ["Ramat Gan", "Bnei Brak", "Petah Tikva"]], ["14:00", "16:00", ["Bnei Brak", "Petah Tikva", "Rosh Haayin"]]],
-        "19/07/2021":  [["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["14:00", "16:00", ["Bnei Brak", "Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
-        "20/07/2021":  [["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["14:00", "16:00", ["Bnei Brak", "Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
-        "21/07/2021":  [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["14:00", "16:00", ["Bnei Brak", "Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
-        "22/07/2021":  [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
-                        ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]]]
+# synthetic data vars
+timeslot_start_hours        = (8, 10, 12, 14, 16)
+timeslot_length_hours       = 2
+courier_workday_probability = 5 / 7
+timeslot_probability        = 0.8
+max_num_of_extra_cities     = 3
+
+
+def create_example_courier():
+    courier_id = random.randint(0, courier_id_max_val)
+    # value for each day of the week is a list of timeslot lists, each timeslot list contains starting time, end time and list of supported addresses
+    available_timeslots_dict = \
+        {"courier_id": courier_id, "timeslots":
+            {"17/07/2021": [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan", "Bnei Brak"]],
+                            ["12:00", "14:00", ["Ramat Gan", "Bnei Brak", "Petah Tikva"]], ["14:00", "16:00", ["Bnei Brak", "Petah Tikva", "Rosh Haayin"]],
+                            ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
+            "18/07/2021":  [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan", "Bnei Brak"]],
+                            ["12:00", "14:00", ["Ramat Gan", "Bnei Brak", "Petah Tikva"]], ["14:00", "16:00", ["Bnei Brak", "Petah Tikva", "Rosh Haayin"]]],
+            "19/07/2021":  [["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["14:00", "16:00", ["Bnei Brak", "Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
+            "20/07/2021":  [["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["14:00", "16:00", ["Bnei Brak", "Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
+            "21/07/2021":  [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["14:00", "16:00", ["Bnei Brak", "Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["16:00", "18:00", ["Bnei Brak", "Petah Tikva", "Tel Aviv-Yafo"]]],
+            "22/07/2021":  [["08:00", "10:00", ["Tel Aviv-Yafo", "Ramat Gan"]], ["10:00", "12:00", ["Tel Aviv-Yafo", "Ramat Gan"]],
+                            ["12:00", "14:00", ["Tel Aviv-Yafo", "Ramat Gan"]]]
+            }
         }
-    }
+    return available_timeslots_dict
+
+
+def get_city_names(num_of_cities):
+    return ['City {}'.format(city_num) for city_num in range(1, num_of_cities + 1)]
+
+
+def get_city_weights(num_of_cities, skew):
+    # Zipf-like popularity - city of rank r is chosen with weight 1 / r^skew (skew 0 means uniform)
+    return [1 / (rank ** skew) for rank in range(1, num_of_cities + 1)]
+
+
+def create_synthetic_courier(courier_id, start_date, num_of_days, city_names, city_weights, rnd):
+    # courier works ~5 days a week around a home city chosen by city popularity, each timeslot supports the home
+    # city and up to max_num_of_extra_cities other cities, also chosen by popularity
+    home_city = rnd.choices(city_names, city_weights)[0]
+    timeslots = {}
+    for day_num in range(num_of_days):
+        if rnd.random() > courier_workday_probability:
+            continue
+
+        date_str = (start_date + timedelta(days=day_num)).strftime('%d/%m/%Y')
+        timeslots_list = []
+        for start_hour in timeslot_start_hours:
+            if rnd.random() > timeslot_probability:
+                continue
+
+            extra_cities = rnd.choices(city_names, city_weights, k=rnd.randint(0, max_num_of_extra_cities))
+            supported_addresses = sorted(set([home_city] + extra_cities))
+            timeslots_list.append(['{:02d}:00'.format(start_hour), '{:02d}:00'.format(start_hour + timeslot_length_hours),
+                                   supported_addresses])
+        if timeslots_list:
+            timeslots[date_str] = timeslots_list
+
+    return {"courier_id": courier_id, "timeslots": timeslots}
+
+
+def create_synthetic_couriers_file(file_path, num_of_couriers, num_of_days, num_of_cities, skew=1.0,
+                                   start_date=datetime(2021, 7, 17), seed=0):
+    # writes num_of_couriers couriers to a jsonl file (a courier per line, see load_courier_timeslots), returns
+    # list of city names by popularity. Same arguments produce the same file
+    rnd          = random.Random(seed)
+    city_names   = get_city_names(num_of_cities)
+    city_weights = get_city_weights(num_of_cities, skew)
+    courier_ids  = rnd.sample(range(courier_id_max_val + 1), num_of_couriers)
+    with open(file_path, 'w') as f:
+        for courier_id in courier_ids:
+            courier_data = create_synthetic_courier(courier_id, start_date, num_of_days, city_names, city_weights, rnd)
+            f.write(json.dumps(courier_data) + '\n')
+
+    return city_names
+
 
-with open('courier_timeslots.json', 'w') as f:
-    json.dump(available_timeslots_dict, f, indent=2)
\ No newline at end of file
+if __name__ == '__main__':
+    # without arguments the example courier_timeslots.json is written, with --couriers a synthetic jsonl file
+    parser = argparse.ArgumentParser(description='Create couriers timeslots file')
+    parser.add_argument('--couriers', type=int, help='num of synthetic couriers')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--skew', type=float, default=1.0, help='city popularity skew, 0 is uniform')
+    parser.add_argument('--start-date', default='17/07/2021', help='dd/mm/yyyy')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='couriers_timeslots.jsonl')
+    args = parser.parse_args()
+    if args.couriers is None:
+        with open('courier_timeslots.json', 'w') as f:
+            json.dump(create_example_courier(), f, indent=2)
+    else:
+        create_synthetic_couriers_file(args.output, args.couriers, args.days, args.cities, args.skew,
+                                       datetime.strptime(args.start_date, '%d/%m/%Y'), args.seed)
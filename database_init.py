@@ -1,17 +1,99 @@
-from flask import Flask
+from flask import Flask, g, has_app_context
 from flask_restful import Api
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.hybrid import hybrid_property
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache, wraps
+import hashlib
+import io
 import json
+import os
+import pickle
+import sqlite3
 
 app = Flask(__name__)
 api = Api(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///database.db"
+# database settings, each one can be overridden by an environment variable of the same name. Reads of endpoints marked
+# with read_from_replica go to DATABASE_REPLICA_URI if it is set, everything else goes to DATABASE_URI.
+# DATABASE_STATEMENT_TIMEOUT_SECONDS is statement timeout on PostgreSQL and lock wait timeout on SQLite
+database_settings = {
+    'DATABASE_URI':                       'sqlite:///database.db',
+    'DATABASE_REPLICA_URI':               None,
+    'DATABASE_POOL_SIZE':                 10,
+    'DATABASE_POOL_RECYCLE_SECONDS':      1800,
+    'DATABASE_STATEMENT_TIMEOUT_SECONDS': 5,
+}
+for setting_name, default_value in database_settings.items():
+    app.config[setting_name] = os.environ.get(setting_name, default_value)
+app.config['SQLALCHEMY_DATABASE_URI'] = app.config['DATABASE_URI']
+if app.config['DATABASE_REPLICA_URI']:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': app.config['DATABASE_REPLICA_URI']}
 # Flask-SQLAlchemy has its own event notification system that gets layered on top of SQLAlchemy.
 # To do this, it tracks modifications to the SQLAlchemy session. This takes extra resources, so the option
 # SQLALCHEMY_TRACK_MODIFICATIONS allows you to disable the modification tracking system.
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app, session_options={"autoflush": False})  # TODO: remove autoflush=False, this prevents from database to lock queries when accessed
+
+
+class RoutingSession(SignallingSession):
+    # session of a request marked with read_from_replica uses the replica engine (if one is configured)
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context() and g.get('use_read_replica') and 'replica' in (self.app.config.get('SQLALCHEMY_BINDS') or {}):
+            return db.get_engine(self.app, bind='replica')
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # pool and timeout settings are applied to primary and replica engines
+        super().apply_driver_hacks(app, sa_url, options)
+        statement_timeout = float(app.config['DATABASE_STATEMENT_TIMEOUT_SECONDS'])
+        connect_args = options.setdefault('connect_args', {})
+        if sa_url.drivername.startswith('sqlite'):     # SQLite opens a connection per session, pool does not apply
+            connect_args['timeout'] = statement_timeout
+        else:
+            options.setdefault('pool_size', int(app.config['DATABASE_POOL_SIZE']))
+            options.setdefault('pool_recycle', int(app.config['DATABASE_POOL_RECYCLE_SECONDS']))
+            options.setdefault('pool_pre_ping', True)
+            if sa_url.drivername.startswith('postgresql'):
+                connect_args['options'] = '-c statement_timeout={}'.format(int(statement_timeout * 1000))
+
+
+db = RoutingSQLAlchemy(app, session_options={"autoflush": False})  # TODO: remove autoflush=False, this prevents from database to lock queries when accessed
+
+
+def read_from_replica(func):
+    # marks a read only endpoint, its queries are routed to the replica for the rest of the request.
+    # used as method decorator of Flask-RESTful resources
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.use_read_replica = True
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@app.teardown_request
+def reset_read_replica(exception):
+    # requests share g if they run inside an outer app context (e.g. test client), so the mark is removed per request
+    g.pop('use_read_replica', None)
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL journal - readers do not block on a writer and a writer does not block readers, so timeslot searches
+    # are not serialized behind bookings. synchronous=NORMAL is durable in WAL mode except on power loss
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
 
 # PyCharm code inspection error ignored in all Flask SQLAlchemy Models, see:
 #   https://stackoverflow.com/questions/35242153/unresolved-attribute-column-in-class-sqlalchemy
@@ -21,8 +103,48 @@ class UsersModel(db.Model):
     user_name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(500), nullable=False)
     country_code = db.Column(db.String(100), nullable=False)
-    user_email = db.Column(db.String(100), nullable=False)
-    address_object = db.Column(db.PickleType())     # address_object is None when creating new user
+    user_email = db.Column(db.String(100), nullable=False, index=True)  # every endpoint looks users up by email
+    # resolved address, columns are None until the address is resolved (see migrate_address_columns for older dbs)
+    address_street       = db.Column(db.String(200))
+    address_home_num     = db.Column(db.String(50))
+    address_city         = db.Column(db.String(100), index=True)
+    address_country      = db.Column(db.String(100))
+    address_country_code = db.Column(db.String(100))
+
+    @property
+    def address_object(self):
+        # None when creating new user
+        if self.address_city is None:
+            return None
+
+        return Address(self.address_street, self.address_home_num, self.address_city, self.address_country,
+                       self.address_country_code)
+
+    @address_object.setter
+    def address_object(self, address):
+        for field_name in Address.__slots__:
+            setattr(self, 'address_' + field_name, getattr(address, field_name) if address else None)
+
+    @hybrid_property
+    def resolved_country_code(self):
+        # country of the resolved address, country code given on user creation until the address is resolved.
+        # Holidays are checked by this country on timeslot search and on booking
+        return self.address_country_code or self.country_code
+
+    @resolved_country_code.expression
+    def resolved_country_code(cls):
+        return db.func.coalesce(cls.address_country_code, cls.country_code)
+
+
+@dataclass
+class Address:
+    __slots__ = ('street', 'home_num', 'city', 'country', 'country_code')
+    street:       str
+    home_num:     str
+    city:         str
+    country:      str
+    country_code: str
+    #postcode:    str   # N/A for Israel
 
 
 class CouriersModel(db.Model):
@@ -37,6 +159,8 @@ class CouriersModel(db.Model):
     num_of_remaining_deliveries = db.Column(db.Integer, nullable=False)
     date = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.Integer, nullable=False)
+    # timeslot search joins couriers on (courier_id, date), booking looks up the same pair
+    __table_args__ = (db.Index('ix_couriers_courier_id_date', 'courier_id', 'date'),)
 
 
 class DeliveriesModel(db.Model):
@@ -50,6 +174,8 @@ class DeliveriesModel(db.Model):
     courier_id = db.Column(db.Integer, nullable=False)
     user_email = db.Column(db.Integer, nullable=False)
     status = db.Column(db.Integer, nullable=False)
+    # daily and weekly deliveries are a range query on date, optionally for a single courier
+    __table_args__ = (db.Index('ix_deliveries_date_courier_id', 'date', 'courier_id'),)
 
 
 class TimeslotsModel(db.Model):
@@ -66,40 +192,392 @@ class TimeslotsModel(db.Model):
     num_of_scheduled_deliveries = db.Column(db.Integer, nullable=False)
     status = db.Column(db.Integer, nullable=False)
     supported_addresses = db.Column(db.PickleType(), nullable=False)
+    # timeslot search filters available timeslots and excludes holiday dates. Courier file loading looks up timeslots
+    # by courier, (courier_id, start_time) is the key timeslots are upserted by
+    __table_args__ = (db.Index('ix_timeslots_status_date', 'status', 'date'),
+                      db.Index('ix_timeslots_courier_id_start_time', 'courier_id', 'start_time', unique=True))
 
 
-def load_courier_timeslots(json_file):
-    # all existing queries in timeslot table are deleted on start, to avoid duplicate timeslots
-    TimeslotsModel.query.delete()
-    CouriersModel.query.delete()
-    DeliveriesModel.query.delete()
-
-    with open(json_file) as data_file:
-        data = json.load(data_file)
-        # data is a dictionary of weekdays as keys and list of lists as value. The list of lists contains a list per timeslot
-        # that consists of start time as int/float and a list of supported addresses
-        courier_id = data["courier_id"]
-        for date_str in data["timeslots"]:
-            date_next_weekday = datetime.strptime(date_str, '%d/%m/%Y').date()
-            year, month, day = [date_next_weekday.year, date_next_weekday.month, date_next_weekday.day]
-            # new row for each date per courier - tracking total num of deliveries booked (max of 10)
-            new_date_for_courier_table = CouriersModel(courier_id=courier_id,
-                                                       num_of_remaining_deliveries=CouriersModel.max_num_of_remaining_deliveries_var,
-                                                       date=date_next_weekday, status=CouriersModel.available)
-            db.session.add(new_date_for_courier_table)
-            timeslots_list = data["timeslots"][date_str]
-            for timeslot in timeslots_list:
-                timeslot_start_time_str, timeslot_end_time_str, supported_addresses_list = timeslot
-                timeslot_start_time = datetime.strptime(timeslot_start_time_str, '%H:%M')
-                timeslot_end_time   = datetime.strptime(timeslot_end_time_str, '%H:%M')
-                new_timeslot_start_time = timeslot_start_time.replace(year=year, month=month, day=day)
-                new_timeslot_end_time   = timeslot_end_time.replace(year=year, month=month, day=day)
-                # new row for each timeslot per courier - tracking num of scheduled deliveries per timeslot (max of 2),
-                # status. contains supported addresses info per timeslot
-                new_timeslot = TimeslotsModel(courier_id=courier_id, start_time=new_timeslot_start_time,
-                                              end_time=new_timeslot_end_time, date=date_next_weekday,
-                                              num_of_scheduled_deliveries=0, status=TimeslotsModel.available,
-                                              supported_addresses=supported_addresses_list)
-                db.session.add(new_timeslot)
+class TimeslotCitiesModel(db.Model):
+    # city to timeslot index - a row per city in timeslot's supported addresses, so timeslots for user's city are
+    # found by an index lookup instead of unpickling supported_addresses of every timeslot
+    query_id = db.Column(db.Integer, primary_key=True)
+    timeslot_id = db.Column(db.Integer, nullable=False)
+    city = db.Column(db.String(100), nullable=False)
+    # city rows of reloaded timeslots are deleted by timeslot_id
+    __table_args__ = (db.Index('ix_timeslot_cities_city_timeslot_id', 'city', 'timeslot_id'),
+                      db.Index('ix_timeslot_cities_timeslot_id', 'timeslot_id'))
+
+
+class HolidayCalendarModel(db.Model):
+    # holiday dates per country, precomputed in background by HolidayCalendarJob. Timeslots on these dates are not
+    # offered to users of the country and can not be booked by them
+    country_code = db.Column(db.String(100), primary_key=True)
+    date = db.Column(db.DateTime, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+
+
+class HolidayCalendarRefreshesModel(db.Model):
+    # a row per refreshed (country_code, year), tells a country without holidays from a country not refreshed yet
+    country_code = db.Column(db.String(100), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
+
+class CourierManifestsModel(db.Model):
+    # materialized daily manifest of a courier - delivery counts and delivery ids ordered by timeslot. Updated by
+    # update_courier_manifests in the transaction that books, completes or cancels a delivery, version is increased
+    # on every change and is the ETag of the manifest
+    courier_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    date = db.Column(db.DateTime, primary_key=True)
+    num_of_scheduled_deliveries = db.Column(db.Integer, nullable=False)
+    num_of_completed_deliveries = db.Column(db.Integer, nullable=False)
+    deliveries = db.Column(db.Text, nullable=False)    # JSON list of [timeslot start time HH:MM, delivery_id], sorted
+    version = db.Column(db.Integer, nullable=False)
+
+
+def create_manifest_entry(start_time, delivery_id):
+    return [start_time.strftime('%H:%M'), delivery_id]
+
+
+class GeocodeCacheModel(db.Model):
+    # cached Geocoding API results keyed by normalized address string, shared by all users with the same address
+    normalized_address = db.Column(db.String(500), primary_key=True)
+    status = db.Column(db.String(50), nullable=False)
+    street = db.Column(db.String(200))
+    home_num = db.Column(db.String(50))
+    city = db.Column(db.String(100))
+    country = db.Column(db.String(100))
+    country_code = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
 
+
+class SchemaMigrationsModel(db.Model):
+    # migrations applied to the database, init_database runs each migration once
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+
+class CourierFilesModel(db.Model):
+    # content hash of each loaded courier file, load_changed_courier_files skips files that did not change
+    file_path = db.Column(db.String(500), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    loaded_at = db.Column(db.DateTime, nullable=False)
+
+
+def load_changed_courier_files(json_files):
+    # incremental reload - a courier file is loaded (see load_courier_timeslots) only if its content hash differs from
+    # the hash stored when it was last loaded. Returns list of loaded files
+    loaded_files = []
+    for json_file in json_files:
+        file_path    = os.path.abspath(json_file)
+        content_hash = get_file_hash(file_path)
+        courier_file = CourierFilesModel.query.get(file_path)
+        if courier_file and courier_file.content_hash == content_hash:
+            continue
+
+        load_courier_timeslots(file_path)
+        # hash is stored after the file was loaded, a load that failed midway is repeated on next start
+        db.session.merge(CourierFilesModel(file_path=file_path, content_hash=content_hash, loaded_at=datetime.now()))
         db.session.commit()
+        loaded_files.append(json_file)
+    return loaded_files
+
+
+def get_file_hash(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def load_courier_timeslots(json_files, batch_size=5000):
+    # loads couriers' timeslots from a json file with a single courier, or from a jsonl file with a courier per line.
+    # json_files is a file path or a list of file paths. Couriers are parsed one at a time and written in batches of
+    # ~batch_size timeslots using executemany. Existing timeslots and courier dates are updated, not replaced, so
+    # scheduled deliveries and remaining capacity are kept. Timeslots of a loaded courier that are not in the file
+    # anymore are retired (see retire_timeslots)
+    if isinstance(json_files, str):
+        json_files = [json_files]
+
+    couriers_batch, num_of_timeslots_in_batch = [], 0
+    for courier_data in iter_couriers(json_files):
+        couriers_batch.append(courier_data)
+        num_of_timeslots_in_batch += sum(len(timeslots_list) for timeslots_list in courier_data["timeslots"].values())
+        if num_of_timeslots_in_batch >= batch_size:
+            upsert_couriers_batch(couriers_batch)
+            couriers_batch, num_of_timeslots_in_batch = [], 0
+
+    if couriers_batch:
+        upsert_couriers_batch(couriers_batch)
+
+
+def iter_couriers(json_files):
+    # data is a dictionary of dates as keys and list of lists as value. The list of lists contains a list per timeslot
+    # that consists of start time, end time and a list of supported addresses
+    for json_file in json_files:
+        with open(json_file) as data_file:
+            if json_file.endswith('.jsonl'):
+                for line in data_file:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield json.load(data_file)
+
+
+@lru_cache(maxsize=None)
+def parse_date(date_str):
+    return datetime.strptime(date_str, '%d/%m/%Y')
+
+
+@lru_cache(maxsize=None)
+def parse_time(time_str):
+    # timeslot time as timedelta from start of the day
+    hours, minutes = time_str.split(':')
+    return timedelta(hours=int(hours), minutes=int(minutes))
+
+
+def upsert_couriers_batch(couriers_batch):
+    courier_ids = [courier_data["courier_id"] for courier_data in couriers_batch]
+    courier_dates_rows, timeslots_rows, supported_addresses_per_timeslot = {}, {}, {}
+    for courier_data in couriers_batch:
+        courier_id = courier_data["courier_id"]
+        for date_str, timeslots_list in courier_data["timeslots"].items():
+            date = parse_date(date_str)
+            # row for each date per courier - tracking total num of deliveries booked (max of 10)
+            courier_dates_rows[(courier_id, date)] = {'courier_id': courier_id, 'date': date}
+            for timeslot_start_time_str, timeslot_end_time_str, supported_addresses_list in timeslots_list:
+                start_time = date + parse_time(timeslot_start_time_str)
+                # row for each timeslot per courier - tracking num of scheduled deliveries per timeslot (max of 2),
+                # status. contains supported addresses info per timeslot
+                timeslots_rows[(courier_id, start_time)] = {'courier_id': courier_id, 'start_time': start_time,
+                                                            'end_time': date + parse_time(timeslot_end_time_str),
+                                                            'date': date, 'supported_addresses': supported_addresses_list}
+                supported_addresses_per_timeslot[(courier_id, start_time)] = supported_addresses_list
+
+    # courier dates - only new dates are inserted, existing dates keep their remaining deliveries
+    couriers_table = CouriersModel.__table__
+    existing_courier_dates = set()
+    for courier_ids_chunk in chunks(courier_ids):
+        rows = db.session.execute(db.select([couriers_table.c.courier_id, couriers_table.c.date])
+                                  .where(couriers_table.c.courier_id.in_(courier_ids_chunk)))
+        existing_courier_dates.update((courier_id, date) for courier_id, date in rows)
+    new_courier_dates_rows = [dict(row, num_of_remaining_deliveries=CouriersModel.max_num_of_remaining_deliveries_var,
+                                   status=CouriersModel.available)
+                              for key, row in courier_dates_rows.items() if key not in existing_courier_dates]
+    if new_courier_dates_rows:
+        db.session.execute(couriers_table.insert(), new_courier_dates_rows)
+
+    # timeslots - existing timeslots are updated (scheduled deliveries are kept, a retired timeslot that is back in the
+    # file is available again unless it is full), new ones inserted
+    timeslots_table = TimeslotsModel.__table__
+    existing_timeslot_ids = get_timeslot_ids(courier_ids)
+    removed_timeslot_ids  = [timeslot_id for key, timeslot_id in existing_timeslot_ids.items()
+                             if key not in timeslots_rows]
+    updated_timeslots_rows, new_timeslots_rows = [], []
+    for key, row in timeslots_rows.items():
+        if key in existing_timeslot_ids:
+            updated_timeslots_rows.append(dict(row, existing_timeslot_id=existing_timeslot_ids[key]))
+        else:
+            new_timeslots_rows.append(dict(row, num_of_scheduled_deliveries=0, status=TimeslotsModel.available))
+
+    if updated_timeslots_rows:
+        is_full = timeslots_table.c.num_of_scheduled_deliveries >= TimeslotsModel.max_num_of_deliveries
+        db.session.execute(timeslots_table.update()
+                           .where(timeslots_table.c.timeslot_id == db.bindparam('existing_timeslot_id'))
+                           .values(end_time=db.bindparam('end_time'), date=db.bindparam('date'),
+                                   supported_addresses=db.bindparam('supported_addresses'),
+                                   status=db.case([(is_full, TimeslotsModel.not_available)],
+                                                  else_=TimeslotsModel.available)),
+                           updated_timeslots_rows)
+    if new_timeslots_rows:
+        db.session.execute(timeslots_table.insert(), new_timeslots_rows)
+    if removed_timeslot_ids:
+        retire_timeslots(removed_timeslot_ids)
+
+    # city rows of all loaded timeslots are replaced
+    timeslot_ids = get_timeslot_ids(courier_ids)
+    loaded_timeslot_ids = [timeslot_ids[key] for key in timeslots_rows]
+    timeslot_cities_table = TimeslotCitiesModel.__table__
+    for timeslot_ids_chunk in chunks(loaded_timeslot_ids):
+        db.session.execute(timeslot_cities_table.delete()
+                           .where(timeslot_cities_table.c.timeslot_id.in_(timeslot_ids_chunk)))
+    timeslot_cities_rows = [{'timeslot_id': timeslot_ids[key], 'city': city}
+                            for key, supported_addresses_list in supported_addresses_per_timeslot.items()
+                            for city in set(supported_addresses_list)]
+    if timeslot_cities_rows:
+        db.session.execute(timeslot_cities_table.insert(), timeslot_cities_rows)
+
+    db.session.commit()
+
+
+def retire_timeslots(timeslot_ids):
+    # timeslots removed from courier's file are marked as not available, so they are not offered or booked anymore.
+    # Timeslots without deliveries are deleted with their city rows, booked ones are kept for their deliveries
+    timeslots_table       = TimeslotsModel.__table__
+    timeslot_cities_table = TimeslotCitiesModel.__table__
+    unbooked_timeslot_ids = []
+    for timeslot_ids_chunk in chunks(timeslot_ids):
+        db.session.execute(timeslots_table.update()
+                           .where(timeslots_table.c.timeslot_id.in_(timeslot_ids_chunk))
+                           .values(status=TimeslotsModel.not_available))
+        unbooked_timeslot_ids += [timeslot_id for timeslot_id, in db.session.execute(
+            db.select([timeslots_table.c.timeslot_id])
+            .where(db.and_(timeslots_table.c.timeslot_id.in_(timeslot_ids_chunk),
+                           timeslots_table.c.num_of_scheduled_deliveries == 0)))]
+
+    for timeslot_ids_chunk in chunks(unbooked_timeslot_ids):
+        db.session.execute(timeslot_cities_table.delete()
+                           .where(timeslot_cities_table.c.timeslot_id.in_(timeslot_ids_chunk)))
+        db.session.execute(timeslots_table.delete().where(timeslots_table.c.timeslot_id.in_(timeslot_ids_chunk)))
+
+
+def get_timeslot_ids(courier_ids):
+    # returns dict of (courier_id, start_time) -> timeslot_id of couriers' timeslots
+    timeslots_table = TimeslotsModel.__table__
+    timeslot_ids = {}
+    for courier_ids_chunk in chunks(courier_ids):
+        rows = db.session.execute(db.select([timeslots_table.c.courier_id, timeslots_table.c.start_time,
+                                             timeslots_table.c.timeslot_id])
+                                  .where(timeslots_table.c.courier_id.in_(courier_ids_chunk)))
+        timeslot_ids.update(((courier_id, start_time), timeslot_id) for courier_id, start_time, timeslot_id in rows)
+    return timeslot_ids
+
+
+def chunks(values, chunk_size=500):
+    # IN queries are split to stay below SQLite's limit on number of bound parameters
+    for i in range(0, len(values), chunk_size):
+        yield values[i:i + chunk_size]
+
+
+def add_timeslot_cities(timeslot_id, supported_addresses_list):
+    for city in set(supported_addresses_list):
+        db.session.add(TimeslotCitiesModel(timeslot_id=timeslot_id, city=city))
+
+
+def migrate_timeslot_cities():
+    # migration for databases created before timeslot_cities table existed: creates the table and fills it from the
+    # pickled supported_addresses of timeslots that have no city rows yet
+    TimeslotCitiesModel.__table__.create(db.engine, checkfirst=True)
+    indexed_timeslot_ids = {timeslot_id for timeslot_id, in db.session.query(TimeslotCitiesModel.timeslot_id).distinct()}
+    for timeslot in TimeslotsModel.query.all():
+        if timeslot.timeslot_id not in indexed_timeslot_ids:
+            add_timeslot_cities(timeslot.timeslot_id, timeslot.supported_addresses)
+
+    db.session.commit()
+
+
+def release_holiday_timeslots():
+    # migration for databases where timeslot search marked holiday timeslots as not available. Holidays are excluded
+    # by the holiday calendar now, so timeslots that are not available while not fully booked are released
+    TimeslotsModel.query\
+        .filter(TimeslotsModel.status == TimeslotsModel.not_available,
+                TimeslotsModel.num_of_scheduled_deliveries < TimeslotsModel.max_num_of_deliveries)\
+        .update({TimeslotsModel.status: TimeslotsModel.available}, synchronize_session=False)
+    db.session.commit()
+
+
+class LegacyAddressUnpickler(pickle.Unpickler):
+    # pickled addresses reference the Address class of the module that pickled them (delivery_api or __main__), their
+    # attributes are loaded into LegacyAddress, whatever the module was
+    def find_class(self, module, name):
+        if name == 'Address':
+            return LegacyAddress
+
+        return super().find_class(module, name)
+
+
+class LegacyAddress:
+    pass
+
+
+def migrate_address_columns():
+    # migration for databases where resolved address was stored as pickled address_object: adds address columns of
+    # users table and fills them from the pickles of users that have no address columns yet. The address_object
+    # column is left in place (SQLite can not drop it) and is not read afterwards
+    users_table   = UsersModel.__table__
+    inspector     = db.inspect(db.engine)
+    table_columns = {column['name'] for column in inspector.get_columns(users_table.name)}
+    for column_name in ['address_' + field_name for field_name in Address.__slots__]:
+        if column_name not in table_columns:
+            column = users_table.c[column_name]
+            db.session.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                users_table.name, column_name, column.type.compile(dialect=db.engine.dialect)))
+    db.session.commit()
+
+    if 'address_object' not in table_columns:
+        return
+
+    rows = db.session.execute('SELECT user_id, address_object FROM {} WHERE address_object IS NOT NULL AND '
+                              'address_city IS NULL'.format(users_table.name)).fetchall()
+    address_rows = []
+    for user_id, pickled_address in rows:
+        legacy_address = LegacyAddressUnpickler(io.BytesIO(pickled_address)).load()
+        address_row = {'b_address_' + field_name: legacy_address.__dict__.get(field_name)
+                       for field_name in Address.__slots__}
+        address_row['b_user_id'] = user_id
+        address_rows.append(address_row)
+
+    if address_rows:
+        db.session.execute(users_table.update()
+                           .where(users_table.c.user_id == db.bindparam('b_user_id'))
+                           .values({'address_' + field_name: db.bindparam('b_address_' + field_name)
+                                    for field_name in Address.__slots__}),
+                           address_rows)
+    db.session.commit()
+
+
+def build_courier_manifests():
+    # migration for databases with deliveries booked before courier manifests existed: manifests of all courier days
+    # with deliveries are rebuilt from deliveries table
+    manifests = {}
+    for courier_id, date, delivery_id, status, start_time in db.session.query(
+            DeliveriesModel.courier_id, DeliveriesModel.date, DeliveriesModel.delivery_id, DeliveriesModel.status,
+            TimeslotsModel.start_time).join(TimeslotsModel, TimeslotsModel.timeslot_id == DeliveriesModel.timeslot_id):
+        manifest = manifests.setdefault((courier_id, date), {'courier_id': courier_id, 'date': date, 'version': 1,
+                                                             'num_of_scheduled_deliveries': 0,
+                                                             'num_of_completed_deliveries': 0, 'deliveries': []})
+        if status == DeliveriesModel.completed:
+            manifest['num_of_completed_deliveries'] += 1
+        else:
+            manifest['num_of_scheduled_deliveries'] += 1
+        manifest['deliveries'].append(create_manifest_entry(start_time, delivery_id))
+
+    CourierManifestsModel.query.delete(synchronize_session=False)
+    manifests_rows = [dict(manifest, deliveries=json.dumps(sorted(manifest['deliveries'])))
+                      for manifest in manifests.values()]
+    if manifests_rows:
+        db.session.execute(CourierManifestsModel.__table__.insert(), manifests_rows)
+    db.session.commit()
+
+
+def create_missing_indexes(table):
+    # create_all does not add indexes to tables that already exist, indexes of table missing in the database are created
+    table_indexes = {index['name'] for index in db.inspect(db.engine).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in table_indexes:
+            index.create(db.engine)
+
+
+# applied in order by init_database, each migration is also safe to run again
+migrations = [migrate_address_columns, migrate_timeslot_cities, release_holiday_timeslots, build_courier_manifests]
+
+
+def init_database():
+    # idempotent schema check - creates missing tables, runs migrations that were not applied to this database yet and
+    # creates missing indexes of existing tables (after migrations, which may add indexed columns). A new database is
+    # created with the current schema, so its migrations are only recorded
+    is_new_database = not db.inspect(db.engine).get_table_names()
+    db.create_all()
+    applied_migrations = {name for name, in db.session.query(SchemaMigrationsModel.name)}
+    for migration in migrations:
+        if migration.__name__ not in applied_migrations:
+            if not is_new_database:
+                migration()
+            db.session.add(SchemaMigrationsModel(name=migration.__name__, applied_at=datetime.now()))
+    db.session.commit()
+
+    if not is_new_database:
+        for table in db.metadata.sorted_tables:
+            create_missing_indexes(table)
@@ -1,22 +1,57 @@
+import logging
 import os
-from flask import jsonify
+from flask import jsonify, request, Response, stream_with_context
 from flask_restful import Resource
-import requests
 from datetime import timedelta
-import holidayapi
 import threading
+from collections import namedtuple
+from itertools import chain, groupby
+import time
+import random
+from sqlalchemy.exc import OperationalError
 from database_init import *
 from api_keys import *
-
-
-class Address:
-    def __init__(self, street, home_num, city, country, country_code):
-        self.street = street
-        self.home_num = home_num
-        self.city = city
-        self.country = country
-        self.country_code = country_code
-        #self.postcode = postcode   # N/A for Israel
+from holiday_cache import HolidayCache
+from geocoding import resolve_address
+from upstream_client import UpstreamUnavailableError
+from availability_index import AvailabilityIndex, AvailabilityIndexRefreshJob, format_timeslot_entry
+from timeslot_assignment import AssignmentGraph, CityTimeslots
+from courier_manifests import update_courier_manifests, get_manifest_etag, create_manifest_body
+from holiday_calendar import HolidayCalendarJob, get_calendar_holidays, get_holiday_dates
+from metrics import metrics, instrument_app
+
+
+logger = logging.getLogger(__name__)
+# shared by all requests of the process. Persisted (from create_app on) so restarted workers do not need to access
+# Holiday API again
+holiday_cache = HolidayCache()
+holidays_cache_path = 'holidays_cache.db'
+# availability index settings, each one can be overridden by an environment variable of the same name. The index is
+# built on startup and kept current by bookings and cancellations of this process. Other worker processes' changes are
+# reloaded every AVAILABILITY_INDEX_REFRESH_SECONDS, 0 disables the index (timeslot search goes to the database)
+availability_index_settings = {
+    'AVAILABILITY_INDEX_REFRESH_SECONDS': 30,
+}
+for setting_name, default_value in availability_index_settings.items():
+    app.config[setting_name] = os.environ.get(setting_name, default_value)
+availability_index = AvailabilityIndex()
+availability_index_refresh_job = AvailabilityIndexRefreshJob(
+    availability_index, float(app.config['AVAILABILITY_INDEX_REFRESH_SECONDS']))
+# booking and cancellation retries while database is locked by concurrent transactions
+max_num_of_db_attempts = 5
+db_retry_delay_seconds = 0.02
+# today's date is simulated for testing as the Holiday API provides info for 2021 (use datetime.now() in production),
+# deliveries endpoints accept date query parameter instead
+simulated_today_daily       = datetime(2021, 7, 19)
+simulated_today_weekly      = datetime(2021, 7, 17)
+max_num_of_days_for_display = 366
+max_page_size               = 1000
+delivery_status_names       = { DeliveriesModel.scheduled: 'scheduled', DeliveriesModel.completed: 'completed' }
+wrong_deliveries_window_message = 'Wrong input. Expected date as dd/mm/yyyy, num_of_days, courier_id and limit as ' \
+                                  'integers, after as cursor from previous page and format as json or ndjson'
+geocoding_unavailable_message = 'Address can not be resolved at the moment. Please try again later'
+DeliveriesWindow = namedtuple('DeliveriesWindow', ['start_date', 'num_of_days', 'courier_id', 'limit', 'cursor',
+                                                   'response_format'])
 
 
 class User(Resource):
@@ -57,56 +92,104 @@ class User(Resource):
 
 class ResolveAddress(Resource):
     def post(self, user_email):
-        # resolve single line address into class, func accesses Google's Geocoding API
+        # resolve single line address into class, func accesses Google's Geocoding API if the address is not cached
         user = UsersModel.query.filter_by(user_email=user_email).first()
         if user:
-            address_str = user.address
-            params = {'key': geocoding_api_key, 'address': address_str}
-            base_url = 'https://maps.googleapis.com/maps/api/geocode/json?'
-            response = requests.get(base_url, params=params).json()
-            if response['status'] == 'OK':
-                # extract the relevant info from the response
-                address_components = response['results'][0]['address_components']
-                home_num, street, city, country, country_code = ["", "", "", "", ""]
-                for address_component in address_components:
-                    if address_component['types'][0] == 'street_number':
-                        home_num = address_component['long_name']
-
-                    elif address_component['types'][0] == 'route':
-                        street = address_component['long_name']
-
-                    elif address_component['types'][0] == 'locality':
-                        city = address_component['long_name']
-
-                    elif address_component['types'][0] == 'country':
-                        country = address_component['long_name']
-                        country_code = address_component['short_name']  # country code is needed for accessing Holiday API
-
-                resolved_address = Address(street, home_num, city, country, country_code)
-                user.address_object = resolved_address
+            try:
+                status, address_fields = resolve_address(user.address)
+            except UpstreamUnavailableError:
+                return jsonify({'message': geocoding_unavailable_message})
+
+            if status == 'OK':
+                user.address_object = Address(**address_fields)
                 db.session.commit()
 
                 return jsonify({'message': 'Address object added to user\'s info'})
 
-            elif response['status'] == 'ZERO_RESULTS':
+            elif status == 'ZERO_RESULTS':
                 return jsonify({'message': 'Address does not exist. Please provide a valid address'})
 
-            else:   # response['status'] is any other status
+            else:   # status is any other status
                 return jsonify({'message': 'Something went wrong'})
 
         else:  # user does not exist in database
             return jsonify({'message': 'User does not exist. Please create user.'})
 
 
+def find_available_timeslots(user_city, holidays):
+    # returns available timeslots for user_city excluding holidays, shared by sync and async timeslot search.
+    # read only - timeslots on holidays are filtered out, their status is not changed
+    available_timeslots_list = []
+    holiday_dates = [datetime.combine(holiday, datetime.min.time()) for holiday in holidays]
+    # courier status is checked in the same query by joining the courier's row for the timeslot date,
+    # only timeslots supporting user's city are fetched using the city index
+    query = TimeslotsModel.query\
+        .join(TimeslotCitiesModel, TimeslotCitiesModel.timeslot_id == TimeslotsModel.timeslot_id)\
+        .join(CouriersModel, db.and_(CouriersModel.courier_id == TimeslotsModel.courier_id,
+                                     CouriersModel.date == TimeslotsModel.date))\
+        .filter(TimeslotCitiesModel.city == user_city,
+                TimeslotsModel.status == TimeslotsModel.available,
+                CouriersModel.status == CouriersModel.available)
+    if holiday_dates:
+        query = query.filter(~TimeslotsModel.date.in_(holiday_dates))
+    timeslots = query.order_by(TimeslotsModel.timeslot_id).all()
+    for timeslot in timeslots:
+        available_timeslots_list.append(create_timeslot_entry(timeslot))
+
+    return available_timeslots_list
+
+
+def create_timeslot_entry(timeslot):
+    return format_timeslot_entry(timeslot.timeslot_id, timeslot.start_time, timeslot.end_time)
+
+
+def search_available_timeslots(user_city, holidays):
+    # answers from the in-memory availability index once it is built, otherwise from the database
+    if not availability_index.is_built:
+        return find_available_timeslots(user_city, holidays)
+
+    return availability_index.search(user_city, holidays)
+
+
+def find_overlapping_timeslots(range_start, range_end, min_overlap, city):
+    # returns available timeslots that overlap [range_start, range_end) by at least min_overlap, ordered by start time.
+    # A timeslot is shorter than a day, so it is dated on the day before range start at the latest - the date range
+    # predicate is answered by the (status, date) index and only timeslots of these days are checked for overlap
+    first_date = datetime.combine(range_start.date(), datetime.min.time()) - timedelta(days=1)
+    query = db.session.query(TimeslotsModel.timeslot_id, TimeslotsModel.start_time, TimeslotsModel.end_time)\
+        .join(CouriersModel, db.and_(CouriersModel.courier_id == TimeslotsModel.courier_id,
+                                     CouriersModel.date == TimeslotsModel.date))\
+        .filter(TimeslotsModel.status == TimeslotsModel.available,
+                TimeslotsModel.date >= first_date, TimeslotsModel.date < range_end,
+                TimeslotsModel.start_time < range_end, TimeslotsModel.end_time > range_start,
+                CouriersModel.status == CouriersModel.available)
+    if city is not None:
+        query = query.join(TimeslotCitiesModel, TimeslotCitiesModel.timeslot_id == TimeslotsModel.timeslot_id)\
+            .filter(TimeslotCitiesModel.city == city)
+    timeslots = query.order_by(TimeslotsModel.start_time, TimeslotsModel.end_time, TimeslotsModel.timeslot_id).all()
+    return [format_timeslot_entry(timeslot_id, start_time, end_time) for timeslot_id, start_time, end_time in timeslots
+            if min(end_time, range_end) - max(start_time, range_start) >= min_overlap]
+
+
+def search_overlapping_timeslots(range_start, range_end, min_overlap, city=None):
+    # answers from the interval trees of the availability index once it is built, otherwise from the database
+    if not availability_index.is_built:
+        return find_overlapping_timeslots(range_start, range_end, min_overlap, city)
+
+    return availability_index.search_overlapping(range_start, range_end, min_overlap, city)
+
+
 class Timeslots(Resource):
     # vars
     year_for_holiday_API = 2021
+    method_decorators    = {'post': [read_from_replica]}
 
     def __init__(self):
         self.available_timeslots_list = []
         self.user_city                = ''
         self.user_country_code        = ''
-        self.holidays                 = set()
+        self.holidays                 = frozenset()
+        self.address_error            = None    # message set by create_address_object, which runs in a separate thread
 
 
     def post(self, user_email):
@@ -117,118 +200,105 @@ class Timeslots(Resource):
             self.user_country_code = user.country_code
             user_email = user.user_email
             # resolve address_str to object, if user has not done it yet
-            # accessing geocoding and holidays API is done in parallel, using two threads
-            if user.address_object is None:
+            # geocoding runs in a separate thread, in parallel with getting holidays
+            if user.address_city is None:
                 create_address_object_thread = threading.Thread(target=self.create_address_object, args=(user_email,))
-                get_holidays_thread = threading.Thread(target=self.get_holidays)
                 create_address_object_thread.start()
-                get_holidays_thread.start()
+                self.get_holidays()
                 create_address_object_thread.join()
-                get_holidays_thread.join()
+                if self.address_error:
+                    return jsonify({'message': self.address_error})
 
-            else:   # if user has address_object, only access holiday API
-                self.user_city         = user.address_object.city
-                self.user_country_code = user.address_object.country_code
+            else:   # if user has resolved address, only access holiday API
+                self.user_city         = user.address_city
+                self.user_country_code = user.address_country_code
                 self.get_holidays()
 
-            timeslots = TimeslotsModel.query.filter_by(status=TimeslotsModel.available).all()
-            for timeslot in timeslots:
-                courier_id    = timeslot.courier_id
-                timeslot_date = timeslot.date
-                courier       = CouriersModel.query.filter_by(courier_id=courier_id, date=timeslot_date).first()
+            self.available_timeslots_list = search_available_timeslots(self.user_city, self.holidays)
+            return self.available_timeslots_list
 
-                if courier.status == CouriersModel.available and self.is_city_in_supported_addresses(timeslot) \
-                        and not self.is_holiday(timeslot):
-                    self.add_to_available_timeslots(timeslot)
+        else:   # user does not exist in database
+            return jsonify({'message': 'User does not exist. Please create user to see available timeslots'})
 
-                elif self.is_holiday(timeslot):    # if date is holiday, update timeslot as not available
-                    timeslot.status = TimeslotsModel.not_available
 
-            db.session.commit()
+    def get_holidays(self):
+        # year set to 2021 due to limitation of free version of holiday API, contains info about the past, not curr year
+        # tested dates (from courier_timeslots.json) are set in 2021. Holidays are read from the holiday calendar,
+        # until holiday_calendar_job refreshed user's country they are taken from holiday cache
+        holidays = get_calendar_holidays(self.user_country_code, self.year_for_holiday_API)
+        if holidays is not None:
+            self.holidays = holidays
+            return
+
+        holiday_calendar_job.request_refresh(self.user_country_code)
+        try:
+            self.holidays = holiday_cache.get_holidays(self.user_country_code, self.year_for_holiday_API)
+        except Exception:  # timeslots are returned without holiday exclusion, error is counted by holiday cache
+            logger.exception('An error occurred while getting holidays of %s', self.user_country_code)
 
-            return self.available_timeslots_list
 
-        else:   # user does not exist in database
-            return jsonify({'message': 'User does not exist. Please create user to see available timeslots'})
+    def create_address_object(self, user_email):
+        # resolve single line address into class, address is resolved by the shared geocoding resolver (this function
+        # runs in a separate thread and class attribute user_city needs an update). Errors are stored in address_error,
+        # since return value of thread target is lost. App context removes thread's db session on exit
+        with app.app_context():
+            user = UsersModel.query.filter_by(user_email=user_email).first()
+            if user:
+                try:
+                    status, address_fields = resolve_address(user.address)
+                except UpstreamUnavailableError:
+                    self.address_error = geocoding_unavailable_message
+                    return
+                except Exception:
+                    status = None
 
+                if status == 'OK':
+                    self.user_city = address_fields['city']
+                    user.address_object = Address(**address_fields)
+                    db.session.commit()
 
-    def add_to_available_timeslots(self, timeslot):
-        start_time      = timeslot.start_time
-        start_time_str  = start_time.strftime('%d/%m/%Y, %H:%M')
-        end_time        = timeslot.end_time
-        end_time_str    = end_time.strftime('%d/%m/%Y, %H:%M')
-        timeslot_string = '{}-{}'.format(start_time_str, end_time_str)
-        timeslot_id_str = str(timeslot.timeslot_id)
-        self.available_timeslots_list.append([timeslot_id_str, timeslot_string])
+                elif status == 'ZERO_RESULTS':
+                    self.address_error = 'Address does not exist. Please provide a valid address'
 
+                else:
+                    self.address_error = 'Something went wrong'
 
-    def is_city_in_supported_addresses(self, timeslot):
-        supported_addresses_list = timeslot.supported_addresses
-        return (self.user_city in supported_addresses_list)
+            else:  # user does not exist in database
+                self.address_error = 'User does not exist. Please create user.'
 
 
-    def is_holiday(self, timeslot):
-        date = timeslot.date.date()# TODO: check if needed
-        return (date in self.holidays)
+# precomputes holiday calendar in background, started with the app
+holiday_calendar_job = HolidayCalendarJob(holiday_cache, Timeslots.year_for_holiday_API)
 
 
-    def get_holidays(self):
-        hapi       = holidayapi.v1(holiday_api_key)
-        # year set to 2021 due to limitation of free version of holiday API, contains info about the past, not curr year
-        # tested dates (from courier_timeslots.json) are set in 2021
-        parameters = { 'country': self.user_country_code, 'year': self.year_for_holiday_API }
+class TimeslotsSearch(Resource):
+    method_decorators = {'get': [read_from_replica]}
 
+    def get(self):
+        # returns available timeslots overlapping a time range, ordered by start time. Query parameters: start and end
+        # as dd/mm/yyyy, HH:MM, optional duration - minimal overlap in minutes, optional city. Timeslots on holidays
+        # are not excluded, as the search is not made for a user's country
         try:
-            holidays_dict = hapi.holidays(parameters)
-            holidays = holidays_dict['holidays']
-            for holiday in holidays:
-                # all holidays from dict are add to the holidays set (even though some holidays in Irsrael are considered workdays)
-                # TODO: check which holiday is a workday
-                holiday_datetime_obj = datetime.strptime(holiday['date'], '%Y-%m-%d')
-                self.holidays.add(holiday_datetime_obj.date())
-        except:
-            print("An error occurred")
+            range_start, range_end, min_overlap, city = parse_timeslots_range()
+        except (KeyError, ValueError):
+            return jsonify({'message': 'Wrong input. Expected start and end as dd/mm/yyyy, HH:MM (end after start, at '
+                                       'most {} days apart) and duration in minutes'.format(max_num_of_days_for_display)})
 
+        return search_overlapping_timeslots(range_start, range_end, min_overlap, city)
 
-    def create_address_object(self, user_email):
-        # resolve single line address into class, func accesses Google's Geocoding API (could not use func from ResolveAddress
-        # class because this function runs in a separate thread and class attribute user_city needs an update
-        user = UsersModel.query.filter_by(user_email=user_email).first()
-        if user:
-            address_str = user.address
-            params = { 'key': geocoding_api_key, 'address': address_str }
-            base_url = 'https://maps.googleapis.com/maps/api/geocode/json?'
-            response = requests.get(base_url, params=params).json()
-            if response['status'] == 'OK':
-                # extract the relevant info from the response
-                address_components = response['results'][0]['address_components']
-                home_num, street, city, country, country_code = ["", "", "", "", ""]
-                for address_component in address_components:
-                    if address_component['types'][0] == 'street_number':
-                        home_num = address_component['long_name']
-
-                    elif address_component['types'][0] == 'route':
-                        street = address_component['long_name']
-
-                    elif address_component['types'][0] == 'locality':
-                        self.user_city = address_component['long_name']
-
-                    elif address_component['types'][0] == 'country':
-                        country = address_component['long_name']
-                        country_code = address_component['short_name']
-
-                resolved_address = Address(street, home_num, self.user_city, country, country_code)
-                user.address_object = resolved_address
-                db.session.commit()
 
-            elif response['status'] == 'ZERO_RESULTS':
-                return jsonify({'message': 'Address does not exist. Please provide a valid address'})
+def parse_timeslots_range():
+    # raises KeyError or ValueError on wrong input
+    range_start = datetime.strptime(request.args['start'], '%d/%m/%Y, %H:%M')
+    range_end   = datetime.strptime(request.args['end'], '%d/%m/%Y, %H:%M')
+    if not range_start < range_end <= range_start + timedelta(days=max_num_of_days_for_display):
+        raise ValueError('range out of bounds')
 
-            else:
-                return jsonify({'message': 'Something went wrong'})
+    min_overlap = timedelta(minutes=int(request.args.get('duration', 0)))
+    if not timedelta(0) <= min_overlap <= range_end - range_start:
+        raise ValueError('duration out of range')
 
-        else:  # user does not exist in database
-            return jsonify({'message': 'User does not exist. Please create user.'})
+    return range_start, range_end, min_overlap, request.args.get('city')
 
 
 class DeliveryBooking(Resource):
@@ -236,28 +306,13 @@ class DeliveryBooking(Resource):
         # func books a delivery for user provided timeslot_id
         user = UsersModel.query.filter_by(user_email=user_email).first()
         if user:
-            timeslot = TimeslotsModel.query.filter_by(timeslot_id=timeslot_id).with_for_update().first()
-            if timeslot.status == TimeslotsModel.available:
-                timeslot_date = timeslot.date
-                courier_id    = timeslot.courier_id
-                new_delivery  = DeliveriesModel(timeslot_id=timeslot_id, date=timeslot_date, courier_id=courier_id,
-                                                user_email=user_email, status=DeliveriesModel.scheduled)
-                db.session.add(new_delivery)
-                courier = CouriersModel.query.filter_by(courier_id=courier_id).first()
-                # courier status update
-                if courier.num_of_remaining_deliveries > 0: # courier not fully booked
-                    courier.num_of_remaining_deliveries -= 1
-                    if courier.num_of_remaining_deliveries == 0:
-                        courier.status = CouriersModel.full
-
-                # timeslot status update
-                if timeslot.num_of_scheduled_deliveries < TimeslotsModel.max_num_of_deliveries:
-                    timeslot.num_of_scheduled_deliveries += 1
-                    if timeslot.num_of_scheduled_deliveries == TimeslotsModel.max_num_of_deliveries:
-                        timeslot.status = TimeslotsModel.not_available
-
-                db.session.commit()
+            try:
+                is_booked = commit_with_retry(book_timeslot, user_email, timeslot_id)
+            except OperationalError:    # database stayed locked by concurrent transactions
+                return jsonify({'message': 'Booking failed due to high load. Please try again'})
 
+            if is_booked:
+                availability_index.apply_booking(int(timeslot_id))
                 return jsonify({'message': 'Delivery booked!'})
 
             else:   # timeslot is not available
@@ -267,26 +322,244 @@ class DeliveryBooking(Resource):
             return jsonify({'message': 'User does not exist. Please create user to book a timeslot'})
 
 
-def create_delivery_strings_list(delivery_queries_list):
-    deliveries_list = []
-    for delivery_query in delivery_queries_list:
-        delivery_id       = delivery_query.delivery_id
-        timeslot_id       = delivery_query.timeslot_id
-        delivery_date     = delivery_query.date
-        delivery_date_str = delivery_date.strftime('%d/%m/%Y')
-        delivery_string   = 'Delivery ID: {}, Timeslot ID: {}, Delivery date: {}'.format(delivery_id, timeslot_id, delivery_date_str)
-        deliveries_list.append(delivery_string)
-    return deliveries_list
+def book_timeslot(user_email, timeslot_id):
+    # books a delivery using conditional UPDATEs - counters change only while capacity is left, so concurrent bookings
+    # can not overbook the timeslot or the courier's day. Returns False if timeslot is not available. Caller commits
+    timeslot = db.session.query(TimeslotsModel.courier_id, TimeslotsModel.date, TimeslotsModel.start_time)\
+        .filter_by(timeslot_id=timeslot_id).first()
+    if timeslot is None:
+        return False
+
+    user_country_code = db.session.query(UsersModel.resolved_country_code).filter_by(user_email=user_email).scalar()
+    if get_holiday_dates([user_country_code], [timeslot.date]):    # timeslot is on a holiday in user's country
+        return False
+
+    num_of_scheduled_deliveries = TimeslotsModel.num_of_scheduled_deliveries
+    is_timeslot_booked = TimeslotsModel.query\
+        .filter(TimeslotsModel.timeslot_id == timeslot_id, TimeslotsModel.status == TimeslotsModel.available,
+                num_of_scheduled_deliveries < TimeslotsModel.max_num_of_deliveries)\
+        .update({num_of_scheduled_deliveries: num_of_scheduled_deliveries + 1,
+                 TimeslotsModel.status: db.case([(num_of_scheduled_deliveries + 1 >= TimeslotsModel.max_num_of_deliveries,
+                                                  TimeslotsModel.not_available)], else_=TimeslotsModel.status)},
+                synchronize_session=False)
+    if not is_timeslot_booked:
+        return False
+
+    num_of_remaining_deliveries = CouriersModel.num_of_remaining_deliveries
+    is_courier_booked = CouriersModel.query\
+        .filter(CouriersModel.courier_id == timeslot.courier_id, CouriersModel.date == timeslot.date,
+                num_of_remaining_deliveries > 0)\
+        .update({num_of_remaining_deliveries: num_of_remaining_deliveries - 1,
+                 CouriersModel.status: db.case([(num_of_remaining_deliveries - 1 <= 0, CouriersModel.full)],
+                                               else_=CouriersModel.status)},
+                synchronize_session=False)
+    if not is_courier_booked:   # courier's day is fully booked, timeslot update is reverted in the same transaction
+        TimeslotsModel.query.filter_by(timeslot_id=timeslot_id)\
+            .update({num_of_scheduled_deliveries: num_of_scheduled_deliveries - 1,
+                     TimeslotsModel.status: TimeslotsModel.available}, synchronize_session=False)
+        return False
+
+    new_delivery = DeliveriesModel(timeslot_id=timeslot_id, date=timeslot.date, courier_id=timeslot.courier_id,
+                                   user_email=user_email, status=DeliveriesModel.scheduled)
+    db.session.add(new_delivery)
+    db.session.flush()  # delivery id is added to courier's manifest
+    update_courier_manifests(booked_deliveries=[(timeslot.courier_id, timeslot.date, timeslot.start_time,
+                                                 new_delivery.delivery_id)])
+    return True
+
+
+def cancel_delivery(delivery_id):
+    # cancels a delivery and returns its capacity to the timeslot and the courier's day. Returns False if delivery
+    # does not exist (e.g. cancelled by a concurrent request). Caller commits
+    delivery = db.session.query(DeliveriesModel.timeslot_id, DeliveriesModel.courier_id, DeliveriesModel.date,
+                                DeliveriesModel.status).filter_by(delivery_id=delivery_id).first()
+    if delivery is None:
+        return False
+
+    # delivery row is deleted first, so concurrent cancellations of the same delivery return capacity only once
+    is_deleted = DeliveriesModel.query.filter_by(delivery_id=delivery_id).delete(synchronize_session=False)
+    if not is_deleted:
+        return False
+
+    # courier status update
+    num_of_remaining_deliveries = CouriersModel.num_of_remaining_deliveries
+    CouriersModel.query\
+        .filter(CouriersModel.courier_id == delivery.courier_id, CouriersModel.date == delivery.date,
+                num_of_remaining_deliveries < CouriersModel.max_num_of_remaining_deliveries_var)\
+        .update({num_of_remaining_deliveries: num_of_remaining_deliveries + 1,
+                 CouriersModel.status: CouriersModel.available}, synchronize_session=False)
+
+    # timeslot status update
+    num_of_scheduled_deliveries = TimeslotsModel.num_of_scheduled_deliveries
+    TimeslotsModel.query\
+        .filter(TimeslotsModel.timeslot_id == delivery.timeslot_id, num_of_scheduled_deliveries > 0)\
+        .update({num_of_scheduled_deliveries: num_of_scheduled_deliveries - 1,
+                 TimeslotsModel.status: TimeslotsModel.available}, synchronize_session=False)
+    update_courier_manifests(cancelled_deliveries=[(delivery.courier_id, delivery.date, int(delivery_id),
+                                                    delivery.status)])
+    return True
+
+
+def complete_delivery(delivery_id):
+    # marks a scheduled delivery as completed, completing a completed delivery changes nothing. Returns False if
+    # delivery does not exist. Caller commits
+    delivery = db.session.query(DeliveriesModel.courier_id, DeliveriesModel.date).filter_by(delivery_id=delivery_id).first()
+    if delivery is None:
+        return False
+
+    is_completed = DeliveriesModel.query.filter_by(delivery_id=delivery_id, status=DeliveriesModel.scheduled)\
+        .update({DeliveriesModel.status: DeliveriesModel.completed}, synchronize_session=False)
+    if is_completed:
+        update_courier_manifests(completed_deliveries=[(delivery.courier_id, delivery.date, int(delivery_id))])
+    return True
+
+
+class ConcurrentUpdateError(OperationalError):
+    # raised when a guarded UPDATE of a batch did not match all rows, because a concurrent transaction changed them
+    def __init__(self):
+        super().__init__('guarded update', None, 'counters changed by a concurrent transaction')
+
+
+def commit_with_retry(func, *args):
+    # runs func and commits its changes. If the database is locked by a concurrent transaction (or a batch lost a race
+    # with one), the transaction is rolled back and retried with exponential backoff and jitter, up to
+    # max_num_of_db_attempts times
+    for attempt in range(max_num_of_db_attempts):
+        try:
+            result = func(*args)
+            db.session.commit()
+            return result
+
+        except OperationalError:
+            db.session.rollback()
+            if attempt == max_num_of_db_attempts - 1:
+                raise
+            time.sleep(db_retry_delay_seconds * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def create_delivery_entry(delivery_query):
+    return { 'delivery_id': delivery_query.delivery_id, 'timeslot_id': delivery_query.timeslot_id,
+             'courier_id': delivery_query.courier_id, 'date': delivery_query.date.strftime('%d/%m/%Y'),
+             'status': delivery_status_names[delivery_query.status] }
+
+
+def parse_deliveries_window(default_start_date, default_num_of_days):
+    # reads optional query parameters: date (dd/mm/yyyy, first day of the window), num_of_days, courier_id,
+    # limit (page size), after (cursor returned with previous page) and format (json or ndjson).
+    # raises ValueError on wrong input
+    start_date_str = request.args.get('date')
+    start_date     = datetime.strptime(start_date_str, '%d/%m/%Y') if start_date_str else default_start_date
+    num_of_days    = int(request.args.get('num_of_days', default_num_of_days))
+    if not 1 <= num_of_days <= max_num_of_days_for_display:
+        raise ValueError('num_of_days out of range')
+
+    courier_id_str = request.args.get('courier_id')
+    courier_id     = int(courier_id_str) if courier_id_str is not None else None
+    limit_str      = request.args.get('limit')
+    limit          = int(limit_str) if limit_str is not None else None
+    if limit is not None and not 1 <= limit <= max_page_size:
+        raise ValueError('limit out of range')
+
+    cursor_str     = request.args.get('after')
+    cursor         = parse_cursor(cursor_str) if cursor_str else None
+    response_format = request.args.get('format', 'json')
+    if response_format not in ('json', 'ndjson'):
+        raise ValueError('unknown format')
+
+    return DeliveriesWindow(start_date, num_of_days, courier_id, limit, cursor, response_format)
+
+
+def create_cursor(delivery):
+    # deliveries are ordered by (date, delivery_id), cursor keeps both so the next page starts with a keyset condition
+    return '{}-{}'.format(delivery.date.strftime('%Y%m%d'), delivery.delivery_id)
+
+
+def parse_cursor(cursor_str):
+    date_str, delivery_id_str = cursor_str.split('-')
+    return datetime.strptime(date_str, '%Y%m%d'), int(delivery_id_str)
+
+
+def query_deliveries_in_range(window):
+    # single range query on the date index instead of a query per day, rows are fetched in chunks while streaming
+    end_date = window.start_date + timedelta(days=window.num_of_days)
+    query = DeliveriesModel.query.filter(DeliveriesModel.date >= window.start_date, DeliveriesModel.date < end_date)
+    if window.courier_id is not None:
+        query = query.filter(DeliveriesModel.courier_id == window.courier_id)
+    if window.cursor is not None:   # keyset pagination - continues after the last delivery of previous page
+        cursor_date, cursor_delivery_id = window.cursor
+        query = query.filter(db.or_(DeliveriesModel.date > cursor_date,
+                                    db.and_(DeliveriesModel.date == cursor_date,
+                                            DeliveriesModel.delivery_id > cursor_delivery_id)))
+    query = query.order_by(DeliveriesModel.date, DeliveriesModel.delivery_id)
+    if window.limit is not None:
+        return query.limit(window.limit + 1).all()     # extra row tells if there is a next page
+
+    return query.yield_per(1000)
+
+
+def stream_deliveries_per_day(deliveries):
+    # streams JSON object of delivery date -> list of deliveries, deliveries are ordered by date
+    yield '{'
+    for day_num, (date, day_deliveries) in enumerate(groupby(deliveries, key=lambda delivery: delivery.date)):
+        yield '{}{}: ['.format(',' if day_num else '', json.dumps(date.strftime('%d/%m/%Y')))
+        for delivery_num, delivery in enumerate(day_deliveries):
+            yield '{}{}'.format(',' if delivery_num else '', json.dumps(create_delivery_entry(delivery)))
+        yield ']'
+    yield '}\n'
+
+
+def stream_deliveries_ndjson(deliveries):
+    for delivery in deliveries:
+        yield json.dumps(create_delivery_entry(delivery)) + '\n'
+
+
+def get_deliveries_response(window, no_deliveries_message):
+    if window.limit is not None:
+        return get_deliveries_page_response(window)
+
+    deliveries = iter(query_deliveries_in_range(window))
+    first_delivery = next(deliveries, None)
+    if first_delivery is None:
+        return jsonify({'message': no_deliveries_message})
+
+    deliveries = chain([first_delivery], deliveries)
+    if window.response_format == 'ndjson':
+        return Response(stream_with_context(stream_deliveries_ndjson(deliveries)), mimetype='application/x-ndjson')
+
+    return Response(stream_with_context(stream_deliveries_per_day(deliveries)), mimetype='application/json')
+
+
+def get_deliveries_page_response(window):
+    # single page of at most limit deliveries, next_cursor is None on the last page
+    deliveries  = query_deliveries_in_range(window)
+    next_cursor = create_cursor(deliveries[window.limit - 1]) if len(deliveries) > window.limit else None
+    deliveries  = deliveries[:window.limit]
+    if window.response_format == 'ndjson':
+        response = Response(stream_deliveries_ndjson(deliveries), mimetype='application/x-ndjson')
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+
+    return jsonify({'deliveries': [create_delivery_entry(delivery) for delivery in deliveries],
+                    'next_cursor': next_cursor})
 
 
 class Deliveries(Resource):
+    method_decorators = {'get': [read_from_replica]}
+
     def post(self, user_email, delivery_id):
         # marks delivery as complete
         user     = UsersModel.query.filter_by(user_email=user_email).first()
         delivery = DeliveriesModel.query.filter_by(delivery_id=delivery_id).first()
         if user and delivery:
-            delivery.status = DeliveriesModel.completed
-            db.session.commit()
+            try:
+                is_completed = commit_with_retry(complete_delivery, delivery_id)
+            except OperationalError:    # database stayed locked by concurrent transactions
+                return jsonify({'message': 'Completion failed due to high load. Please try again'})
+
+            if not is_completed:    # cancelled by a concurrent request
+                return jsonify({'message': 'Delivery does not exist'})
+
             return jsonify({'message': 'Delivery completed'})
 
         elif user and not delivery:   # user exists, but no delivery with delivery_id exists
@@ -301,24 +574,16 @@ class Deliveries(Resource):
         user     = UsersModel.query.filter_by(user_email=user_email).first()
         delivery = DeliveriesModel.query.filter_by(delivery_id=delivery_id).first()
         if user and delivery:
-            courier_id = delivery.courier_id
-            courier    = CouriersModel.query.filter_by(courier_id=courier_id).first()
-            # courier status update
-            if courier.num_of_remaining_deliveries < CouriersModel.max_num_of_remaining_deliveries_var: # courier not fully booked
-                courier.num_of_remaining_deliveries += 1
-                if courier.status == CouriersModel.full:
-                    courier.status = CouriersModel.available
-
-            # timeslot status update
             timeslot_id = delivery.timeslot_id
-            timeslot    = TimeslotsModel.query.filter_by(timeslot_id=timeslot_id).first()
-            if timeslot.num_of_scheduled_deliveries > 0:
-                timeslot.num_of_scheduled_deliveries -= 1
-            if timeslot.status == TimeslotsModel.not_available:  # status before deletion was full
-                timeslot.status = TimeslotsModel.available
+            try:
+                is_cancelled = commit_with_retry(cancel_delivery, delivery_id)
+            except OperationalError:    # database stayed locked by concurrent transactions
+                return jsonify({'message': 'Cancellation failed due to high load. Please try again'})
 
-            db.session.delete(delivery)
-            db.session.commit()
+            if not is_cancelled:    # cancelled by a concurrent request
+                return jsonify({'message': 'Delivery does not exist'})
+
+            availability_index.apply_cancellation(timeslot_id)
             return jsonify({'message': 'Delivery deleted'})
 
         elif user and not delivery:
@@ -329,69 +594,447 @@ class Deliveries(Resource):
 
 
     def get(self):
-        # returns list of daily deliveries
-        #today = datetime.now()
-        # today's date is simulated for testing as the Holiday API provides info for 2021
-        today            = datetime(2021, 7, 19)
-        date_today       = today.replace(hour=0, minute=0, second=0, microsecond=0)
-        daily_deliveries = DeliveriesModel.query.filter_by(date=date_today).all()
-        if daily_deliveries:
-            daily_deliveries_list = create_delivery_strings_list(daily_deliveries)
-            return daily_deliveries_list
+        # returns daily deliveries grouped by date, see parse_deliveries_window for optional query parameters
+        try:
+            window = parse_deliveries_window(simulated_today_daily, 1)
+        except ValueError:
+            return jsonify({'message': wrong_deliveries_window_message})
 
-        else:   # no deliveries today
-            return jsonify({'message': 'No deliveries today'})
+        return get_deliveries_response(window, 'No deliveries today')
 
 
 class WeeklyDeliveries(Resource):
     # vars
     num_of_days_for_display = 7
+    method_decorators       = {'get': [read_from_replica]}
 
-    def __init__(self):
-        self.curr_week_dates_list = []
+    def get(self):
+        # retrieves all weekly deliveries (starting from today) grouped by date, see parse_deliveries_window for optional
+        # query parameters
+        try:
+            window = parse_deliveries_window(simulated_today_weekly, self.num_of_days_for_display)
+        except ValueError:
+            return jsonify({'message': wrong_deliveries_window_message})
 
+        return get_deliveries_response(window, 'No deliveries this week')
+
+
+class CourierManifest(Resource):
+    method_decorators = {'get': [read_from_replica]}
+
+    def get(self, courier_id, date_str=None):
+        # precomputed manifest of courier's day (date as dd-mm-yyyy, today by default) - a single primary key lookup.
+        # ETag is the manifest version, a request with matching If-None-Match gets 304 without body
+        try:
+            date = datetime.strptime(date_str, '%d-%m-%Y') if date_str else simulated_today_daily
+        except ValueError:
+            return jsonify({'message': 'Wrong input. Expected date as dd-mm-yyyy'})
+
+        manifest = CourierManifestsModel.query.get((courier_id, date))
+        etag = get_manifest_etag(courier_id, date, manifest.version if manifest else 0)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(create_manifest_body(courier_id, date, manifest))
+        response.set_etag(etag)
+        return response
 
-    def get(self):
-        # retrieves all weekly deliveries (starting from today)
-        self.create_curr_week_dates_list()
-        weekly_deliveries_list = []
-        for date in self.curr_week_dates_list:
-            curr_date_deliveries = DeliveriesModel.query.filter_by(date=date).all()
-            if curr_date_deliveries:
-                curr_date_deliveries_list = create_delivery_strings_list(curr_date_deliveries)
-                weekly_deliveries_list += curr_date_deliveries_list
 
-        if weekly_deliveries_list:
-            return weekly_deliveries_list
+class DeliveriesBatch(Resource):
+    # books or cancels many deliveries in a single transaction, results are returned per item in request order
 
-        else:   # no deliveries this week
-            return jsonify({'message': 'No deliveries this week'})
+    def post(self):
+        # books deliveries, request body is a JSON list of {"user_email": ..., "timeslot_id": ...}
+        bookings = request.get_json(silent=True)
+        if not isinstance(bookings, list) or not all(is_valid_booking(booking) for booking in bookings):
+            return jsonify({'message': 'Wrong input. Expected a list of {"user_email": ..., "timeslot_id": ...}'})
 
-    def create_curr_week_dates_list(self):
-        # creates list of dates for current week for displaying weekly deliveries
-        #today = datetime.now()
-        # today's date is simulated for testing as the Holiday API provides info for 2021
-        today      = datetime(2021, 7, 17)
-        date_today = today.replace(hour=0, minute=0, second=0, microsecond=0)
-        for days_delta in range(self.num_of_days_for_display):
-            date = date_today + timedelta(days=days_delta)
-            self.curr_week_dates_list.append(date)
+        bookings = [(booking['user_email'], int(booking['timeslot_id'])) for booking in bookings]
+        try:
+            results = commit_with_retry(book_timeslots_batch, bookings)
+        except OperationalError:    # database stayed locked by concurrent transactions
+            return jsonify({'message': 'Booking failed due to high load. Please try again'})
+
+        for result in results:
+            if 'delivery_id' in result:
+                availability_index.apply_booking(result['timeslot_id'])
+
+        return jsonify(results)
+
+
+    def delete(self):
+        # cancels deliveries, request body is a JSON list of delivery ids
+        delivery_ids = request.get_json(silent=True)
+        if not isinstance(delivery_ids, list) or not all(is_valid_id(delivery_id) for delivery_id in delivery_ids):
+            return jsonify({'message': 'Wrong input. Expected a list of delivery ids'})
+
+        delivery_ids = [int(delivery_id) for delivery_id in delivery_ids]
+        try:
+            results = commit_with_retry(cancel_deliveries_batch, delivery_ids)
+        except OperationalError:    # database stayed locked by concurrent transactions
+            return jsonify({'message': 'Cancellation failed due to high load. Please try again'})
+
+        for result in results:
+            if 'timeslot_id' in result:
+                availability_index.apply_cancellation(result['timeslot_id'])
+
+        return jsonify(results)
+
+
+class DeliveriesAssignment(Resource):
+    def post(self):
+        # assigns many delivery requests to timeslots in a single transaction, request body is a JSON list of
+        # {"user_email": ..., "preferred_windows": [["dd/mm/yyyy, HH:MM", "dd/mm/yyyy, HH:MM"], ...]}. Unlike
+        # DeliveriesBatch the timeslots are chosen by the server, results are returned per item in request order
+        delivery_requests = request.get_json(silent=True)
+        if isinstance(delivery_requests, list):
+            delivery_requests = [parse_delivery_request(delivery_request) for delivery_request in delivery_requests]
+        if not isinstance(delivery_requests, list) or None in delivery_requests:
+            return jsonify({'message': 'Wrong input. Expected a list of {"user_email": ..., "preferred_windows": '
+                                       '[["dd/mm/yyyy, HH:MM", "dd/mm/yyyy, HH:MM"], ...]}'})
+
+        try:
+            results = commit_with_retry(assign_timeslots_batch, delivery_requests)
+        except OperationalError:    # database stayed locked by concurrent transactions
+            return jsonify({'message': 'Booking failed due to high load. Please try again'})
+
+        for result in results:
+            if 'delivery_id' in result:
+                availability_index.apply_booking(result['timeslot_id'])
+
+        return jsonify(results)
+
+
+def parse_delivery_request(delivery_request):
+    # returns (user_email, preferred_windows) of {"user_email": ..., "preferred_windows": [[start, end], ...]}, times
+    # are dd/mm/yyyy, HH:MM. Returns None if the request is not valid
+    if not isinstance(delivery_request, dict) or not isinstance(delivery_request.get('user_email'), str) \
+            or not isinstance(delivery_request.get('preferred_windows'), list):
+        return None
+
+    preferred_windows = []
+    for window in delivery_request['preferred_windows']:
+        if not isinstance(window, list) or len(window) != 2 or not all(isinstance(time_str, str) for time_str in window):
+            return None
+        try:
+            window_start_time, window_end_time = [datetime.strptime(time_str, '%d/%m/%Y, %H:%M') for time_str in window]
+        except ValueError:
+            return None
+        preferred_windows.append((window_start_time, window_end_time))
+    return delivery_request['user_email'], preferred_windows
+
+
+def is_valid_booking(booking):
+    return isinstance(booking, dict) and isinstance(booking.get('user_email'), str) \
+        and is_valid_id(booking.get('timeslot_id'))
+
+
+def is_valid_id(value):
+    return (isinstance(value, int) and not isinstance(value, bool)) or (isinstance(value, str) and value.isdigit())
+
+
+def book_timeslots_batch(bookings):
+    # books list of (user_email, timeslot_id). Capacity of all requested timeslots and courier days is read with one
+    # query per table, bookings are allocated in request order and counters are updated with one guarded executemany
+    # per table. If a concurrent transaction changed the counters in between, ConcurrentUpdateError is raised and the
+    # whole batch is retried. Caller commits
+    user_emails  = list({user_email for user_email, _ in bookings})
+    timeslot_ids = list({timeslot_id for _, timeslot_id in bookings})
+    user_country_codes = {}
+    for user_emails_chunk in chunks(user_emails):
+        user_country_codes.update(db.session.query(UsersModel.user_email, UsersModel.resolved_country_code)
+                                  .filter(UsersModel.user_email.in_(user_emails_chunk)))
+    timeslots = {}
+    for timeslot_ids_chunk in chunks(timeslot_ids):
+        timeslots.update((timeslot.timeslot_id, timeslot) for timeslot in
+                         db.session.query(TimeslotsModel.timeslot_id, TimeslotsModel.courier_id, TimeslotsModel.date,
+                                          TimeslotsModel.start_time, TimeslotsModel.status,
+                                          TimeslotsModel.num_of_scheduled_deliveries)
+                         .filter(TimeslotsModel.timeslot_id.in_(timeslot_ids_chunk)))
+    courier_ids = list({timeslot.courier_id for timeslot in timeslots.values()})
+    batch_dates = list({timeslot.date for timeslot in timeslots.values()})
+    courier_dates = {}
+    for courier_ids_chunk in chunks(courier_ids):
+        courier_dates.update(((courier.courier_id, courier.date), courier.num_of_remaining_deliveries) for courier in
+                             db.session.query(CouriersModel.courier_id, CouriersModel.date,
+                                              CouriersModel.num_of_remaining_deliveries)
+                             .filter(CouriersModel.courier_id.in_(courier_ids_chunk),
+                                     CouriersModel.date.in_(batch_dates)))
+    holiday_dates = get_holiday_dates(user_country_codes.values(), [timeslot.date for timeslot in timeslots.values()])
+
+    # allocation in request order
+    remaining_per_timeslot = {timeslot_id: TimeslotsModel.max_num_of_deliveries - timeslot.num_of_scheduled_deliveries
+                              if timeslot.status == TimeslotsModel.available else 0
+                              for timeslot_id, timeslot in timeslots.items()}
+    remaining_per_courier_date = dict(courier_dates)
+    results, new_bookings = [], []
+    for user_email, timeslot_id in bookings:
+        result = {'user_email': user_email, 'timeslot_id': timeslot_id}
+        timeslot = timeslots.get(timeslot_id)
+        courier_date = (timeslot.courier_id, timeslot.date) if timeslot else None
+        if user_email not in user_country_codes:
+            result['message'] = 'User does not exist. Please create user to book a timeslot'
+
+        elif timeslot is None or remaining_per_timeslot[timeslot_id] <= 0 \
+                or remaining_per_courier_date.get(courier_date, 0) <= 0 \
+                or (user_country_codes[user_email], timeslot.date) in holiday_dates:
+            result['message'] = 'Timeslot is not available. Please choose another timeslot'
+
+        else:
+            remaining_per_timeslot[timeslot_id] -= 1
+            remaining_per_courier_date[courier_date] -= 1
+            new_bookings.append((result, timeslot_id, timeslot.courier_id, timeslot.date, timeslot.start_time,
+                                 user_email))
+            result['message'] = 'Delivery booked!'
+        results.append(result)
+
+    save_batch_bookings(new_bookings)
+    return results
+
+
+def assign_timeslots_batch(delivery_requests):
+    # assigns list of (user_email, preferred_windows) to timeslots, windows are (start_time, end_time) in preference
+    # order. Candidates of a request are available timeslots of user's city that fit in one of its windows, the
+    # assignment books the largest number of requests without exceeding remaining deliveries of timeslots and courier
+    # days (max flow, see AssignmentGraph). Capacity is read with one query per table (per chunk), bookings are saved
+    # with save_batch_bookings. Caller commits
+    user_emails = list({user_email for user_email, _ in delivery_requests})
+    users = {}
+    for user_emails_chunk in chunks(user_emails):
+        users.update((user.user_email, user) for user in
+                     db.session.query(UsersModel.user_email, UsersModel.resolved_country_code.label('country_code'),
+                                      UsersModel.address_city)
+                     .filter(UsersModel.user_email.in_(user_emails_chunk)))
+    cities  = list({user.address_city for user in users.values() if user.address_city is not None})
+    windows = [window for _, preferred_windows in delivery_requests for window in preferred_windows]
+    timeslots, city_timeslots = {}, {}
+    if cities and windows:
+        first_start_time = min(start_time for start_time, _ in windows)
+        last_end_time    = max(end_time for _, end_time in windows)
+        for cities_chunk in chunks(cities):
+            for timeslot in db.session.query(TimeslotCitiesModel.city, TimeslotsModel.timeslot_id,
+                                             TimeslotsModel.courier_id, TimeslotsModel.date, TimeslotsModel.start_time,
+                                             TimeslotsModel.end_time, TimeslotsModel.num_of_scheduled_deliveries)\
+                    .join(TimeslotsModel, TimeslotsModel.timeslot_id == TimeslotCitiesModel.timeslot_id)\
+                    .filter(TimeslotCitiesModel.city.in_(cities_chunk),
+                            TimeslotsModel.status == TimeslotsModel.available,
+                            TimeslotsModel.start_time >= first_start_time, TimeslotsModel.start_time < last_end_time):
+                timeslots[timeslot.timeslot_id] = timeslot
+                city_timeslots.setdefault(timeslot.city, []).append(
+                    (timeslot.start_time, timeslot.end_time, timeslot.timeslot_id))
+    city_timeslots = {city: CityTimeslots(city_timeslots_list) for city, city_timeslots_list in city_timeslots.items()}
+
+    courier_ids   = list({timeslot.courier_id for timeslot in timeslots.values()})
+    courier_dates = {}
+    if timeslots:
+        first_date = min(timeslot.date for timeslot in timeslots.values())
+        last_date  = max(timeslot.date for timeslot in timeslots.values())
+        for courier_ids_chunk in chunks(courier_ids):
+            courier_dates.update(((courier.courier_id, courier.date), courier.num_of_remaining_deliveries) for courier in
+                                 db.session.query(CouriersModel.courier_id, CouriersModel.date,
+                                                  CouriersModel.num_of_remaining_deliveries)
+                                 .filter(CouriersModel.courier_id.in_(courier_ids_chunk),
+                                         CouriersModel.date >= first_date, CouriersModel.date <= last_date))
+    holiday_dates = get_holiday_dates([user.country_code for user in users.values()],
+                                      [timeslot.date for timeslot in timeslots.values()])
+
+    assignment_graph = AssignmentGraph(
+        {timeslot_id: TimeslotsModel.max_num_of_deliveries - timeslot.num_of_scheduled_deliveries
+         for timeslot_id, timeslot in timeslots.items()},
+        {timeslot_id: (timeslot.courier_id, timeslot.date) for timeslot_id, timeslot in timeslots.items()},
+        courier_dates)
+    results = []
+    for user_email, preferred_windows in delivery_requests:
+        result = {'user_email': user_email}
+        user = users.get(user_email)
+        candidate_group_keys = []
+        if user is None:
+            result['message'] = 'User does not exist. Please create user to book a timeslot'
+
+        elif user.address_city is None:
+            result['message'] = 'Address is not resolved. Please resolve address to book a timeslot'
+
+        elif user.address_city in city_timeslots:
+            # timeslots of the same city and time range are interchangeable for the request
+            user_city_timeslots = city_timeslots[user.address_city]
+            for window_start_time, window_end_time in preferred_windows:
+                for time_range in user_city_timeslots.find_in_window(window_start_time, window_end_time):
+                    group_key = (user.address_city, time_range)
+                    timeslot_ids = user_city_timeslots.timeslot_ids[time_range]
+                    if (user.country_code, timeslots[timeslot_ids[0]].date) not in holiday_dates \
+                            and group_key not in candidate_group_keys:
+                        assignment_graph.add_group(group_key, timeslot_ids)
+                        candidate_group_keys.append(group_key)
+        assignment_graph.add_request(candidate_group_keys)
+        results.append(result)
+
+    new_bookings = []
+    for result, timeslot_id in zip(results, assignment_graph.solve()):
+        if timeslot_id is not None:
+            timeslot = timeslots[timeslot_id]
+            new_bookings.append((result, timeslot_id, timeslot.courier_id, timeslot.date, timeslot.start_time,
+                                 result['user_email']))
+            result['timeslot_id'] = timeslot_id
+            result['message']     = 'Delivery booked!'
+
+        elif 'message' not in result:
+            result['message'] = 'No timeslot is available in preferred windows'
+
+    save_batch_bookings(new_bookings)
+    return results
+
+
+def save_batch_bookings(new_bookings):
+    # new_bookings - list of (result, timeslot_id, courier_id, date, start_time, user_email). Counters are updated with
+    # one guarded executemany per table, if a concurrent transaction changed them in between ConcurrentUpdateError is
+    # raised. Delivery ids are added to the results and to courier manifests
+    if not new_bookings:
+        return
+
+    booked_per_timeslot, booked_per_courier_date = {}, {}
+    for _, timeslot_id, courier_id, date, _, _ in new_bookings:
+        booked_per_timeslot[timeslot_id] = booked_per_timeslot.get(timeslot_id, 0) + 1
+        booked_per_courier_date[(courier_id, date)] = booked_per_courier_date.get((courier_id, date), 0) + 1
+
+    timeslots_table = TimeslotsModel.__table__
+    num_of_scheduled_deliveries = timeslots_table.c.num_of_scheduled_deliveries
+    updated = db.session.execute(
+        timeslots_table.update()
+        .where(db.and_(timeslots_table.c.timeslot_id == db.bindparam('b_timeslot_id'),
+                       timeslots_table.c.status == TimeslotsModel.available,
+                       num_of_scheduled_deliveries + db.bindparam('b_booked') <= TimeslotsModel.max_num_of_deliveries))
+        .values(num_of_scheduled_deliveries=num_of_scheduled_deliveries + db.bindparam('b_booked'),
+                status=db.case([(num_of_scheduled_deliveries + db.bindparam('b_booked') >= TimeslotsModel.max_num_of_deliveries,
+                                 TimeslotsModel.not_available)], else_=timeslots_table.c.status)),
+        [{'b_timeslot_id': timeslot_id, 'b_booked': booked} for timeslot_id, booked in booked_per_timeslot.items()])
+    if updated.rowcount != len(booked_per_timeslot):
+        raise ConcurrentUpdateError()
+
+    couriers_table = CouriersModel.__table__
+    num_of_remaining_deliveries = couriers_table.c.num_of_remaining_deliveries
+    updated = db.session.execute(
+        couriers_table.update()
+        .where(db.and_(couriers_table.c.courier_id == db.bindparam('b_courier_id'),
+                       couriers_table.c.date == db.bindparam('b_date'),
+                       num_of_remaining_deliveries >= db.bindparam('b_booked')))
+        .values(num_of_remaining_deliveries=num_of_remaining_deliveries - db.bindparam('b_booked'),
+                status=db.case([(num_of_remaining_deliveries - db.bindparam('b_booked') <= 0, CouriersModel.full)],
+                               else_=couriers_table.c.status)),
+        [{'b_courier_id': courier_id, 'b_date': date, 'b_booked': booked}
+         for (courier_id, date), booked in booked_per_courier_date.items()])
+    if updated.rowcount != len(booked_per_courier_date):
+        raise ConcurrentUpdateError()
+
+    new_deliveries = [(result, DeliveriesModel(timeslot_id=timeslot_id, date=date, courier_id=courier_id,
+                                               user_email=user_email, status=DeliveriesModel.scheduled))
+                      for result, timeslot_id, courier_id, date, _, user_email in new_bookings]
+    db.session.add_all([new_delivery for _, new_delivery in new_deliveries])
+    db.session.flush()  # delivery ids are returned to the caller
+    for result, new_delivery in new_deliveries:
+        result['delivery_id'] = new_delivery.delivery_id
+    update_courier_manifests(booked_deliveries=[(courier_id, date, start_time, result['delivery_id'])
+                                                for result, _, courier_id, date, start_time, _ in new_bookings])
+
+
+def cancel_deliveries_batch(delivery_ids):
+    # cancels list of delivery ids with one DELETE and one executemany per counter table. Caller commits
+    deliveries = {}
+    for delivery_ids_chunk in chunks(list(set(delivery_ids))):
+        deliveries.update((delivery.delivery_id, delivery) for delivery in
+                          db.session.query(DeliveriesModel.delivery_id, DeliveriesModel.timeslot_id,
+                                           DeliveriesModel.courier_id, DeliveriesModel.date, DeliveriesModel.status)
+                          .filter(DeliveriesModel.delivery_id.in_(delivery_ids_chunk)))
+
+    num_of_deleted = 0
+    for delivery_ids_chunk in chunks(list(deliveries)):
+        num_of_deleted += DeliveriesModel.query.filter(DeliveriesModel.delivery_id.in_(delivery_ids_chunk))\
+            .delete(synchronize_session=False)
+    if num_of_deleted != len(deliveries):   # some deliveries were cancelled by a concurrent request
+        raise ConcurrentUpdateError()
+
+    cancelled_per_timeslot, cancelled_per_courier_date = {}, {}
+    for delivery in deliveries.values():
+        courier_date = (delivery.courier_id, delivery.date)
+        cancelled_per_timeslot[delivery.timeslot_id] = cancelled_per_timeslot.get(delivery.timeslot_id, 0) + 1
+        cancelled_per_courier_date[courier_date] = cancelled_per_courier_date.get(courier_date, 0) + 1
+
+    if deliveries:
+        timeslots_table = TimeslotsModel.__table__
+        num_of_scheduled_deliveries = timeslots_table.c.num_of_scheduled_deliveries
+        db.session.execute(
+            timeslots_table.update()
+            .where(db.and_(timeslots_table.c.timeslot_id == db.bindparam('b_timeslot_id'),
+                           num_of_scheduled_deliveries >= db.bindparam('b_cancelled')))
+            .values(num_of_scheduled_deliveries=num_of_scheduled_deliveries - db.bindparam('b_cancelled'),
+                    status=TimeslotsModel.available),
+            [{'b_timeslot_id': timeslot_id, 'b_cancelled': cancelled}
+             for timeslot_id, cancelled in cancelled_per_timeslot.items()])
+
+        couriers_table = CouriersModel.__table__
+        num_of_remaining_deliveries = couriers_table.c.num_of_remaining_deliveries
+        db.session.execute(
+            couriers_table.update()
+            .where(db.and_(couriers_table.c.courier_id == db.bindparam('b_courier_id'),
+                           couriers_table.c.date == db.bindparam('b_date'),
+                           num_of_remaining_deliveries + db.bindparam('b_cancelled')
+                           <= CouriersModel.max_num_of_remaining_deliveries_var))
+            .values(num_of_remaining_deliveries=num_of_remaining_deliveries + db.bindparam('b_cancelled'),
+                    status=CouriersModel.available),
+            [{'b_courier_id': courier_id, 'b_date': date, 'b_cancelled': cancelled}
+             for (courier_id, date), cancelled in cancelled_per_courier_date.items()])
+        update_courier_manifests(cancelled_deliveries=[(delivery.courier_id, delivery.date, delivery.delivery_id,
+                                                        delivery.status) for delivery in deliveries.values()])
+
+    # a delivery id that appears twice in the request is cancelled once
+    results, cancelled_delivery_ids = [], set()
+    for delivery_id in delivery_ids:
+        if delivery_id in deliveries and delivery_id not in cancelled_delivery_ids:
+            cancelled_delivery_ids.add(delivery_id)
+            results.append({'delivery_id': delivery_id, 'timeslot_id': deliveries[delivery_id].timeslot_id,
+                            'message': 'Delivery deleted'})
+        else:
+            results.append({'delivery_id': delivery_id, 'message': 'Delivery does not exist'})
+    return results
 
 
 
 # API build
+class Metrics(Resource):
+    def get(self):
+        # request latency, SQL queries per request and phase duration histograms in Prometheus text format
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+instrument_app(app, api)
 api.add_resource(User, "/create-user/<string:address_str>/<string:country_code>/<string:user_name>/<string:user_email>")
 api.add_resource(ResolveAddress, "/resolve-address/<string:user_email>")
 api.add_resource(Timeslots, '/timeslots/<string:user_email>')
+api.add_resource(TimeslotsSearch, '/timeslots/search')
 api.add_resource(DeliveryBooking, '/deliveries/<string:user_email>/<string:timeslot_id>')
 api.add_resource(Deliveries, '/deliveries/<string:user_email>/<string:delivery_id>/completed',
                              '/deliveries/<string:user_email>/<string:delivery_id>', '/deliveries/daily')
 api.add_resource(WeeklyDeliveries, '/deliveries/weekly')
+api.add_resource(DeliveriesBatch, '/deliveries/batch')
+api.add_resource(DeliveriesAssignment, '/deliveries/batch/assign')
+api.add_resource(CourierManifest, '/couriers/<int:courier_id>/manifest',
+                 '/couriers/<int:courier_id>/manifest/<string:date_str>')
+api.add_resource(Metrics, '/metrics')
+
+
+def create_app(courier_files=('courier_timeslots.json',)):
+    # application factory - opens holidays cache file, checks the schema, reloads courier files that changed since the
+    # last start and builds the availability index (unless it is disabled). Upstream API clients are created on first use
+    holiday_cache.open_persistence(os.path.abspath(holidays_cache_path))
+    with app.app_context():
+        init_database()
+        load_changed_courier_files(courier_files)
+        if availability_index_refresh_job.refresh_interval_seconds > 0:
+            availability_index.build()
+    if availability_index_refresh_job.refresh_interval_seconds > 0:
+        availability_index_refresh_job.start()
+    holiday_calendar_job.start()
+    return app
 
 
 if __name__ == '__main__':
-    database_filename = os.path.abspath(os.getcwd()) + "/database.db"
-    if not os.path.exists(database_filename):
-        db.create_all()
-    load_courier_timeslots('courier_timeslots.json')
-    app.run(debug=False)
+    create_app().run(debug=False)
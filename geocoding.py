@@ -0,0 +1,153 @@
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from database_init import db, GeocodeCacheModel
+from api_keys import geocoding_api_key
+from upstream_client import UpstreamClient, UpstreamUnavailableError, get_json
+
+geocoding_base_url = 'https://maps.googleapis.com/maps/api/geocode/json?'
+# cache vars
+geocode_cache_ttl         = timedelta(days=30)
+geocode_cache_max_entries = 100000
+geocode_cache_evict_batch = 1000    # oldest entries evicted together once cache size exceeds the limit
+# only final answers are cached, any other status (quota, server error) is retried on next request
+cacheable_statuses        = ('OK', 'ZERO_RESULTS')
+# status of a call that Geocoding API answered with an error (4xx) or with a malformed body
+geocoding_error_status    = 'UNKNOWN_ERROR'
+# Geocoding API default limit is 50 requests per second. A request thread waits for geocoding at most 4 seconds
+geocoding_client = UpstreamClient('geocode', rate_per_second=50, burst=50, timeout_seconds=2, deadline_seconds=4)
+# cache size as seen by this process - counted on first insert and after eviction, increased by inserts. Entries
+# inserted by other processes are counted at the next recount, the limit may be exceeded by them until then
+geocode_cache_size      = None
+geocode_cache_size_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+def normalize_address(address_str):
+    # addresses that differ only in case, whitespace or punctuation share one cache entry
+    address_str = re.sub(r'[^\w\s]', ' ', address_str.lower())
+    return ' '.join(address_str.split())
+
+
+def resolve_address(address_str):
+    # resolves single line address, func accesses Google's Geocoding API only if the address is not cached.
+    # returns geocoding status and dict of address fields (None if status is not 'OK'). While Geocoding API is not
+    # available an expired cache entry is returned, UpstreamUnavailableError is raised if there is none. An error
+    # response or a malformed body is returned as geocoding_error_status, same as an error status in the body
+    normalized_address = normalize_address(address_str)
+    cached_result = get_cached_address(normalized_address)
+    if cached_result:
+        return cached_result
+
+    params = { 'key': geocoding_api_key, 'address': address_str }
+    try:
+        response = geocoding_client.call(lambda timeout: get_json(geocoding_base_url, params, timeout))
+    except UpstreamUnavailableError:
+        stale_result = get_cached_address(normalized_address, allow_expired=True)
+        if stale_result:
+            return stale_result
+        raise
+
+    except Exception:   # not transient (4xx, body is not JSON), retrying will not help
+        logger.exception('Geocoding API error for address %s', address_str)
+        return geocoding_error_status, None
+
+    try:
+        return handle_geocoding_response(normalized_address, response)
+    except (KeyError, IndexError, TypeError):
+        logger.exception('Geocoding API returned an invalid response for address %s', address_str)
+        return geocoding_error_status, None
+
+
+def get_cached_address(normalized_address, allow_expired=False):
+    # returns cached geocoding status and address fields, None if address is not cached or entry has expired
+    cached_address = GeocodeCacheModel.query.get(normalized_address)
+    if cached_address and (allow_expired or cached_address.created_at + geocode_cache_ttl > datetime.now()):
+        return cached_address.status, get_cached_address_fields(cached_address)
+
+    return None
+
+
+def handle_geocoding_response(normalized_address, response):
+    # extracts geocoding status and address fields from Geocoding API response and caches final answers
+    status = response['status']
+    address_fields = None
+    if status == 'OK':
+        address_fields = extract_address_fields(response['results'][0]['address_components'])
+
+    if status in cacheable_statuses:
+        add_to_geocode_cache(normalized_address, status, address_fields)
+
+    return status, address_fields
+
+
+def extract_address_fields(address_components):
+    # extract the relevant info from the response
+    address_fields = { 'street': "", 'home_num': "", 'city': "", 'country': "", 'country_code': "" }
+    for address_component in address_components:
+        if address_component['types'][0] == 'street_number':
+            address_fields['home_num'] = address_component['long_name']
+
+        elif address_component['types'][0] == 'route':
+            address_fields['street'] = address_component['long_name']
+
+        elif address_component['types'][0] == 'locality':
+            address_fields['city'] = address_component['long_name']
+
+        elif address_component['types'][0] == 'country':
+            address_fields['country'] = address_component['long_name']
+            address_fields['country_code'] = address_component['short_name']  # country code is needed for accessing Holiday API
+
+    return address_fields
+
+
+def get_cached_address_fields(cached_address):
+    if cached_address.status != 'OK':
+        return None
+
+    return { 'street': cached_address.street, 'home_num': cached_address.home_num, 'city': cached_address.city,
+             'country': cached_address.country, 'country_code': cached_address.country_code }
+
+
+def add_to_geocode_cache(normalized_address, status, address_fields):
+    cached_address = GeocodeCacheModel(normalized_address=normalized_address, status=status, created_at=datetime.now(),
+                                       **(address_fields or {}))
+    db.session.merge(cached_address)   # replaces expired entry, if exists
+    try:
+        db.session.commit()
+    except IntegrityError:  # a concurrent request cached the same address first, its entry is kept
+        db.session.rollback()
+        return
+
+    if count_geocode_cache_insert() > geocode_cache_max_entries:
+        evict_oldest_geocode_cache_entries()
+
+
+def count_geocode_cache_insert():
+    # returns cache size including the inserted entry (a replaced entry is counted as new, size is recounted before
+    # anything is evicted)
+    global geocode_cache_size
+    with geocode_cache_size_lock:
+        if geocode_cache_size is None:
+            geocode_cache_size = GeocodeCacheModel.query.count()
+        else:
+            geocode_cache_size += 1
+        return geocode_cache_size
+
+
+def evict_oldest_geocode_cache_entries():
+    # oldest entries are evicted in a batch, so the cache is trimmed once per geocode_cache_evict_batch inserts
+    # instead of on every insert. The cutoff is found by a walk of the created_at index from the oldest entry
+    global geocode_cache_size
+    with geocode_cache_size_lock:
+        num_of_entries = GeocodeCacheModel.query.count()
+        num_of_evicted = num_of_entries - geocode_cache_max_entries + geocode_cache_evict_batch
+        if num_of_entries > geocode_cache_max_entries:
+            cutoff = db.session.query(GeocodeCacheModel.created_at).order_by(GeocodeCacheModel.created_at)\
+                .offset(num_of_evicted - 1).limit(1).scalar()
+            num_of_entries -= GeocodeCacheModel.query.filter(GeocodeCacheModel.created_at <= cutoff)\
+                .delete(synchronize_session=False)
+            db.session.commit()
+        geocode_cache_size = num_of_entries
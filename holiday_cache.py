@@ -0,0 +1,233 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from api_keys import holiday_api_key
+from upstream_client import UpstreamClient, UpstreamUnavailableError, get_json
+
+holiday_api_url = 'https://holidayapi.com/v1/holidays?'
+
+
+def parse_holidays(holidays_dict):
+    # all holidays from dict are added (even though some holidays in Israel are considered workdays)
+    # TODO: check which holiday is a workday
+    return frozenset(datetime.strptime(holiday['date'], '%Y-%m-%d').date() for holiday in holidays_dict['holidays'])
+
+
+class _InFlightFetch:
+    # a single upstream fetch that concurrent misses for the same key wait on
+    def __init__(self):
+        self.done     = threading.Event()
+        self.holidays = None
+        self.error    = None
+
+
+class HolidayApiClient:
+    # same request as holidayapi.v1 client, which has no timeout and returns error responses as data
+    def __init__(self, key=holiday_api_key, base_url=holiday_api_url):
+        self.key      = key
+        self.base_url = base_url
+
+    def holidays(self, parameters, timeout=None):
+        return get_json(self.base_url, dict(parameters, key=self.key), timeout)
+
+
+class HolidayCache:
+    # process-wide cache of holiday dates keyed by (country_code, year). Entries expire after ttl_seconds, the least
+    # recently used entry is evicted when max_entries is exceeded and concurrent misses for the same key share one
+    # upstream call. If persistence_path is set (or open_persistence was called), fetched holidays are also stored in a
+    # SQLite file, so a restarted worker starts warm and expired holidays are served while Holiday API is not available
+    def __init__(self, ttl_seconds=24 * 60 * 60, max_entries=256, persistence_path=None, client_factory=None):
+        self.ttl_seconds      = ttl_seconds
+        self.max_entries      = max_entries
+        self.persistence_path = None
+        # client_factory allows replacing Holiday API client (e.g. with a stub), client.holidays(parameters, timeout)
+        self.client_factory   = client_factory or HolidayApiClient
+        self.upstream_client  = UpstreamClient('holiday_fetch', rate_per_second=10, burst=20, timeout_seconds=3,
+                                               deadline_seconds=5, max_attempts=2)
+        self.hits             = 0
+        self.misses           = 0
+        self.upstream_calls   = 0
+        self._entries         = OrderedDict()  # key -> (expires_at, holidays)
+        self._in_flight       = {}
+        self._lock            = threading.Lock()
+        if persistence_path:
+            self.open_persistence(persistence_path)
+
+
+    def get_holidays(self, country_code, year):
+        # returns frozenset of holiday dates. Upstream errors are raised to the caller and are not cached, expired
+        # holidays are returned instead if Holiday API is not available
+        key = (country_code, year)
+        with self._lock:
+            holidays = self._get_fresh_entry(key)
+            if holidays is not None:
+                self.hits += 1
+                return holidays
+
+            self.misses += 1
+            in_flight = self._in_flight.get(key)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = _InFlightFetch()
+                self._in_flight[key] = in_flight
+
+        if not is_leader:   # another thread is already fetching this key
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.holidays
+
+        try:
+            persisted = self._load_persisted(key)
+            if persisted is not None:
+                fetched_at, holidays = persisted
+            else:
+                fetched_at = time.time()
+                try:
+                    holidays = self._fetch(country_code, year)
+                except UpstreamUnavailableError:
+                    holidays = self.get_stale_holidays(country_code, year)
+                    if holidays is None:
+                        raise
+                    # not stored, next miss tries Holiday API again
+                    in_flight.holidays = holidays
+                    return holidays
+
+                self._persist(key, holidays, fetched_at)
+            with self._lock:
+                self._store(key, holidays, fetched_at)
+            in_flight.holidays = holidays
+            return holidays
+
+        except Exception as e:
+            in_flight.error = e
+            raise
+
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+
+    def get_cached_holidays(self, country_code, year):
+        # returns holidays from memory or from persistence layer without accessing Holiday API, None on miss.
+        # used by callers that fetch holidays by themselves (async timeslot search)
+        key = (country_code, year)
+        with self._lock:
+            holidays = self._get_fresh_entry(key)
+            if holidays is not None:
+                self.hits += 1
+                return holidays
+
+        persisted = self._load_persisted(key)
+        with self._lock:
+            if persisted is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            fetched_at, holidays = persisted
+            self._store(key, holidays, fetched_at)
+            return holidays
+
+
+    def get_stale_holidays(self, country_code, year):
+        # returns persisted holidays even if expired, None if never fetched. Degraded result while Holiday API is
+        # not available
+        persisted = self._load_persisted((country_code, year), allow_expired=True)
+        return persisted[1] if persisted else None
+
+
+    def add_holidays(self, country_code, year, holidays_dict):
+        # adds Holiday API response fetched by the caller, returns frozenset of holiday dates
+        key        = (country_code, year)
+        fetched_at = time.time()
+        holidays   = parse_holidays(holidays_dict)
+        self._persist(key, holidays, fetched_at)
+        with self._lock:
+            self.upstream_calls += 1
+            self._store(key, holidays, fetched_at)
+        return holidays
+
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'upstream_calls': self.upstream_calls,
+                    'entries': len(self._entries)}
+
+
+    def clear(self):
+        # clears in-memory entries only, persisted holidays are kept
+        with self._lock:
+            self._entries.clear()
+
+
+    def open_persistence(self, persistence_path):
+        # creates the SQLite file if it does not exist, holidays are persisted and loaded from it from now on
+        with sqlite3.connect(persistence_path, timeout=5) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS holidays_cache (country_code TEXT NOT NULL, '
+                               'year INTEGER NOT NULL, holidays TEXT NOT NULL, fetched_at REAL NOT NULL, '
+                               'PRIMARY KEY (country_code, year))')
+        self.persistence_path = persistence_path
+
+
+    def _get_fresh_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, holidays = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return holidays
+
+
+    def _store(self, key, holidays, fetched_at):
+        self._entries[key] = (fetched_at + self.ttl_seconds, holidays)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+    def _fetch(self, country_code, year):
+        hapi       = self.client_factory()
+        parameters = { 'country': country_code, 'year': year }
+        with self._lock:
+            self.upstream_calls += 1
+        holidays_dict = self.upstream_client.call(lambda timeout: hapi.holidays(parameters, timeout=timeout))
+        return parse_holidays(holidays_dict)
+
+
+    def _connect(self):
+        # new connection per operation, sqlite3 connections can not be shared between threads
+        return sqlite3.connect(self.persistence_path, timeout=5)
+
+
+    def _load_persisted(self, key, allow_expired=False):
+        if not self.persistence_path:
+            return None
+
+        with self._connect() as connection:
+            row = connection.execute('SELECT holidays, fetched_at FROM holidays_cache WHERE country_code = ? AND year = ?',
+                                     key).fetchone()
+        if row is None or (not allow_expired and row[1] + self.ttl_seconds <= time.time()):
+            return None
+
+        holidays = frozenset(datetime.strptime(date_str, '%Y-%m-%d').date() for date_str in json.loads(row[0]))
+        return row[1], holidays
+
+
+    def _persist(self, key, holidays, fetched_at):
+        if not self.persistence_path:
+            return
+
+        dates_str = json.dumps(sorted(date.strftime('%Y-%m-%d') for date in holidays))
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO holidays_cache (country_code, year, holidays, fetched_at) '
+                               'VALUES (?, ?, ?, ?)', (key[0], key[1], dates_str, fetched_at))
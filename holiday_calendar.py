@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+from database_init import *
+
+logger = logging.getLogger(__name__)
+
+
+def get_calendar_holidays(country_code, year):
+    # returns frozenset of holiday dates of country and year, None if the calendar was not refreshed for them yet
+    is_refreshed = db.session.query(HolidayCalendarRefreshesModel.refreshed_at)\
+        .filter_by(country_code=country_code, year=year).first()
+    if is_refreshed is None:
+        return None
+
+    return frozenset(date.date() for date, in db.session.query(HolidayCalendarModel.date)
+                     .filter_by(country_code=country_code, year=year))
+
+
+def get_holiday_dates(country_codes, dates):
+    # returns set of (country_code, date) of the given dates that are holidays in the given countries
+    holiday_dates = set()
+    country_codes = list(set(country_codes))
+    dates         = list(set(dates))
+    for dates_chunk in chunks(dates, 400):
+        holiday_dates.update(db.session.query(HolidayCalendarModel.country_code, HolidayCalendarModel.date)
+                             .filter(HolidayCalendarModel.country_code.in_(country_codes),
+                                     HolidayCalendarModel.date.in_(dates_chunk)))
+    return holiday_dates
+
+
+def refresh_holiday_calendar(country_code, year, holidays):
+    # replaces holiday dates of country and year in a single transaction
+    HolidayCalendarModel.query.filter_by(country_code=country_code, year=year).delete(synchronize_session=False)
+    holiday_calendar_rows = [{'country_code': country_code, 'year': year,
+                              'date': datetime.combine(holiday, datetime.min.time())} for holiday in holidays]
+    if holiday_calendar_rows:
+        db.session.execute(HolidayCalendarModel.__table__.insert(), holiday_calendar_rows)
+    db.session.merge(HolidayCalendarRefreshesModel(country_code=country_code, year=year, refreshed_at=datetime.now()))
+    db.session.commit()
+
+
+class HolidayCalendarJob:
+    # background job that precomputes the holiday calendar for countries of all users every refresh_interval_seconds,
+    # so timeslot search only reads it. Countries requested with request_refresh are refreshed right away
+    def __init__(self, holiday_cache, year, refresh_interval_seconds=6 * 60 * 60):
+        self.holiday_cache            = holiday_cache
+        self.year                     = year
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._requested_country_codes = set()
+        self._wake                    = threading.Event()
+        self._lock                    = threading.Lock()
+        self._thread                  = None
+
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+
+    def request_refresh(self, country_code):
+        with self._lock:
+            self._requested_country_codes.add(country_code)
+        self._wake.set()
+
+
+    def refresh(self, country_codes=None):
+        # refreshes calendar of given countries (countries of all users by default), returns num of refreshed countries.
+        # Holiday API errors are logged and the country is refreshed on the next run
+        num_of_refreshed_countries = 0
+        with app.app_context():
+            if country_codes is None:
+                users_country_codes = db.session.query(UsersModel.resolved_country_code).distinct()
+                country_codes = {country_code for country_code, in users_country_codes}
+
+            for country_code in country_codes:
+                try:
+                    holidays = self.holiday_cache.get_holidays(country_code, self.year)
+                    refresh_holiday_calendar(country_code, self.year, holidays)
+                    num_of_refreshed_countries += 1
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('An error occurred while refreshing holidays of %s', country_code)
+
+        return num_of_refreshed_countries
+
+
+    def _run(self):
+        next_full_refresh = 0
+        while True:
+            self._wake.clear()
+            with self._lock:
+                requested_country_codes, self._requested_country_codes = self._requested_country_codes, set()
+
+            if time.time() >= next_full_refresh:
+                self.refresh()
+                self.refresh(requested_country_codes)   # requested countries may have no users yet
+                next_full_refresh = time.time() + self.refresh_interval_seconds
+            elif requested_country_codes:
+                self.refresh(requested_country_codes)
+
+            self._wake.wait(timeout=max(0, next_full_refresh - time.time()))
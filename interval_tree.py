@@ -0,0 +1,60 @@
+class IntervalTree:
+    # static interval tree - intervals sorted by start time form an implicit balanced binary search tree (the root of
+    # a range of intervals is its middle one) and each node keeps the latest end time of its subtree. A query skips
+    # subtrees that end before the range and stops at intervals that start after it. A subtree whose intervals all
+    # start after range start and before range end overlaps it as a whole and is copied without visiting its nodes,
+    # so a query costs O(log n) node visits plus copying the overlapping intervals. Built once, changes need a rebuild
+    __slots__ = ('start_times', 'end_times', 'items', 'max_end_times')
+    leaf_size = 16  # ranges of up to leaf_size intervals are scanned instead of split
+
+    def __init__(self, intervals):
+        # intervals - list of (start_time, end_time, item) sorted by start and end time
+        self.start_times   = [start_time for start_time, _, _ in intervals]
+        self.end_times     = [end_time for _, end_time, _ in intervals]
+        self.items         = [item for _, _, item in intervals]
+        self.max_end_times = [None] * len(intervals)
+        if intervals:
+            self._build(0, len(intervals))
+
+
+    def _build(self, lo, hi):
+        # returns latest end time of range [lo, hi), recursion depth is log2(n / leaf_size)
+        if hi - lo <= IntervalTree.leaf_size:
+            return max(self.end_times[lo:hi])
+
+        mid = (lo + hi) // 2
+        self.max_end_times[mid] = max(self.end_times[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self.max_end_times[mid]
+
+
+    def overlapping(self, range_start, range_end):
+        # returns (start_time, end_time, item) of intervals that overlap [range_start, range_end), ordered by start time
+        overlapping_intervals = []
+        if self.start_times and self.start_times[0] < range_end:
+            self._collect(0, len(self.items), range_start, range_end, overlapping_intervals)
+        return overlapping_intervals
+
+
+    def _collect(self, lo, hi, range_start, range_end, overlapping_intervals):
+        # in-order walk of range [lo, hi)
+        if self.start_times[lo] > range_start and self.start_times[hi - 1] < range_end:  # all intervals overlap
+            overlapping_intervals.extend(zip(self.start_times[lo:hi], self.end_times[lo:hi], self.items[lo:hi]))
+            return
+
+        if hi - lo <= IntervalTree.leaf_size:
+            overlapping_intervals.extend(interval for interval in zip(self.start_times[lo:hi], self.end_times[lo:hi],
+                                                                      self.items[lo:hi])
+                                         if interval[0] < range_end and interval[1] > range_start)
+            return
+
+        mid = (lo + hi) // 2
+        if self.max_end_times[mid] <= range_start:  # whole subtree ends before the range
+            return
+
+        self._collect(lo, mid, range_start, range_end, overlapping_intervals)
+        if self.start_times[mid] >= range_end:      # this interval and the right subtree start after the range
+            return
+
+        if self.end_times[mid] > range_start:
+            overlapping_intervals.append((self.start_times[mid], self.end_times[mid], self.items[mid]))
+        self._collect(mid + 1, hi, range_start, range_end, overlapping_intervals)
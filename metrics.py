@@ -0,0 +1,226 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# latency buckets in seconds, request and phase durations share them
+latency_buckets     = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+query_count_buckets = (1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+
+class Histogram:
+    # observation is counted in its own bucket only, counts are made cumulative (Prometheus style) when rendered
+    def __init__(self, buckets):
+        self.buckets       = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # last bucket is +Inf
+        self.count         = 0
+        self.sum           = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum   += value
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+
+    def cumulative_counts(self):
+        return list(accumulate(self.bucket_counts))[:-1]
+
+
+class MetricsRegistry:
+    # histograms and counters keyed by metric name and labels, rendered in Prometheus text format
+    def __init__(self):
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.counters   = {}    # (name, labels) -> value
+        self.help_texts = {}
+        self._lock      = threading.Lock()
+
+
+    def observe(self, name, value, buckets=latency_buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def describe(self, name, help_text):
+        self.help_texts[name] = help_text
+
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for metric_type, metrics in (('histogram', self.histograms), ('counter', self.counters)):
+                described_names = set()
+                for (name, labels), metric in sorted(metrics.items()):
+                    if name not in described_names:
+                        described_names.add(name)
+                        if name in self.help_texts:
+                            lines.append('# HELP {} {}'.format(name, self.help_texts[name]))
+                        lines.append('# TYPE {} {}'.format(name, metric_type))
+
+                    if metric_type == 'counter':
+                        lines.append('{}{} {}'.format(name, format_labels(labels), metric))
+                        continue
+
+                    for upper_bound, bucket_count in zip(metric.buckets, metric.cumulative_counts()):
+                        lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', upper_bound),)),
+                                                             bucket_count))
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', '+Inf'),)), metric.count))
+                    lines.append('{}_sum{} {}'.format(name, format_labels(labels), metric.sum))
+                    lines.append('{}_count{} {}'.format(name, format_labels(labels), metric.count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in labels) + '}'
+
+
+metrics = MetricsRegistry()
+metrics.describe('http_request_duration_seconds', 'Request duration, including streamed response body')
+metrics.describe('db_queries_per_request', 'Number of SQL statements executed by a request')
+metrics.describe('phase_duration_seconds', 'Duration of a phase of request handling (db_query, geocode, '
+                                           'holiday_fetch, serialization)')
+metrics.describe('upstream_errors_total', 'Failed attempts of calls to upstream APIs')
+metrics.describe('upstream_retries_total', 'Retried attempts of calls to upstream APIs')
+metrics.describe('upstream_rejected_total', 'Calls to upstream APIs rejected by rate limit or open circuit breaker')
+metrics.describe('availability_index_reloaded_records_total', 'Availability index records reloaded from the database '
+                                                              'after other processes changed them')
+
+
+@contextmanager
+def span(phase):
+    # times a phase of request handling, e.g. with span('geocode'): ...
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('phase_duration_seconds', time.perf_counter() - start_time, phase=phase)
+
+
+class SlowRequestProfiler:
+    # sampling profiler - stacks of threads serving requests are sampled every interval_seconds. Samples of requests
+    # slower than threshold_seconds are written to output_dir in folded stack format (input of flamegraph.pl and
+    # speedscope), samples of faster requests are dropped
+    def __init__(self, threshold_seconds, output_dir, interval_seconds=0.005):
+        self.threshold_seconds = threshold_seconds
+        self.output_dir        = output_dir
+        self.interval_seconds  = interval_seconds
+        self._samples          = {}    # thread ident -> Counter of folded stacks
+        self._lock             = threading.Lock()
+        self._thread           = None
+
+
+    def start_request(self):
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+
+    def finish_request(self, duration, request_name):
+        # returns path of written profile, None if request was not slow
+        with self._lock:
+            samples = self._samples.pop(threading.get_ident(), None)
+        if not samples or duration < self.threshold_seconds:
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        profile_path = os.path.join(self.output_dir, '{}-{}ms-{}-{}.folded'.format(
+            request_name, int(duration * 1000), time.strftime('%Y%m%d%H%M%S'), threading.get_ident()))
+        with open(profile_path, 'w') as profile_file:
+            for stack, num_of_samples in samples.most_common():
+                profile_file.write('{} {}\n'.format(stack, num_of_samples))
+        return profile_path
+
+
+    def _run(self):
+        profiler_ident = threading.get_ident()
+        while True:
+            time.sleep(self.interval_seconds)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_ident, samples in self._samples.items():
+                    frame = frames.get(thread_ident)
+                    if frame is not None and thread_ident != profiler_ident:
+                        samples[fold_stack(frame)] += 1
+
+
+def fold_stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append('{}:{}'.format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename)))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+def instrument_app(app, api):
+    # registers request timing, per request SQL query counting, serialization timing of Flask-RESTful responses and
+    # the slow request profiler (enabled by SLOW_REQUEST_PROFILE_SECONDS environment variable)
+    threshold_str = os.environ.get('SLOW_REQUEST_PROFILE_SECONDS')
+    profiler = SlowRequestProfiler(float(threshold_str), os.environ.get('SLOW_REQUEST_PROFILE_DIR', 'profiles'))\
+        if threshold_str else None
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start_time = time.perf_counter()
+        g.num_of_queries     = 0
+        if profiler:
+            profiler.start_request()
+
+    @app.after_request
+    def record_response_status(response):
+        g.response_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request_metrics(exception):
+        # runs after streamed response body was sent
+        if 'request_start_time' not in g:
+            return
+
+        duration = time.perf_counter() - g.pop('request_start_time')
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe('http_request_duration_seconds', duration, endpoint=endpoint, method=request.method,
+                        status=g.pop('response_status', 500))
+        metrics.observe('db_queries_per_request', g.pop('num_of_queries', 0), buckets=query_count_buckets,
+                        endpoint=endpoint)
+        if profiler:
+            profiler.finish_request(duration, endpoint)
+
+    default_output_json = api.representations['application/json']
+
+    @api.representation('application/json')
+    def output_json(data, code, headers=None):
+        with span('serialization'):
+            return default_output_json(data, code, headers)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('query_start_times', []).append(time.perf_counter())
+    if has_request_context() and 'num_of_queries' in g:
+        g.num_of_queries += 1
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_duration(connection, cursor, statement, parameters, context, executemany):
+    query_start_time = connection.info['query_start_times'].pop()
+    metrics.observe('phase_duration_seconds', time.perf_counter() - query_start_time, phase='db_query')
@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# project modules are flat in the repository root
+repository_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_path)
+
+
+@pytest.fixture
+def database(tmp_path):
+    # empty SQLite database in tmp_path with the timeslots of courier_timeslots.json loaded, yields the Flask app
+    from database_init import app, db, init_database, load_courier_timeslots
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'database.db')
+    with app.app_context():
+        init_database()
+        load_courier_timeslots(os.path.join(repository_path, 'courier_timeslots.json'))
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.get_engine().dispose()
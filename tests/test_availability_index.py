@@ -0,0 +1,72 @@
+import pytest
+from database_init import *
+from availability_index import AvailabilityIndex
+
+
+def commit_booking(timeslot_id):
+    # the counter changes of book_timeslot, committed
+    timeslot = TimeslotsModel.query.get(timeslot_id)
+    timeslot.num_of_scheduled_deliveries += 1
+    CouriersModel.query.filter_by(courier_id=timeslot.courier_id, date=timeslot.date)\
+        .update({CouriersModel.num_of_remaining_deliveries: CouriersModel.num_of_remaining_deliveries - 1})
+    db.session.commit()
+
+
+def book_while_loading(availability_index, timeslot_id, is_committed_before_load):
+    # replaces _load_counters with a load a booking of this process interleaves with
+    load_counters = availability_index._load_counters
+    def interleaved_load_counters():
+        availability_index._load_counters = load_counters
+        if is_committed_before_load:
+            commit_booking(timeslot_id)
+            loaded_counters = load_counters()
+        else:
+            loaded_counters = load_counters()
+            commit_booking(timeslot_id)
+        availability_index.apply_booking(timeslot_id)
+        return loaded_counters
+    availability_index._load_counters = interleaved_load_counters
+
+
+def assert_counters(availability_index, timeslot_id, num_of_scheduled_deliveries):
+    assert availability_index.check_consistency() == []
+    timeslot = availability_index.timeslots[timeslot_id]
+    assert timeslot.num_of_scheduled_deliveries == num_of_scheduled_deliveries
+    assert timeslot.courier_date.num_of_remaining_deliveries == \
+        CouriersModel.query.filter_by(courier_id=timeslot.courier_date.courier_id,
+                                      date=timeslot.courier_date.date).one().num_of_remaining_deliveries
+
+
+@pytest.mark.parametrize('is_committed_before_load', [False, True])
+def test_booking_applied_while_refreshing_is_kept(database, is_committed_before_load):
+    with database.app_context():
+        availability_index = AvailabilityIndex()
+        availability_index.build()
+        timeslot_id = TimeslotsModel.query.first().timeslot_id
+        book_while_loading(availability_index, timeslot_id, is_committed_before_load)
+        availability_index.refresh()
+        assert_counters(availability_index, timeslot_id, 1)
+
+        availability_index.refresh()    # the skipped record is reloaded by the next refresh
+        assert_counters(availability_index, timeslot_id, 1)
+
+
+def test_booking_applied_while_building_is_kept(database, monkeypatch):
+    with database.app_context():
+        availability_index = AvailabilityIndex()
+        availability_index.build()
+        timeslot_id = TimeslotsModel.query.first().timeslot_id
+        execute = db.session.execute
+        num_of_queries = []
+        def execute_and_book(*args, **kwargs):
+            # books after the build read the timeslots, before the new records replace the old ones
+            rows = execute(*args, **kwargs).fetchall()
+            num_of_queries.append(1)
+            if len(num_of_queries) == 2:
+                commit_booking(timeslot_id)
+                availability_index.apply_booking(timeslot_id)
+            return rows
+        monkeypatch.setattr(db.session, 'execute', execute_and_book)
+        availability_index.build()
+        monkeypatch.undo()
+        assert_counters(availability_index, timeslot_id, 1)
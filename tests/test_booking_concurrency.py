@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+from database_init import db, CouriersModel, DeliveriesModel, TimeslotsModel, UsersModel
+import delivery_api    # registers the API resources on the app
+
+num_of_threads             = 8
+num_of_bookings_per_thread = 40
+
+
+def create_users(num_of_users):
+    user_emails = ['user{}@example.com'.format(i) for i in range(num_of_users)]
+    for user_email in user_emails:
+        db.session.add(UsersModel(user_name='user', address='Herzl 5 Ramat Gan', country_code='IL',
+                                  user_email=user_email))
+    db.session.commit()
+    return user_emails
+
+
+def test_concurrent_bookings_do_not_overbook(database):
+    # threads book random timeslots through the API until timeslots and courier days are full, the counters must
+    # match the booked deliveries and never exceed the capacity
+    with database.app_context():
+        user_emails  = create_users(num_of_threads)
+        timeslot_ids = [timeslot_id for timeslot_id, in db.session.query(TimeslotsModel.timeslot_id)]
+
+    responses = []
+    def book(user_email, seed):
+        client = database.test_client()
+        rnd = random.Random(seed)
+        for _ in range(num_of_bookings_per_thread):
+            response = client.post('/deliveries/{}/{}'.format(user_email, rnd.choice(timeslot_ids)))
+            responses.append(response.get_json()['message'])
+
+    threads = [threading.Thread(target=book, args=(user_email, seed)) for seed, user_email in enumerate(user_emails)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_seconds = time.perf_counter() - start_time
+
+    num_of_booked = responses.count('Delivery booked!')
+    print('{} booking requests ({:.0f}/s), {} booked'.format(len(responses), len(responses) / elapsed_seconds,
+                                                            num_of_booked))
+    assert len(responses) == num_of_threads * num_of_bookings_per_thread
+    assert set(responses) <= {'Delivery booked!', 'Timeslot is not available. Please choose another timeslot'}
+
+    with database.app_context():
+        assert DeliveriesModel.query.count() == num_of_booked
+        deliveries_per_timeslot, deliveries_per_courier_date = {}, {}
+        for delivery in DeliveriesModel.query:
+            deliveries_per_timeslot[delivery.timeslot_id] = deliveries_per_timeslot.get(delivery.timeslot_id, 0) + 1
+            courier_date = (delivery.courier_id, delivery.date)
+            deliveries_per_courier_date[courier_date] = deliveries_per_courier_date.get(courier_date, 0) + 1
+
+        for timeslot in TimeslotsModel.query:
+            num_of_deliveries = deliveries_per_timeslot.get(timeslot.timeslot_id, 0)
+            assert timeslot.num_of_scheduled_deliveries == num_of_deliveries
+            assert num_of_deliveries <= TimeslotsModel.max_num_of_deliveries
+            is_full = num_of_deliveries == TimeslotsModel.max_num_of_deliveries
+            assert timeslot.status == (TimeslotsModel.not_available if is_full else TimeslotsModel.available)
+
+        for courier in CouriersModel.query:
+            num_of_deliveries = deliveries_per_courier_date.get((courier.courier_id, courier.date), 0)
+            assert courier.num_of_remaining_deliveries \
+                == CouriersModel.max_num_of_remaining_deliveries_var - num_of_deliveries
+            assert courier.num_of_remaining_deliveries >= 0
+            assert courier.status == (CouriersModel.full if courier.num_of_remaining_deliveries == 0
+                                      else CouriersModel.available)
@@ -0,0 +1,54 @@
+import json
+import os
+from datetime import datetime
+from conftest import repository_path
+from database_init import db, load_courier_timeslots, TimeslotCitiesModel, TimeslotsModel, UsersModel
+import delivery_api    # registers the API resources on the app
+
+user_email   = 'user@example.com'
+removed_date = datetime(2021, 7, 22)
+
+
+def get_timeslots_of_date(date):
+    return {timeslot.start_time: timeslot for timeslot in TimeslotsModel.query.filter_by(date=date)}
+
+
+def test_reload_retires_timeslots_removed_from_the_file(database, tmp_path):
+    with open(os.path.join(repository_path, 'courier_timeslots.json')) as data_file:
+        courier_data = json.load(data_file)
+    smaller_file = str(tmp_path / 'courier_timeslots.json')
+    with open(smaller_file, 'w') as data_file:
+        json.dump(dict(courier_data, timeslots={date_str: timeslots_list for date_str, timeslots_list
+                                                in courier_data['timeslots'].items() if date_str != '22/07/2021'}),
+                  data_file)
+
+    with database.app_context():
+        db.session.add(UsersModel(user_name='user', address='Herzl 5 Ramat Gan', country_code='IL',
+                                  user_email=user_email))
+        db.session.commit()
+        removed_timeslots = get_timeslots_of_date(removed_date)
+        assert len(removed_timeslots) == 3
+        booked_timeslot_id = removed_timeslots[removed_date.replace(hour=8)].timeslot_id
+        num_of_timeslots = TimeslotsModel.query.count()
+    response = database.test_client().post('/deliveries/{}/{}'.format(user_email, booked_timeslot_id))
+    assert response.get_json()['message'] == 'Delivery booked!'
+
+    with database.app_context():
+        load_courier_timeslots(smaller_file)
+        # the booked timeslot is kept for its delivery but is not available, the other two are deleted
+        assert list(get_timeslots_of_date(removed_date).values()) == [TimeslotsModel.query.get(booked_timeslot_id)]
+        assert TimeslotsModel.query.get(booked_timeslot_id).status == TimeslotsModel.not_available
+        assert TimeslotsModel.query.count() == num_of_timeslots - 2
+        assert {timeslot_id for timeslot_id, in db.session.query(TimeslotCitiesModel.timeslot_id)} \
+            == {timeslot_id for timeslot_id, in db.session.query(TimeslotsModel.timeslot_id)}
+        available_timeslots = delivery_api.find_available_timeslots('Ramat Gan', set())
+        assert not [entry for entry in available_timeslots if entry[1].startswith('22/07/2021')]
+        assert TimeslotsModel.query.filter(TimeslotsModel.date != removed_date,
+                                           TimeslotsModel.status == TimeslotsModel.not_available).count() == 0
+
+        # timeslots added back to the file are offered again
+        load_courier_timeslots(os.path.join(repository_path, 'courier_timeslots.json'))
+        assert TimeslotsModel.query.count() == num_of_timeslots
+        assert TimeslotsModel.query.get(booked_timeslot_id).status == TimeslotsModel.available
+        available_timeslots = delivery_api.find_available_timeslots('Ramat Gan', set())
+        assert len([entry for entry in available_timeslots if entry[1].startswith('22/07/2021')]) == 3
@@ -0,0 +1,81 @@
+import threading
+import pytest
+import requests
+from database_init import db, GeocodeCacheModel, UsersModel
+import delivery_api    # registers the API resources on the app
+import geocoding
+
+address_str = 'Herzl 5, Ramat Gan'
+geocoding_response = {'status': 'OK', 'results': [{'address_components': [
+    {'types': ['street_number'], 'long_name': '5', 'short_name': '5'},
+    {'types': ['route'], 'long_name': 'Herzl', 'short_name': 'Herzl'},
+    {'types': ['locality'], 'long_name': 'Ramat Gan', 'short_name': 'Ramat Gan'},
+    {'types': ['country'], 'long_name': 'Israel', 'short_name': 'IL'}]}]}
+
+
+def create_users(user_emails):
+    for user_email in user_emails:
+        db.session.add(UsersModel(user_name='user', address=address_str, country_code='IL', user_email=user_email))
+    db.session.commit()
+
+
+def test_concurrent_requests_cache_the_same_address(database, monkeypatch):
+    # both requests miss the cache and merge a new entry before either of them commits
+    user_emails = ['user1@example.com', 'user2@example.com']
+    with database.app_context():
+        create_users(user_emails)
+    monkeypatch.setattr(geocoding, 'get_json', lambda url, params, timeout: geocoding_response)
+    both_merged = threading.Barrier(len(user_emails), timeout=5)
+    merge = db.session.merge
+    def merge_and_wait(instance):
+        merged_instance = merge(instance)
+        if isinstance(instance, GeocodeCacheModel):
+            both_merged.wait()
+        return merged_instance
+    monkeypatch.setattr(db.session, 'merge', merge_and_wait)
+
+    messages = {}
+    def resolve(user_email):
+        response = database.test_client().post('/resolve-address/' + user_email)
+        messages[user_email] = (response.status_code, response.get_json())
+    threads = [threading.Thread(target=resolve, args=(user_email,)) for user_email in user_emails]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for user_email in user_emails:
+        assert messages[user_email] == (200, {'message': 'Address object added to user\'s info'})
+    with database.app_context():
+        assert GeocodeCacheModel.query.count() == 1
+        assert {user.address_city for user in UsersModel.query} == {'Ramat Gan'}
+
+
+class StubHolidayApiClient:
+    def holidays(self, parameters, timeout=None):
+        return {'holidays': []}
+
+
+def raise_bad_request(url, params, timeout):
+    response = requests.Response()
+    response.status_code, response.url = 400, url
+    response.raise_for_status()
+
+
+def raise_malformed_body(url, params, timeout):
+    raise ValueError('Expecting value: line 1 column 1 (char 0)')
+
+
+@pytest.mark.parametrize('geocoding_get_json', [raise_bad_request, raise_malformed_body,
+                                                lambda url, params, timeout: {'status': 'OK', 'results': []}])
+def test_geocoding_error_response_is_reported_as_error(database, monkeypatch, geocoding_get_json):
+    with database.app_context():
+        create_users(['user@example.com'])
+    monkeypatch.setattr(geocoding, 'get_json', geocoding_get_json)
+    monkeypatch.setattr(delivery_api.holiday_cache, 'client_factory', StubHolidayApiClient)
+    client = database.test_client()
+    for path in ['/resolve-address/user@example.com', '/timeslots/user@example.com']:
+        response = client.post(path)
+        assert (response.status_code, response.get_json()) == (200, {'message': 'Something went wrong'})
+    with database.app_context():
+        assert GeocodeCacheModel.query.count() == 0
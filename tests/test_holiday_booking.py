@@ -0,0 +1,61 @@
+from datetime import date, datetime
+import pytest
+from database_init import db, TimeslotsModel, UsersModel
+from holiday_calendar import HolidayCalendarJob, refresh_holiday_calendar
+import delivery_api    # registers the API resources on the app
+
+user_email = 'user@example.com'
+holiday    = datetime(2021, 7, 18)
+
+
+@pytest.fixture
+def client(database):
+    # user created with a free text country, the resolved address is in Israel. 18/07/2021 is a holiday in Israel
+    with database.app_context():
+        user = UsersModel(user_name='user', address='Herzl 5 Ramat Gan', country_code='Israel', user_email=user_email)
+        user.address_object = delivery_api.Address('Herzl', '5', 'Ramat Gan', 'Israel', 'IL')
+        db.session.add(user)
+        db.session.commit()
+        refresh_holiday_calendar('IL', 2021, [holiday.date()])
+    return database.test_client()
+
+
+def get_holiday_timeslot_id(database):
+    with database.app_context():
+        return db.session.query(TimeslotsModel.timeslot_id).filter_by(date=holiday).order_by(TimeslotsModel.start_time)\
+            .first()[0]
+
+
+def test_booking_checks_holidays_of_resolved_country(database, client):
+    response = client.post('/deliveries/{}/{}'.format(user_email, get_holiday_timeslot_id(database)))
+    assert response.get_json()['message'] == 'Timeslot is not available. Please choose another timeslot'
+
+
+def test_batch_booking_checks_holidays_of_resolved_country(database, client):
+    response = client.post('/deliveries/batch', json=[{'user_email': user_email,
+                                                       'timeslot_id': get_holiday_timeslot_id(database)}])
+    assert response.get_json()[0]['message'] == 'Timeslot is not available. Please choose another timeslot'
+
+
+def test_assignment_checks_holidays_of_resolved_country(client):
+    response = client.post('/deliveries/batch/assign', json=[{'user_email': user_email, 'preferred_windows': [
+        ['18/07/2021, 08:00', '18/07/2021, 16:00']]}])
+    assert response.get_json()[0]['message'] == 'No timeslot is available in preferred windows'
+
+    response = client.post('/deliveries/batch/assign', json=[{'user_email': user_email, 'preferred_windows': [
+        ['18/07/2021, 08:00', '19/07/2021, 12:00']]}])
+    assert response.get_json()[0]['message'] == 'Delivery booked!'
+
+
+def test_calendar_job_refreshes_resolved_countries(database, client):
+    class StubHolidayCache:
+        def __init__(self):
+            self.country_codes = []
+
+        def get_holidays(self, country_code, year):
+            self.country_codes.append(country_code)
+            return frozenset([date(2021, 7, 18)])
+
+    holiday_cache = StubHolidayCache()
+    assert HolidayCalendarJob(holiday_cache, 2021).refresh() == 1
+    assert holiday_cache.country_codes == ['IL']
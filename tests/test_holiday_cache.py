@@ -0,0 +1,154 @@
+import threading
+import time
+from datetime import date
+import pytest
+import holiday_cache
+from holiday_cache import HolidayCache
+
+
+class StubHolidayApiClient:
+    # counts calls and returns a holiday per country, calls can be held until release is set
+    def __init__(self, error=None):
+        self.num_of_calls = 0
+        self.error        = error
+        self.release      = threading.Event()
+        self.release.set()
+        self._lock        = threading.Lock()
+
+    def holidays(self, parameters, timeout=None):
+        with self._lock:
+            self.num_of_calls += 1
+        self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return {'holidays': [{'date': '{}-07-18'.format(parameters['year'])}]}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(holiday_cache.time, 'time', fake_clock.time)
+    return fake_clock
+
+
+def create_cache(stub_client, **kwargs):
+    return HolidayCache(client_factory=lambda: stub_client, **kwargs)
+
+
+def run_in_threads(func, num_of_threads):
+    # starts num_of_threads threads calling func, results and errors are collected once the threads are joined
+    results, errors = [], []
+    def run():
+        try:
+            results.append(func())
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run) for _ in range(num_of_threads)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def wait_for_misses(cache, num_of_misses):
+    deadline = time.monotonic() + 5
+    while cache.stats()['misses'] < num_of_misses:
+        assert time.monotonic() < deadline, 'threads did not reach the cache'
+        time.sleep(0.001)
+
+
+def test_entry_expires_after_ttl(clock):
+    stub_client = StubHolidayApiClient()
+    cache = create_cache(stub_client, ttl_seconds=60)
+    assert cache.get_holidays('IL', 2021) == frozenset([date(2021, 7, 18)])
+    clock.now += 59
+    cache.get_holidays('IL', 2021)
+    assert stub_client.num_of_calls == 1
+
+    clock.now += 1
+    cache.get_holidays('IL', 2021)
+    assert stub_client.num_of_calls == 2
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'upstream_calls': 2, 'entries': 1}
+
+
+def test_least_recently_used_entry_is_evicted():
+    stub_client = StubHolidayApiClient()
+    cache = create_cache(stub_client, max_entries=2)
+    cache.get_holidays('IL', 2021)
+    cache.get_holidays('US', 2021)
+    cache.get_holidays('IL', 2021)    # US is now the least recently used
+    cache.get_holidays('FR', 2021)
+    assert cache.stats()['entries'] == 2
+    assert stub_client.num_of_calls == 3
+
+    cache.get_holidays('IL', 2021)
+    assert stub_client.num_of_calls == 3
+    cache.get_holidays('US', 2021)
+    assert stub_client.num_of_calls == 4
+
+
+def test_concurrent_misses_share_one_upstream_call():
+    num_of_threads = 16
+    stub_client = StubHolidayApiClient()
+    stub_client.release.clear()
+    cache = create_cache(stub_client)
+    threads, results, errors = run_in_threads(lambda: cache.get_holidays('IL', 2021), num_of_threads)
+    wait_for_misses(cache, num_of_threads)
+    stub_client.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == [frozenset([date(2021, 7, 18)])] * num_of_threads
+    assert stub_client.num_of_calls == 1
+    assert cache.stats()['upstream_calls'] == 1
+
+
+def test_upstream_error_is_raised_to_all_waiters_and_not_cached():
+    num_of_threads = 8
+    stub_client = StubHolidayApiClient(error=ValueError('invalid response'))
+    stub_client.release.clear()
+    cache = create_cache(stub_client)
+    threads, results, errors = run_in_threads(lambda: cache.get_holidays('IL', 2021), num_of_threads)
+    wait_for_misses(cache, num_of_threads)
+    stub_client.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == []
+    assert len(errors) == num_of_threads
+    assert all(error is errors[0] for error in errors)
+    assert stub_client.num_of_calls == 1
+
+    stub_client.error = None
+    assert cache.get_holidays('IL', 2021) == frozenset([date(2021, 7, 18)])
+    assert stub_client.num_of_calls == 2
+
+
+def test_restarted_cache_starts_warm_from_persistence(tmp_path):
+    persistence_path = str(tmp_path / 'holidays_cache.db')
+    create_cache(StubHolidayApiClient(), persistence_path=persistence_path).get_holidays('IL', 2021)
+
+    stub_client = StubHolidayApiClient(error=AssertionError('Holiday API must not be called'))
+    restarted_cache = create_cache(stub_client, persistence_path=persistence_path)
+    assert restarted_cache.get_holidays('IL', 2021) == frozenset([date(2021, 7, 18)])
+    assert stub_client.num_of_calls == 0
+    assert restarted_cache.stats()['entries'] == 1
+
+
+def test_expired_holidays_are_served_while_holiday_api_is_not_available(tmp_path, clock):
+    persistence_path = str(tmp_path / 'holidays_cache.db')
+    create_cache(StubHolidayApiClient(), ttl_seconds=60, persistence_path=persistence_path).get_holidays('IL', 2021)
+    clock.now += 120
+
+    stub_client = StubHolidayApiClient(error=ConnectionError('connection refused'))
+    restarted_cache = create_cache(stub_client, ttl_seconds=60, persistence_path=persistence_path)
+    assert restarted_cache.get_holidays('IL', 2021) == frozenset([date(2021, 7, 18)])
+    assert stub_client.num_of_calls == restarted_cache.upstream_client.max_attempts
@@ -0,0 +1,27 @@
+import random
+import pytest
+from interval_tree import IntervalTree
+
+
+def random_intervals(rand, num_of_intervals):
+    # small time range, so start and end times tie often, some intervals have zero length
+    intervals = []
+    for item in range(num_of_intervals):
+        start_time = rand.randint(0, 40)
+        intervals.append((start_time, start_time + rand.choice([0, 1, 2, 5, rand.randint(0, 40)]), item))
+    return sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+
+
+@pytest.mark.parametrize('seed', range(3000))
+def test_overlapping_matches_brute_force(seed):
+    rand = random.Random(seed)
+    # sizes around leaf_size, so both scanned leaves and split subtrees are queried
+    intervals = random_intervals(rand, rand.choice([0, 1, rand.randint(2, IntervalTree.leaf_size),
+                                                    rand.randint(IntervalTree.leaf_size + 1, 200)]))
+    interval_tree = IntervalTree(intervals)
+    for _ in range(5):
+        range_start = rand.randint(-5, 85)
+        range_end   = range_start + rand.choice([0, 1, rand.randint(0, 50)])
+        expected = [interval for interval in intervals
+                    if interval[0] < range_end and interval[1] > range_start]
+        assert interval_tree.overlapping(range_start, range_end) == expected    # in order of the sorted intervals
@@ -0,0 +1,45 @@
+import pytest
+from database_init import *
+
+
+@pytest.fixture
+def replica_app(database, tmp_path, monkeypatch):
+    monkeypatch.setitem(database.config, 'SQLALCHEMY_BINDS', {'replica': 'sqlite:///' + str(tmp_path / 'replica.db')})
+    yield database
+    with database.app_context():
+        db.get_engine(database, bind='replica').dispose()
+
+
+def bound_database(session):
+    return session.get_bind().url.database
+
+
+def test_reads_of_marked_endpoint_go_to_replica(replica_app, tmp_path):
+    @read_from_replica
+    def read_endpoint():
+        return bound_database(db.session)
+
+    with replica_app.test_request_context():
+        assert read_endpoint() == str(tmp_path / 'replica.db')
+
+
+def test_writes_go_to_primary(replica_app, tmp_path):
+    with replica_app.test_request_context():
+        assert bound_database(db.session) == str(tmp_path / 'database.db')
+        db.session.add(UsersModel(user_email='user@example.com', user_name='user', address='address',
+                                  country_code='IL'))
+        db.session.commit()
+    with replica_app.app_context():
+        assert UsersModel.query.filter_by(user_email='user@example.com').count() == 1
+
+
+def test_replica_mark_is_removed_after_request(replica_app, tmp_path):
+    @read_from_replica
+    def read_endpoint():
+        return bound_database(db.session)
+
+    with replica_app.app_context():    # requests share g of an outer app context, as with the test client
+        with replica_app.test_request_context():
+            assert read_endpoint() == str(tmp_path / 'replica.db')
+        with replica_app.test_request_context():
+            assert bound_database(db.session) == str(tmp_path / 'database.db')
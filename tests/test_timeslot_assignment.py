@@ -0,0 +1,78 @@
+import random
+import pytest
+from timeslot_assignment import AssignmentGraph, CityTimeslots
+
+
+def random_instance(rand):
+    # a few courier dates, timeslots and groups, requests pick candidate groups in random preference order
+    courier_date_capacities = {courier_date: rand.randint(0, 3) for courier_date in range(rand.randint(1, 3))}
+    timeslot_capacities     = {timeslot_id: rand.randint(0, 2) for timeslot_id in range(rand.randint(1, 6))}
+    timeslot_courier_dates  = {timeslot_id: rand.choice(list(courier_date_capacities))
+                               for timeslot_id in timeslot_capacities}
+    groups = {group_key: rand.sample(list(timeslot_capacities), rand.randint(1, len(timeslot_capacities)))
+              for group_key in range(rand.randint(1, 4))}
+    requests = [rand.sample(list(groups), rand.randint(0, len(groups))) for _ in range(rand.randint(1, 8))]
+    return timeslot_capacities, timeslot_courier_dates, courier_date_capacities, groups, requests
+
+
+def max_num_of_assigned_requests(timeslot_capacities, timeslot_courier_dates, courier_date_capacities, groups,
+                                 requests):
+    # tries every timeslot (or none) for every request
+    timeslot_remaining     = dict(timeslot_capacities)
+    courier_date_remaining = dict(courier_date_capacities)
+    def search(request_index):
+        if request_index == len(requests):
+            return 0
+
+        best = search(request_index + 1)
+        candidate_timeslot_ids = {timeslot_id for group_key in requests[request_index] for timeslot_id in groups[group_key]}
+        for timeslot_id in candidate_timeslot_ids:
+            courier_date = timeslot_courier_dates[timeslot_id]
+            if timeslot_remaining[timeslot_id] > 0 and courier_date_remaining[courier_date] > 0:
+                timeslot_remaining[timeslot_id]      -= 1
+                courier_date_remaining[courier_date] -= 1
+                best = max(best, 1 + search(request_index + 1))
+                timeslot_remaining[timeslot_id]      += 1
+                courier_date_remaining[courier_date] += 1
+        return best
+    return search(0)
+
+
+@pytest.mark.parametrize('seed', range(400))
+def test_assignment_is_valid_and_maximal(seed):
+    timeslot_capacities, timeslot_courier_dates, courier_date_capacities, groups, requests = \
+        random_instance(random.Random(seed))
+    assignment_graph = AssignmentGraph(timeslot_capacities, timeslot_courier_dates, courier_date_capacities)
+    for candidate_group_keys in requests:
+        for group_key in candidate_group_keys:
+            assignment_graph.add_group(group_key, groups[group_key])
+        assignment_graph.add_request(candidate_group_keys)
+    assigned_timeslot_ids = assignment_graph.solve()
+
+    assert len(assigned_timeslot_ids) == len(requests)
+    booked_per_timeslot, booked_per_courier_date = {}, {}
+    for candidate_group_keys, timeslot_id in zip(requests, assigned_timeslot_ids):
+        if timeslot_id is not None:
+            assert any(timeslot_id in groups[group_key] for group_key in candidate_group_keys)
+            courier_date = timeslot_courier_dates[timeslot_id]
+            booked_per_timeslot[timeslot_id]      = booked_per_timeslot.get(timeslot_id, 0) + 1
+            booked_per_courier_date[courier_date] = booked_per_courier_date.get(courier_date, 0) + 1
+    assert all(booked <= timeslot_capacities[timeslot_id] for timeslot_id, booked in booked_per_timeslot.items())
+    assert all(booked <= courier_date_capacities[courier_date]
+               for courier_date, booked in booked_per_courier_date.items())
+    assert sum(booked_per_timeslot.values()) == max_num_of_assigned_requests(
+        timeslot_capacities, timeslot_courier_dates, courier_date_capacities, groups, requests)
+
+    # requests of a class are assigned in request order
+    for candidate_group_keys in {tuple(candidate_group_keys) for candidate_group_keys in requests}:
+        class_timeslot_ids = [timeslot_id for request, timeslot_id in zip(requests, assigned_timeslot_ids)
+                              if tuple(request) == candidate_group_keys]
+        assert class_timeslot_ids == sorted(class_timeslot_ids, key=lambda timeslot_id: timeslot_id is None)
+
+
+def test_city_timeslots_in_window():
+    city_timeslots = CityTimeslots([(9, 11, 'b'), (8, 10, 'a'), (9, 11, 'c'), (10, 13, 'd'), (12, 13, 'e')])
+    assert city_timeslots.find_in_window(9, 12) == [(9, 11)]
+    assert city_timeslots.timeslot_ids[(9, 11)] == ['b', 'c']
+    assert city_timeslots.find_in_window(8, 13) == [(8, 10), (9, 11), (10, 13), (12, 13)]
+    assert city_timeslots.find_in_window(13, 14) == []
@@ -0,0 +1,207 @@
+from bisect import bisect_left
+from collections import deque
+
+
+class CityTimeslots:
+    # available timeslots of a city grouped by time range (start_time, end_time) and sorted by start time, time ranges
+    # that fit in a preferred window are found by bisection
+    __slots__ = ('time_ranges', 'start_times', 'timeslot_ids')
+
+    def __init__(self, timeslots):
+        # timeslots - list of (start_time, end_time, timeslot_id)
+        self.timeslot_ids = {}  # (start_time, end_time) -> list of timeslot ids
+        for start_time, end_time, timeslot_id in sorted(timeslots):
+            self.timeslot_ids.setdefault((start_time, end_time), []).append(timeslot_id)
+        self.time_ranges = sorted(self.timeslot_ids)
+        self.start_times = [start_time for start_time, _ in self.time_ranges]
+
+    def find_in_window(self, window_start_time, window_end_time):
+        # returns time ranges that start and end within the window, by start time
+        time_ranges = []
+        for start_time, end_time in self.time_ranges[bisect_left(self.start_times, window_start_time):]:
+            if start_time >= window_end_time:
+                break
+            if end_time <= window_end_time:
+                time_ranges.append((start_time, end_time))
+        return time_ranges
+
+
+class AssignmentGraph:
+    # flow network source -> request class -> timeslot group -> timeslot -> courier date -> sink. A timeslot group is
+    # the timeslots a request can not tell apart (e.g. same city and time range), a request class is the requests with
+    # the same candidate groups in the same preference order, so the network stays small when many requests or
+    # timeslots are alike. Capacities of timeslot and courier date edges are their remaining deliveries, a maximum flow
+    # assigns the largest number of requests without exceeding any of them. Edge e and its residual edge are stored
+    # at e and e ^ 1
+    def __init__(self, timeslot_capacities, timeslot_courier_dates, courier_date_capacities):
+        self.edge_targets        = []
+        self.edge_capacities     = []
+        self.node_edges          = [[], []]     # node 0 is source, node 1 is sink
+        self.timeslot_capacities = timeslot_capacities
+        self.timeslot_nodes      = {}
+        self.group_nodes         = {}           # group key -> node
+        self.group_edges         = {}           # group key -> list of (edge, timeslot_id)
+        self.classes             = {}           # tuple of group keys -> RequestClass
+        self.request_classes     = []           # per request, its RequestClass
+        courier_date_nodes       = {}
+        for courier_date, capacity in courier_date_capacities.items():
+            if capacity > 0:
+                courier_date_nodes[courier_date] = self.add_node()
+                self.add_edge(courier_date_nodes[courier_date], 1, capacity)
+
+        for timeslot_id, capacity in timeslot_capacities.items():
+            courier_date_node = courier_date_nodes.get(timeslot_courier_dates[timeslot_id])
+            if capacity > 0 and courier_date_node is not None:
+                self.timeslot_nodes[timeslot_id] = self.add_node()
+                self.add_edge(self.timeslot_nodes[timeslot_id], courier_date_node, capacity)
+
+
+    def add_node(self):
+        self.node_edges.append([])
+        return len(self.node_edges) - 1
+
+
+    def add_edge(self, from_node, to_node, capacity):
+        self.node_edges[from_node].append(len(self.edge_targets))
+        self.edge_targets.append(to_node)
+        self.edge_capacities.append(capacity)
+        self.node_edges[to_node].append(len(self.edge_targets))
+        self.edge_targets.append(from_node)
+        self.edge_capacities.append(0)
+        return len(self.edge_targets) - 2
+
+
+    def add_group(self, group_key, timeslot_ids):
+        # timeslot ids of a group are in preference order, unknown and full timeslots are skipped
+        if group_key not in self.group_nodes:
+            self.group_nodes[group_key] = group_node = self.add_node()
+            self.group_edges[group_key] = [(self.add_edge(group_node, self.timeslot_nodes[timeslot_id],
+                                                          self.timeslot_capacities[timeslot_id]), timeslot_id)
+                                           for timeslot_id in timeslot_ids if timeslot_id in self.timeslot_nodes]
+
+
+    def add_request(self, candidate_group_keys):
+        # candidate groups (added with add_group) are in preference order
+        class_key = tuple(candidate_group_keys)
+        request_class = self.classes.get(class_key)
+        if request_class is None:
+            class_node = self.add_node()
+            request_class = self.classes[class_key] = RequestClass(
+                self.add_edge(0, class_node, 0),
+                [(self.add_edge(class_node, self.group_nodes[group_key], 0), group_key) for group_key in class_key])
+
+        # a class edge can carry every request of the class
+        for edge in [request_class.source_edge] + [edge for edge, _ in request_class.group_edges]:
+            self.edge_capacities[edge] += 1
+        self.request_classes.append(request_class)
+
+
+    def solve(self):
+        # returns assigned timeslot id (None if request is not assigned) per request, in order of add_request. Requests
+        # of a class are assigned in request order, so a class short of capacity leaves its last requests unassigned
+        self.assign_greedily()
+        while self.build_levels():
+            while self.augment():
+                pass
+
+        # flow of an edge is the capacity of its residual edge
+        edge_capacities = self.edge_capacities
+        group_timeslot_ids = {group_key: deque(timeslot_id for edge, timeslot_id in group_edges
+                                               for _ in range(edge_capacities[edge ^ 1]))
+                              for group_key, group_edges in self.group_edges.items()}
+        class_timeslot_ids = {}
+        for request_class in self.classes.values():
+            class_timeslot_ids[request_class] = timeslot_ids = deque()
+            for edge, group_key in request_class.group_edges:
+                for _ in range(edge_capacities[edge ^ 1]):
+                    timeslot_ids.append(group_timeslot_ids[group_key].popleft())
+
+        return [class_timeslot_ids[request_class].popleft() if class_timeslot_ids[request_class] else None
+                for request_class in self.request_classes]
+
+
+    def assign_greedily(self):
+        # classes are assigned in order of their first request to their most preferred timeslots with capacity left,
+        # augmenting paths then only reassign requests where that left capacity stranded. Timeslots that ran out of
+        # capacity are skipped for good, capacities only decrease here
+        edge_targets, edge_capacities, node_edges = self.edge_targets, self.edge_capacities, self.node_edges
+        group_positions = dict.fromkeys(self.group_edges, 0)
+        for request_class in self.classes.values():
+            source_edge = request_class.source_edge
+            for class_edge, group_key in request_class.group_edges:
+                group_edges = self.group_edges[group_key]
+                position = group_positions[group_key]
+                while edge_capacities[source_edge] > 0 and position < len(group_edges):
+                    group_edge        = group_edges[position][0]
+                    timeslot_edge     = node_edges[edge_targets[group_edge]][0]
+                    courier_date_edge = node_edges[edge_targets[timeslot_edge]][0]
+                    amount = min(edge_capacities[source_edge], edge_capacities[group_edge],
+                                 edge_capacities[timeslot_edge], edge_capacities[courier_date_edge])
+                    if amount == 0:
+                        position += 1
+                        continue
+
+                    for edge in (source_edge, class_edge, group_edge, timeslot_edge, courier_date_edge):
+                        edge_capacities[edge]     -= amount
+                        edge_capacities[edge ^ 1] += amount
+                group_positions[group_key] = position
+
+
+    def build_levels(self):
+        # BFS levels of Dinic's algorithm over edges with capacity left, returns True if sink is reachable
+        edge_targets, edge_capacities, node_edges = self.edge_targets, self.edge_capacities, self.node_edges
+        self.levels = levels = [-1] * len(node_edges)
+        self.next_edge_positions = [0] * len(node_edges)
+        levels[0] = 0
+        nodes = deque([0])
+        while nodes:
+            node = nodes.popleft()
+            for edge in node_edges[node]:
+                target = edge_targets[edge]
+                if edge_capacities[edge] > 0 and levels[target] < 0:
+                    levels[target] = levels[node] + 1
+                    nodes.append(target)
+        return levels[1] >= 0
+
+
+    def augment(self):
+        # pushes the bottleneck capacity along a source to sink path of increasing levels (iterative DFS), returns
+        # False if there is none. Dead ends are removed from the level graph, so each phase scans every edge once
+        edge_targets, edge_capacities, node_edges = self.edge_targets, self.edge_capacities, self.node_edges
+        levels, next_edge_positions = self.levels, self.next_edge_positions
+        nodes, path_edges = [0], []
+        while nodes:
+            node = nodes[-1]
+            if node == 1:
+                amount = min(edge_capacities[edge] for edge in path_edges)
+                for edge in path_edges:
+                    edge_capacities[edge]     -= amount
+                    edge_capacities[edge ^ 1] += amount
+                return True
+
+            edges = node_edges[node]
+            position = next_edge_positions[node]
+            while position < len(edges):
+                edge = edges[position]
+                if edge_capacities[edge] > 0 and levels[edge_targets[edge]] == levels[node] + 1:
+                    break
+                position += 1
+            next_edge_positions[node] = position
+            if position < len(edges):
+                nodes.append(edge_targets[edge])
+                path_edges.append(edge)
+            else:   # dead end
+                levels[node] = -1
+                nodes.pop()
+                if path_edges:
+                    path_edges.pop()
+                    next_edge_positions[nodes[-1]] += 1
+        return False
+
+
+class RequestClass:
+    __slots__ = ('source_edge', 'group_edges')
+
+    def __init__(self, source_edge, group_edges):
+        self.source_edge = source_edge
+        self.group_edges = group_edges  # list of (edge, group key) in preference order
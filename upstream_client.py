@@ -0,0 +1,213 @@
+import random
+import threading
+import time
+from metrics import metrics, span
+
+# outbound calls to upstream APIs (Geocoding, Holiday API) go through an UpstreamClient per API. It limits the call
+# rate (token bucket), bounds every attempt with a timeout and the whole call with a deadline, retries transient errors
+# with jittered exponential backoff and stops calling an upstream that keeps failing (circuit breaker), so a slow or
+# failing upstream costs a request thread at most deadline_seconds. Callers serve cached or degraded results on
+# UpstreamUnavailableError
+
+# pooled session shared by all upstream clients, connections are kept alive between requests. Created on first use
+session      = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    # requests is imported with the first upstream call, so startup does not pay for it
+    global session
+    with session_lock:
+        if session is None:
+            import requests
+            session = requests.Session()
+            for prefix in ('https://', 'http://'):
+                session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        return session
+
+
+def get_json(url, params, timeout):
+    # single attempt, HTTP error statuses are raised (requests.HTTPError)
+    response = get_session().get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def is_transient_error(error):
+    # connection errors, timeouts, 5xx and 429 responses are retried and count as upstream failures. Other errors
+    # (4xx, invalid response) mean the upstream answered, retrying will not help
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code is not None:
+        return status_code >= 500 or status_code == 429
+
+    return isinstance(error, OSError)   # requests exceptions are OSErrors
+
+
+class UpstreamUnavailableError(Exception):
+    # call was rejected without accessing the upstream (reason 'rate_limited' or 'circuit_open'), or all attempts
+    # failed (reason 'failed', last error is the __cause__)
+    def __init__(self, api, reason):
+        super().__init__('{} is not available ({})'.format(api, reason))
+        self.api    = api
+        self.reason = reason
+
+
+class TokenBucket:
+    # allows rate_per_second calls on average and bursts of up to burst calls
+    def __init__(self, rate_per_second, burst):
+        self.rate_per_second = rate_per_second
+        self.burst           = burst
+        self._tokens         = burst
+        self._updated_at     = time.monotonic()
+        self._lock           = threading.Lock()
+
+
+    def acquire(self, max_wait_seconds=0):
+        # takes a token, waits up to max_wait_seconds for one. Returns False if no token is available in time
+        deadline = time.monotonic() + max_wait_seconds
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens     = min(self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+
+                wait_seconds = (1 - self._tokens) / self.rate_per_second
+            if now + wait_seconds > deadline:
+                return False
+
+            time.sleep(wait_seconds)
+
+
+class CircuitBreaker:
+    # opens after failure_threshold consecutive failures, calls are rejected while open. After reset_timeout_seconds a
+    # single trial call is let through (half open), its success closes the circuit and its failure opens it again
+    closed    = 'closed'
+    open      = 'open'
+    half_open = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout_seconds):
+        self.failure_threshold     = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.state                 = CircuitBreaker.closed
+        self._num_of_failures      = 0
+        self._opened_at            = None
+        self._trial_in_flight      = False
+        self._lock                 = threading.Lock()
+
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == CircuitBreaker.closed:
+                return True
+
+            if self.state == CircuitBreaker.open and time.monotonic() - self._opened_at >= self.reset_timeout_seconds:
+                self.state            = CircuitBreaker.half_open
+                self._trial_in_flight = False
+            if self.state == CircuitBreaker.half_open and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+
+            return False
+
+
+    def is_open(self):
+        # True while calls are rejected, checked before waiting for a rate limit token
+        with self._lock:
+            if self.state == CircuitBreaker.open:
+                return time.monotonic() - self._opened_at < self.reset_timeout_seconds
+
+            return self.state == CircuitBreaker.half_open and self._trial_in_flight
+
+
+    def record_success(self):
+        with self._lock:
+            self.state            = CircuitBreaker.closed
+            self._num_of_failures = 0
+            self._trial_in_flight = False
+
+
+    def record_failure(self):
+        with self._lock:
+            self._num_of_failures += 1
+            if self.state == CircuitBreaker.half_open or self._num_of_failures >= self.failure_threshold:
+                self.state            = CircuitBreaker.open
+                self._opened_at       = time.monotonic()
+                self._trial_in_flight = False
+
+
+class UpstreamClient:
+    # api names the phase_duration_seconds span and the label of upstream_* counters
+    def __init__(self, api, rate_per_second, burst, timeout_seconds, deadline_seconds, max_attempts=3,
+                 backoff_seconds=0.1, max_wait_seconds=1, failure_threshold=5, reset_timeout_seconds=10):
+        self.api              = api
+        self.timeout_seconds  = timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts     = max_attempts
+        self.backoff_seconds  = backoff_seconds
+        self.max_wait_seconds = max_wait_seconds    # wait for a rate limit token, then the call is rejected
+        self.rate_limiter     = TokenBucket(rate_per_second, burst)
+        self.circuit_breaker  = CircuitBreaker(failure_threshold, reset_timeout_seconds)
+
+
+    def call(self, request_func):
+        # request_func(timeout) makes a single attempt and returns its result. Raises UpstreamUnavailableError if the
+        # call was rejected or failed, non transient errors are raised as is
+        deadline = time.monotonic() + self.deadline_seconds
+        with span(self.api):
+            for attempt in range(self.max_attempts):
+                try:
+                    self.acquire(min(self.max_wait_seconds, max(0, deadline - time.monotonic())))
+                except UpstreamUnavailableError:
+                    if attempt == 0:
+                        raise
+                    break   # circuit opened by failures of this call or concurrent calls
+
+                try:
+                    result = request_func(max(0.001, min(self.timeout_seconds, deadline - time.monotonic())))
+                except Exception as e:
+                    self.record_failure(e)
+                    if not is_transient_error(e):
+                        raise
+
+                    last_error = e
+                    # jitter spreads retries of concurrent callers, same as commit_with_retry
+                    delay_seconds = self.backoff_seconds * 2 ** attempt * random.uniform(0.5, 1.5)
+                    if attempt + 1 == self.max_attempts or time.monotonic() + delay_seconds >= deadline:
+                        break
+
+                    metrics.increment('upstream_retries_total', api=self.api)
+                    time.sleep(delay_seconds)
+                    continue
+
+                self.circuit_breaker.record_success()
+                return result
+
+        raise UpstreamUnavailableError(self.api, 'failed') from last_error
+
+
+    def acquire(self, max_wait_seconds=0):
+        # checks rate limit and circuit breaker before an attempt, raises UpstreamUnavailableError if the attempt can
+        # not be made. Callers that make their own attempts (async timeslot search) record the result of each attempt
+        if self.circuit_breaker.is_open():
+            reason = 'circuit_open'
+        elif not self.rate_limiter.acquire(max_wait_seconds):
+            reason = 'rate_limited'
+        elif not self.circuit_breaker.allow_request():
+            reason = 'circuit_open'
+        else:
+            return
+
+        metrics.increment('upstream_rejected_total', api=self.api, reason=reason)
+        raise UpstreamUnavailableError(self.api, reason)
+
+
+    def record_failure(self, error=None):
+        # error None is a transient failure. A non transient error is a working upstream for the circuit breaker
+        metrics.increment('upstream_errors_total', api=self.api)
+        if error is None or is_transient_error(error):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()